@@ -22,15 +22,24 @@ from ConfigParser import ConfigParser
 
 import parxe.engines.seq
 import parxe.engines.local
+import parxe.engines.batch
+import parxe.engines.remote
 
-# from parxe.planner import planner
-# from parxe.dmap import dmap
-from parxe.common import Singleton, cache
+from parxe.planner import planner
+from parxe.dmap import dmap, dimap, dmap_unordered, dreduce
+from parxe.future import as_completed, wait_all, wait_any
+from parxe.common import Singleton, cache, memoize
+from parxe.results_cache import ResultsCache
 
 DEFAULT_CONFIG_FOLDER = '.pyparxe'
 DEFAULT_CONFIG_FILENAME = 'config.ini'
 MAIN_SECTION = 'main'
 ENGINE_OPTION = 'engine'
+RESULTS_CACHE_DIR_OPTION = 'results_cache_dir'
+RESULTS_CACHE_MAX_BYTES_OPTION = 'results_cache_max_bytes'
+SPECULATIVE_PERCENTILE_OPTION = 'speculative_percentile'
+RETRIES_OPTION = 'retries'
+RETRY_BACKOFF_OPTION = 'retry_backoff'
 
 DEFAULT_CONFIG_PATH = os.path.join(
     os.getenv('HOME', '/etc/'),
@@ -39,12 +48,14 @@ DEFAULT_CONFIG_PATH = os.path.join(
 )
 
 CONFIG_DEFAULTS = {
-    ENGINE_OPTION : parxe.engines.seq.get_instance,
+    ENGINE_OPTION : 'seq',
 }
 
 ENGINES = {
     'seq' : parxe.engines.seq.get_instance,
-    # 'local' : parxe.engines.local.get_instance,
+    'local' : parxe.engines.local.get_instance,
+    'batch' : parxe.engines.batch.get_instance,
+    'remote' : parxe.engines.remote.get_instance,
 }
 
 @Singleton
@@ -52,10 +63,14 @@ class Configuration(object):
     def __init__(self):
         self._engine = None
 
-    # TODO: Control engine set when it has been started
     def set_engine(self, engine):
-        """Sets the engine given the engine string"""
-        self._engine = ENGINES[engine]()
+        """Sets the engine given the engine string or an engine instance"""
+        if planner.started():
+            raise RuntimeError("The engine cannot be changed after start()")
+        if isinstance(engine, str):
+            self._engine = ENGINES[engine]()
+        else:
+            self._engine = engine
 
     @property
     def engine(self):
@@ -69,24 +84,75 @@ def _as_dict(options_list):
 def _construct_config_parser(config_path):
     reader = ConfigParser(defaults=CONFIG_DEFAULTS)
     reader.read(config_path)
+    if not reader.has_section(MAIN_SECTION):
+        reader.add_section(MAIN_SECTION)
     return reader
 
 def _load_configuration(config_path=DEFAULT_CONFIG_PATH,
                         engine=None):
     """Loads the configuration stored at config_path
 
-    The engine argument allow to overwrite its corresponding option.
+    The engine argument allow to overwrite its corresponding option. When
+    engine is None and an engine instance has been given to set_engine(),
+    this instance is used as is.
     """
     reader = cache(_construct_config_parser, config_path)
+    conf = Configuration.get_instance()
     if engine is not None:
         assert isinstance(engine, str), "engine should be a string"
-        reader.set(MAIN_SECTION, engine)
+        reader.set(MAIN_SECTION, ENGINE_OPTION, engine)
         engine_str = engine
-    else:
+    elif conf.engine is None:
         engine_str = reader.get(MAIN_SECTION, ENGINE_OPTION)
-    conf = Configuration.get_instance()
+    else:
+        return
     conf.set_engine(engine_str)
-    conf.engine.set_options(_as_dict(reader.items(engine_str)))
+    if reader.has_section(engine_str):
+        conf.engine.set_options(_as_dict(reader.items(engine_str)))
+
+def _load_results_cache(config_path=DEFAULT_CONFIG_PATH):
+    """Returns the ResultsCache given at main section of config_path, or
+    None when results_cache_dir option is not present."""
+    reader = cache(_construct_config_parser, config_path)
+    if not reader.has_option(MAIN_SECTION, RESULTS_CACHE_DIR_OPTION):
+        return None
+    directory = reader.get(MAIN_SECTION, RESULTS_CACHE_DIR_OPTION)
+    if reader.has_option(MAIN_SECTION, RESULTS_CACHE_MAX_BYTES_OPTION):
+        max_bytes = reader.getint(MAIN_SECTION,
+                                  RESULTS_CACHE_MAX_BYTES_OPTION)
+        return ResultsCache(os.path.expanduser(directory), max_bytes)
+    return ResultsCache(os.path.expanduser(directory))
+
+def _load_speculative_percentile(config_path=DEFAULT_CONFIG_PATH):
+    """Returns the speculative_percentile option at main section of
+    config_path, or None when it is not present."""
+    reader = cache(_construct_config_parser, config_path)
+    if not reader.has_option(MAIN_SECTION, SPECULATIVE_PERCENTILE_OPTION):
+        return None
+    return reader.getfloat(MAIN_SECTION, SPECULATIVE_PERCENTILE_OPTION)
+
+def _load_retries(config_path=DEFAULT_CONFIG_PATH):
+    """Returns a dictionary with retries and retry_backoff arguments of
+    Planner.start() given at main section of config_path."""
+    reader = cache(_construct_config_parser, config_path)
+    kwargs = {}
+    if reader.has_option(MAIN_SECTION, RETRIES_OPTION):
+        kwargs["retries"] = reader.getint(MAIN_SECTION, RETRIES_OPTION)
+    if reader.has_option(MAIN_SECTION, RETRY_BACKOFF_OPTION):
+        kwargs["retry_backoff"] = reader.getfloat(MAIN_SECTION,
+                                                  RETRY_BACKOFF_OPTION)
+    return kwargs
+
+def set_engine(engine):
+    """Sets the engine used by start().
+
+    Parameters
+        engine : string or EngineInterface instance
+
+    An engine string loads its options from the configuration file at
+    start(), an engine instance is used as is.
+    """
+    Configuration.get_instance().set_engine(engine)
 
 def start(config_path=DEFAULT_CONFIG_PATH, engine=None):
     """Starts the parallel tasks planner with an optionally given engine.
@@ -100,9 +166,36 @@ def start(config_path=DEFAULT_CONFIG_PATH, engine=None):
     at set_engine() method or the default selected engine.
     The engine cannot be changed after start() call, unless calling
     stop() function.
+
+    When the main section of the configuration file contains the
+    results_cache_dir option, results of tasks are stored in this
+    directory and reused by following executions of the same tasks.
+
+    When the main section contains the speculative_percentile option,
+    tasks slower than this percentile of finished tasks are executed
+    again, see Planner.start().
+
+    The retries and retry_backoff options of the main section set how
+    many times failed tasks are executed again, see Planner.start().
     """
     _load_configuration(config_path, engine)
-    planner.start(engine=Configuration.get_instance().engine)
+    planner.start(
+        engine=Configuration.get_instance().engine,
+        results_cache=_load_results_cache(config_path),
+        speculative_percentile=_load_speculative_percentile(config_path),
+        **_load_retries(config_path)
+    )
+
+def broadcast(obj):
+    """Returns a handle to obj which is pickled with tasks instead of obj.
+
+    Parameters
+        obj : any picklable object
+
+    Tasks obtain obj calling get() on the handle, and every worker loads
+    it only once, see Planner.broadcast(). The planner should be started.
+    """
+    return planner.broadcast(obj)
 
 def stop():
     """Stops the planner process.
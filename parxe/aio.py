@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Integration of PARXE futures with asyncio event loops.
+
+Futures are bridged to the event loop with done callbacks: when a PARXE
+future is finished, the thread finishing it schedules the copy of its
+state into an asyncio future by means of loop.call_soon_threadsafe(), so
+no thread waits for any future and thousands of tasks can be awaited
+from one event loop:
+
+    result = yield From(parxe.aio.enqueue(func, [x]))
+    result = yield From(parxe.aio.wrap_future(future))
+
+Cancelling the asyncio future aborts the PARXE one. This module requires
+asyncio, or its trollius backport, which is optional for the rest of
+PARXE."""
+
+from parxe.dmap import dmap as _dmap
+from parxe.planner import planner
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+def _check_asyncio():
+    if asyncio is None:
+        raise ImportError("parxe.aio requires asyncio or trollius module")
+
+def _copy_state(future, aio_future):
+    """Gives the result, error or abort of future to aio_future, executed
+    by the event loop."""
+    if aio_future.cancelled():
+        return
+    if future.aborted():
+        aio_future.cancel()
+        return
+    try:
+        result = future.get()
+    except Exception as exc:
+        aio_future.set_exception(exc)
+    else:
+        aio_future.set_result(result)
+
+def wrap_future(future, loop=None):
+    """wrap_future(future : Future, loop=None) -> asyncio.Future
+
+    Returns an asyncio future of the given event loop, by default the
+    current one, which is finished with the result of the given PARXE
+    future. Cancelling the returned future aborts the PARXE one.
+    """
+    _check_asyncio()
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    aio_future = asyncio.Future(loop=loop)
+    def on_aio_done(aio_future):
+        if aio_future.cancelled():
+            future.abort()
+    aio_future.add_done_callback(on_aio_done)
+    future.add_done_callback(
+        lambda fut: loop.call_soon_threadsafe(_copy_state, fut, aio_future)
+    )
+    return aio_future
+
+def enqueue(func, args=[], kwargs={}, loop=None, **options):
+    """enqueue(func, args=[], kwargs={}, loop=None, **options)
+        -> asyncio.Future
+
+    Asynchronous version of Planner.enqueue(), options are given to it.
+    """
+    return wrap_future(planner.enqueue(func, args, kwargs, **options), loop)
+
+def dmap(func, iterable, loop=None, **options):
+    """dmap(func, iterable, loop=None, **options) -> asyncio.Future
+
+    Asynchronous version of dmap(), options are given to it.
+    """
+    return wrap_future(_dmap(func, iterable, **options), loop)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""This module implements the broadcast of large objects to workers.
+
+An object used by many tasks, as a model or a lookup table, is pickled once
+into a file named by the hash of its content, and tasks receive a small
+Broadcast handle instead of the object. Every process loads the file the
+first time get() is called, and keeps the object in a store indexed by its
+hash, so following tasks executed by the same worker use it without loading
+it again:
+
+    model = parxe.broadcast(model)
+    dmap(functools.partial(predict, model), items) # predict calls model.get()
+"""
+
+import cPickle as pkl
+import collections
+import hashlib
+import os
+import tempfile
+
+from threading import Lock
+
+BROADCAST_SUFFIX = ".broadcast"
+# Number of objects kept by the store of every process
+MAX_OBJECTS = 8
+
+# Objects loaded by this process indexed by their hash, the least recently
+# used ones are evicted first
+_objects = collections.OrderedDict()
+_objects_lock = Lock()
+
+def _lookup(key):
+    """Returns the object of the given key from the store, or raises
+    KeyError."""
+    with _objects_lock:
+        obj = _objects.pop(key)
+        _objects[key] = obj
+        return obj
+
+def _insert(key, obj):
+    """Inserts obj into the store, evicting the least recently used
+    objects."""
+    with _objects_lock:
+        _objects.pop(key, None)
+        _objects[key] = obj
+        while len(_objects) > MAX_OBJECTS:
+            _objects.popitem(last=False)
+
+def clear():
+    """Removes every object from the store of this process."""
+    with _objects_lock:
+        _objects.clear()
+
+class Broadcast(object):
+    """A handle to an object stored by store(), which is pickled with
+    tasks arguments instead of the object."""
+    def __init__(self, key, path):
+        self._key = key
+        self._path = path
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def path(self):
+        return self._path
+
+    def get(self):
+        """get() -> object
+
+        Returns the object of this handle, which is loaded from its file
+        only when it is not in the store of this process.
+        """
+        try:
+            return _lookup(self._key)
+        except KeyError:
+            pass
+        with open(self._path, "rb") as f:
+            obj = pkl.load(f)
+        _insert(self._key, obj)
+        return obj
+
+def store(obj, directory):
+    """store(obj, directory : str) -> Broadcast
+
+    Pickles obj into a file of the given directory, named by the hash of
+    its content, and returns its Broadcast handle. Equal objects share the
+    same file, which is written only once.
+    """
+    data = pkl.dumps(obj, pkl.HIGHEST_PROTOCOL)
+    key = hashlib.sha1(data).hexdigest()
+    path = os.path.join(directory, key + BROADCAST_SUFFIX)
+    if not os.path.exists(path):
+        # workers never read partially written files
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+    _insert(key, obj)
+    return Broadcast(key, path)
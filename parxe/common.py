@@ -3,15 +3,45 @@
 
 import os
 import cPickle as pkl
+import collections
+import ctypes
+import functools
 import logging as log
 import os
+import struct
+import sys
 import tempfile
+import threading
+import traceback
 
-from time import sleep, time
+from cStringIO import StringIO
+from time import time
+
+import nanomsg as nmsg
+
+from parxe.notifier import get_notifier
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 DEFAULT_POPEN_BUFSIZE = 4096
 DEFAULT_FILESYSTEM_TIMEOUT = 60 # seconds
 DEFAULT_FILESYSTEM_WAIT_STEP = 1 # seconds
+DEFAULT_CACHE_MAX_ENTRIES = 4096
+
+# Engine option which selects the function used to serialize messages
+SERIALIZER_OPTION = "serializer"
+PICKLE_SERIALIZER = "pickle"
+OUT_OF_BAND_SERIALIZER = "out_of_band"
+# Out-of-band messages start with a byte which is not a pickle opcode
+OUT_OF_BAND_MAGIC = b"\xffPXOB"
+# NumPy arrays smaller than this are pickled as usual
+OUT_OF_BAND_MIN_BYTES = 64 * 1024
+# Alignment of buffers inside out-of-band messages
+OUT_OF_BAND_ALIGNMENT = 16
+_LENGTH_FORMAT = "!Q"
 
 def overrides(interface_class):
     """Throws error if the method doesn't exists"""
@@ -63,6 +93,32 @@ def popen(cmd, mode="r"):
     """Executes the given command string using a shell"""
     return os.popen(cmd, mode, DEFAULT_POPEN_BUFSIZE)
 
+class TaskError(Exception):
+    """An exception raised by a task function in a worker.
+
+    The exception itself is not transported, it may not be serializable,
+    so this class keeps its type name, its message and the formatted
+    traceback of the worker.
+    """
+    def __init__(self, type_name, message, remote_traceback):
+        super(TaskError, self).__init__(type_name, message, remote_traceback)
+        self.type_name = type_name
+        self.message = message
+        self.remote_traceback = remote_traceback
+
+    def __str__(self):
+        return "{}: {}\n\nRemote traceback:\n{}".format(
+            self.type_name, self.message, self.remote_traceback
+        )
+
+def capture_error():
+    """Returns a serializable description of the exception being handled,
+    which is given as error field of task replies."""
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    return (exc_type.__name__, str(exc_value),
+            "".join(traceback.format_exception(exc_type, exc_value,
+                                               exc_traceback)))
+
 def mktempfile():
     """Returns a file handler and its file name hash"""
     f_handler = tempfile.NamedTemporaryFile()
@@ -73,9 +129,129 @@ def serialize(obj, socket):
     """Serializes the given object through the given SP socket"""
     socket.send(pkl.dumps(obj))
 
+def _is_out_of_band(obj):
+    """Indicates if obj is a large contiguous NumPy array"""
+    return (np is not None and type(obj) is np.ndarray and
+            not obj.dtype.hasobject and
+            obj.nbytes >= OUT_OF_BAND_MIN_BYTES and
+            (obj.flags.c_contiguous or obj.flags.f_contiguous))
+
+def _align(offset):
+    """Rounds up offset to a multiple of OUT_OF_BAND_ALIGNMENT"""
+    return -(-offset // OUT_OF_BAND_ALIGNMENT) * OUT_OF_BAND_ALIGNMENT
+
+def dumps_out_of_band(obj):
+    """Splits obj in parts for its out-of-band serialization.
+
+    Returns a tuple (parts, offsets, size), where parts is a list of
+    buffers which should be written at the given offsets of a message of
+    the given size. The message is composed by OUT_OF_BAND_MAGIC, the
+    number of parts, the length of every one and the parts themselves: first
+    one is the pickle of obj where large arrays are replaced by
+    persistent ids, followed by the raw data of every array. The first
+    buffer contains the magic and the lengths, so len(parts) == 2 means
+    that no array has been found.
+    """
+    arrays = []
+    def persistent_id(value):
+        if _is_out_of_band(value):
+            arrays.append(value)
+            return ("ndarray", len(arrays) - 1, value.dtype, value.shape,
+                    not value.flags.c_contiguous)
+        return None
+    stream = StringIO()
+    pickler = pkl.Pickler(stream, pkl.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    header = stream.getvalue()
+    lengths = [len(header)] + [arr.nbytes for arr in arrays]
+    prefix = (OUT_OF_BAND_MAGIC +
+              struct.pack(_LENGTH_FORMAT, len(lengths)) +
+              struct.pack("!%dQ" % len(lengths), *lengths))
+    offsets = [0]
+    offset = len(prefix)
+    for length in lengths:
+        offset = _align(offset)
+        offsets.append(offset)
+        offset += length
+    return [prefix, header] + arrays, offsets, offset
+
+def serialize_out_of_band(obj, socket):
+    """Serializes the given object through the given SP socket, sending
+    large NumPy arrays out of the pickle stream.
+
+    See dumps_out_of_band() for the message format. Array data is copied
+    only once, into the message buffer given to nanomsg.
+    """
+    parts, offsets, size = dumps_out_of_band(obj)
+    msg = (ctypes.c_ubyte * size)()
+    address = ctypes.addressof(msg)
+    for part, offset in zip(parts[:2], offsets):
+        ctypes.memmove(address + offset, part, len(part))
+    for arr, offset in zip(parts[2:], offsets[2:]):
+        ctypes.memmove(address + offset, arr.ctypes.data, arr.nbytes)
+    socket.send(msg)
+
+def loads_out_of_band(msg):
+    """Rebuilds an object from a message serialized out of band.
+
+    Arrays are views over msg buffer, so they are read-only when msg is a
+    read-only buffer.
+    """
+    pos = len(OUT_OF_BAND_MAGIC)
+    num_parts, = struct.unpack_from(_LENGTH_FORMAT, msg, pos)
+    pos += struct.calcsize(_LENGTH_FORMAT)
+    lengths = struct.unpack_from("!%dQ" % num_parts, msg, pos)
+    pos += struct.calcsize("!%dQ" % num_parts)
+    offsets = []
+    for length in lengths:
+        pos = _align(pos)
+        offsets.append(pos)
+        pos += length
+    def persistent_load(pid):
+        _, index, dtype, shape, fortran = pid
+        arr = np.frombuffer(msg, dtype=dtype,
+                            count=lengths[index + 1] // dtype.itemsize,
+                            offset=offsets[index + 1])
+        return arr.reshape(shape, order="F" if fortran else "C")
+    unpickler = pkl.Unpickler(StringIO(buffer(msg, offsets[0], lengths[0])))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+def _recv(socket):
+    """Receives a message from the given SP socket.
+
+    For nanomsg sockets the message buffer allocated by nanomsg is
+    returned, avoiding copies of the data.
+    """
+    if isinstance(socket, nmsg.Socket):
+        rtn, msg = nmsg.wrapper.nn_recv(socket.fd, 0)
+        if rtn < 0:
+            raise nmsg.NanoMsgAPIError()
+        return msg
+    return socket.recv()
+
 def deserialize(socket):
-    """Deserializes one object from the given SP socket"""
-    return pkl.loads(socket.recv())
+    """Deserializes one object from the given SP socket.
+
+    Messages from serialize() and serialize_out_of_band() are supported.
+    """
+    msg = _recv(socket)
+    if buffer(msg, 0, len(OUT_OF_BAND_MAGIC))[:] == OUT_OF_BAND_MAGIC:
+        return loads_out_of_band(msg)
+    if not isinstance(msg, str):
+        msg = buffer(msg)[:]
+    return pkl.loads(msg)
+
+SERIALIZERS = {
+    PICKLE_SERIALIZER : serialize,
+    OUT_OF_BAND_SERIALIZER : serialize_out_of_band,
+}
+
+def get_serializer(options):
+    """Returns the serialize function selected by SERIALIZER_OPTION in the
+    given options dictionary, by default serialize()."""
+    return SERIALIZERS[options.get(SERIALIZER_OPTION, PICKLE_SERIALIZER)]
 
 def wait_until_exists(filename,
                       timeout=DEFAULT_FILESYSTEM_TIMEOUT,
@@ -84,19 +260,20 @@ def wait_until_exists(filename,
 
     Depending on NFS synchronization or similar shared disk storage
     drivers, it can be necessary to wait for a filename to exists.
-    """
 
+    Files in local filesystems are notified by inotify as soon as they
+    are created, and files in network filesystems are checked by the
+    notifier thread every wait_step seconds at most.
+    """
+    if os.path.isfile(filename):
+        return True
     t0 = time()
-    timedout = False
-    while not os.path.isfile(filename) and not timedout:
-        log.info("Waiting disk sync: %.0f more seconds, %.0f seconds elapsed",
-                 wait_step, time() - t0)
-        sleep(wait_step)
-        if time() - t0 > timeout:
-            log.warning("File system wait timedout!")
-            timedout = True
-        wait_step *= 2.0
-    return not timedout
+    log.info("Waiting disk sync: %s", filename)
+    if not get_notifier().wait(filename, timeout, wait_step):
+        log.warning("File system wait timedout! %.0f seconds elapsed",
+                    time() - t0)
+        return False
+    return True
 
 def convert_to_inmutable(arg):
     if isinstance(arg, list) or isinstance(arg, tuple):
@@ -105,19 +282,154 @@ def convert_to_inmutable(arg):
     else:
         return arg
 
-@Singleton
-class _Cache(object):
-    def __init__(self):
-        self._cache = {}
-
-    def __call__(self, func, *args):
-        import sys
-        func_cache = self._cache.setdefault(func, {})
-        inmutable_args = convert_to_inmutable(args)
-        if inmutable_args not in func_cache:
-            func_cache[inmutable_args] = func(*args)
-        return func_cache[inmutable_args]
-
-def cache(*args):
-    cache_instance = _Cache.get_instance()
-    return cache_instance(*args)
+class CacheStats(object):
+    """Counters of a function in a Cache object."""
+    def __init__(self, hits=0, misses=0, evictions=0):
+        self.hits = hits
+        self.misses = misses
+        self.evictions = evictions
+
+    def copy(self):
+        return CacheStats(self.hits, self.misses, self.evictions)
+
+    def __repr__(self):
+        return "CacheStats(hits={}, misses={}, evictions={})".format(
+            self.hits, self.misses, self.evictions)
+
+def _size_of(value):
+    """Estimates the memory used by value, NumPy arrays use nbytes."""
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, (int, long)):
+        return nbytes
+    return sys.getsizeof(value)
+
+class Cache(object):
+    """A thread-safe cache of function results.
+
+    Results are indexed by the function and its arguments, which should
+    be hashable once lists are converted into tuples. The cache is bounded
+    by max_entries and by max_bytes (as estimated by size_of function),
+    evicting the least recently used results, and results older than ttl
+    seconds are computed again. None disables any of these limits.
+
+    When several threads request the same result, it is computed only
+    once and the other threads wait for it. Hits, misses and evictions
+    are counted per function, see stats() method.
+    """
+    def __init__(self, max_entries=DEFAULT_CACHE_MAX_ENTRIES, max_bytes=None,
+                 ttl=None, size_of=_size_of):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._size_of = size_of
+        # key -> (value, expiration time, size), sorted from least to most
+        # recently used
+        self._entries = collections.OrderedDict()
+        self._num_bytes = 0
+        # key -> threading.Event of results being computed
+        self._computing = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _func_stats(self, func):
+        return self._stats.setdefault(func, CacheStats())
+
+    def _evict(self, key):
+        _, _, size = self._entries.pop(key)
+        self._num_bytes -= size
+        self._func_stats(key[0]).evictions += 1
+
+    def _lookup(self, key):
+        """Returns (True, value) for valid entries, (False, None) otherwise.
+
+        Valid entries become the most recently used."""
+        if key not in self._entries:
+            return False, None
+        value, expiration, size = self._entries.pop(key)
+        if expiration is not None and expiration < time():
+            self._num_bytes -= size
+            self._func_stats(key[0]).evictions += 1
+            return False, None
+        self._entries[key] = (value, expiration, size)
+        return True, value
+
+    def _insert(self, key, value):
+        expiration = time() + self._ttl if self._ttl is not None else None
+        size = self._size_of(value) if self._max_bytes is not None else 0
+        self._entries[key] = (value, expiration, size)
+        self._num_bytes += size
+        while self._entries and (
+                (self._max_entries is not None and
+                 len(self._entries) > self._max_entries) or
+                (self._max_bytes is not None and
+                 self._num_bytes > self._max_bytes)):
+            self._evict(next(iter(self._entries)))
+
+    def __call__(self, func, *args, **kwargs):
+        """Returns func(*args, **kwargs), computing it when not cached."""
+        key = (func, convert_to_inmutable(args),
+               tuple(sorted(convert_to_inmutable(kwargs.items()))))
+        while True:
+            with self._lock:
+                found, value = self._lookup(key)
+                if found:
+                    self._func_stats(func).hits += 1
+                    return value
+                event = self._computing.get(key)
+                if event is None:
+                    self._func_stats(func).misses += 1
+                    event = self._computing[key] = threading.Event()
+                    break
+            # another thread is computing the result
+            event.wait()
+        try:
+            value = func(*args, **kwargs)
+            with self._lock:
+                self._insert(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._computing[key]
+            event.set()
+
+    def stats(self, func):
+        """Returns a copy of the CacheStats of the given function."""
+        with self._lock:
+            return self._func_stats(func).copy()
+
+    def clear(self):
+        """Removes every result from the cache, keeping the stats."""
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+_default_cache = Cache()
+
+def cache(func, *args, **kwargs):
+    """Returns func(*args, **kwargs) using the default Cache object."""
+    return _default_cache(func, *args, **kwargs)
+
+def get_default_cache():
+    """Returns the Cache object used by cache() and memoize()."""
+    return _default_cache
+
+def memoize(func=None, cache=None):
+    """Decorator which caches the results of the decorated function.
+
+    It can be used as @memoize, which uses the default Cache object, or
+    as @memoize(cache=Cache(...)) with a particular Cache object. Memoized
+    functions can be given to engines, every worker process keeps its own
+    cache.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def memoized(*args, **kwargs):
+            func_cache = cache if cache is not None else _default_cache
+            return func_cache(func, *args, **kwargs)
+        return memoized
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -1,10 +1,211 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-"""
-Summary
+"""Distributed map over the planner engine.
+
+The iterable is split in chunks of contiguous items, and every chunk is
+executed as one task, avoiding the overhead of a task (and its
+serialization) per item. By default chunk sizes decrease along the
+iterable (guided scheduling): large chunks are enqueued first and the last
+ones are small, so workers finishing early take the remaining work in
+small pieces and a slow chunk at the end delays the result less.
 
-Description
+Results can be consumed as a future over the whole list with dmap(), or
+as they arrive with dimap() and dmap_unordered() generators.
+
+Distributed reduce, dreduce(), reduces every chunk in the engine and
+combines the partial results with a balanced tree of tasks.
 """
 
-def dmap(func, iterable):
-    
+import itertools
+import math
+import sys
+
+from parxe.common import overrides
+from parxe.future import Future, UnionFuture, as_completed
+from parxe.planner import planner
+
+# Number of chunks given to every engine slot, a value larger than one
+# allows to balance the load when tasks have different durations.
+CHUNKS_PER_SLOT = 4
+# Guided chunks take 1/(GUIDED_FACTOR*slots) of the remaining items, and
+# they are never smaller than 1/MIN_CHUNK_RATIO of the fixed chunk size
+GUIDED_FACTOR = 2
+MIN_CHUNK_RATIO = 4
+# Number of partial results combined by every dreduce() task
+DEFAULT_FANOUT = 4
+# Every call is a different submitter of the planner
+_submitter_ids = itertools.count()
+
+def _map_chunk(func, chunk):
+    """Executed by the engine, applies func to every item in chunk."""
+    return [func(x) for x in chunk]
+
+def _reduce_chunk(func, chunk):
+    """Executed by the engine, reduces the values in chunk with func."""
+    return reduce(func, chunk)
+
+def _reduce_values(func, *values):
+    """Executed by the engine, reduces the partial results of a group of
+    tasks with func."""
+    return reduce(func, values)
+
+def _chunk_size(num_items, num_slots):
+    """Returns a chunk size which gives CHUNKS_PER_SLOT chunks to every
+    engine slot."""
+    num_chunks = CHUNKS_PER_SLOT * max(1, num_slots)
+    return max(1, int(math.ceil(num_items / float(num_chunks))))
+
+def _guided_chunk_sizes(num_items, num_slots):
+    """Returns a list of decreasing chunk sizes which add up to num_items."""
+    num_slots = max(1, num_slots)
+    min_size = max(1, _chunk_size(num_items, num_slots) // MIN_CHUNK_RATIO)
+    sizes = []
+    remaining = num_items
+    while remaining > 0:
+        size = int(math.ceil(remaining / float(GUIDED_FACTOR * num_slots)))
+        size = min(remaining, max(min_size, size))
+        sizes.append(size)
+        remaining -= size
+    return sizes
+
+def _enqueue_chunks(func, iterable, chunksize, retries, priority,
+                    chunk_func=_map_chunk, submitter=None):
+    """Splits iterable in chunks and returns a list with the futures of
+    chunk_func(func, chunk) tasks."""
+    items = list(iterable)
+    if chunksize is None:
+        engine = planner.engine
+        num_slots = engine.get_max_tasks() if engine is not None else 1
+        sizes = _guided_chunk_sizes(len(items), num_slots)
+    else:
+        sizes = [chunksize] * int(math.ceil(len(items) / float(chunksize)))
+    if submitter is None:
+        submitter = ("dmap", next(_submitter_ids))
+    futures = []
+    start = 0
+    for size in sizes:
+        futures.append(planner.enqueue(chunk_func,
+                                       [func, items[start:start+size]],
+                                       retries=retries, priority=priority,
+                                       submitter=submitter))
+        start += size
+    return futures
+
+def dmap(func, iterable, chunksize=None, retries=None, priority=0):
+    """dmap(func, iterable, chunksize=None, retries=None, priority=0)
+        -> UnionFuture
+
+    Distributed version of map(). The result is given as a future over
+    the list [func(x) for x in iterable], preserving iterable order.
+
+    When chunksize is None, decreasing chunk sizes are computed from the
+    number of items and the number of concurrent tasks supported by the
+    engine. Failed chunks are executed again up to retries times, see
+    Planner.enqueue().
+
+    Chunks are enqueued with the given priority, and every call shares
+    the engine slots fairly with other calls of the same priority.
+    """
+    return UnionFuture(_enqueue_chunks(func, iterable, chunksize, retries,
+                                       priority),
+                       chain=True)
+
+def _values(futures):
+    """Yields the values of the given chunk futures."""
+    for fut in futures:
+        for value in fut.get():
+            yield value
+
+def dimap(func, iterable, chunksize=None, retries=None, priority=0):
+    """dimap(func, iterable, chunksize=None, retries=None, priority=0)
+        -> generator
+
+    Streaming version of dmap() as itertools.imap(), yields func(x) values
+    in iterable order as soon as their chunk and the previous ones are
+    finished. Chunks are enqueued by this call, not by the first next().
+    """
+    return _values(_enqueue_chunks(func, iterable, chunksize, retries,
+                                   priority))
+
+def dmap_unordered(func, iterable, chunksize=None, retries=None, priority=0):
+    """dmap_unordered(func, iterable, chunksize=None, retries=None,
+                      priority=0) -> generator
+
+    Streaming version of dmap(), yields func(x) values as soon as their
+    chunk is finished, so the order of the iterable is not preserved.
+    """
+    futures = _enqueue_chunks(func, iterable, chunksize, retries, priority)
+    return _values(as_completed(futures))
+
+def _copy_state(source, target):
+    """Finishes target future with the result, error or abort of the
+    finished source future."""
+    if source.aborted():
+        target.abort()
+        return
+    try:
+        value = source.get()
+    except Exception:
+        target._set_exception(sys.exc_info())
+    else:
+        target._set_result(value)
+
+class _ReduceFuture(Future):
+    """A future over the reduction of a list of futures with a balanced
+    tree of tasks.
+
+    Every group of fanout consecutive futures is reduced by a new task,
+    whose future takes the place of the group in the next level of the
+    tree. The whole tree is enqueued at once, giving the futures of every
+    group as task arguments, see Planner.enqueue(), so partial results
+    never pass through the driver and no thread waits for any future.
+    """
+    def __init__(self, func, futures, fanout, retries, priority, submitter):
+        super(_ReduceFuture, self).__init__(None)
+        # futures of every task, allowing to abort them
+        self._futures = list(futures)
+        self.set_as_running()
+        while len(futures) > 1:
+            next_level = []
+            for i in range(0, len(futures), fanout):
+                group = futures[i:i+fanout]
+                if len(group) > 1:
+                    fut = planner.enqueue(_reduce_values, [func] + group,
+                                          retries=retries, priority=priority,
+                                          submitter=submitter)
+                    self._futures.append(fut)
+                    group = [fut]
+                next_level.extend(group)
+            futures = next_level
+        futures[0].add_done_callback(lambda fut: _copy_state(fut, self))
+
+    @overrides(Future)
+    def abort(self):
+        """Aborts the reduction and every one of its tasks."""
+        aborted = super(_ReduceFuture, self).abort()
+        for fut in self._futures:
+            fut.abort()
+        return aborted
+
+def dreduce(func, iterable, fanout=DEFAULT_FANOUT, chunksize=None,
+            retries=None, priority=0):
+    """dreduce(func, iterable, fanout=DEFAULT_FANOUT, chunksize=None,
+               retries=None, priority=0) -> Future
+
+    Distributed version of reduce(). The result is given as a future over
+    the value of reduce(func, iterable), which should not be empty.
+
+    Every chunk of the iterable is reduced by one task, see dmap(), and
+    the partial results are reduced by tasks of fanout values, in a tree
+    of logarithmic depth. The order of the items is preserved, so func
+    should be associative but it can be non commutative.
+    """
+    items = list(iterable)
+    if not items:
+        raise TypeError("dreduce() of empty sequence")
+    if fanout < 2:
+        raise ValueError("fanout should be larger than one")
+    submitter = ("dreduce", next(_submitter_ids))
+    futures = _enqueue_chunks(func, items, chunksize, retries, priority,
+                              chunk_func=_reduce_chunk, submitter=submitter)
+    return _ReduceFuture(func, futures, fanout, retries, priority, submitter)
@@ -23,11 +23,23 @@ class EngineInterface(object):
         underlying SP socket for communication.
         """
         raise NotImplementedError
+
+    def disconnect(self):
+        """disconnect()
+
+        Closes the engine connection opened by connect(), releasing any
+        worker resource started by the engine.
+        """
+        pass
     
     def abort(self, task):
         """abort(task : Task)
 
-        Aborts the given task object
+        Aborts the given task object, which has been given to execute().
+        The engine stops the task as soon as possible, but a reply is
+        still given for it, probably with a None result, and finished()
+        is called as for any other task. Engines unable to stop running
+        tasks let them run until completion.
         """
         raise NotImplementedError
 
@@ -35,10 +47,22 @@ class EngineInterface(object):
         """execute(task : Task, stdout_path : str, stderr_path : str)
         
         Executes the given task object using as output log the given
-        stdout_path and stderr_path
+        stdout_path and stderr_path. Engines should call task.run(), and
+        they may use task.dependencies to choose where it is executed.
         """
         raise NotImplementedError
 
+    def execute_many(self, tasks):
+        """execute_many(tasks : list of (Task, str, str) tuples)
+
+        Executes a list of (task, stdout_path, stderr_path) tuples. Engines
+        with a large cost per submission should override this method to
+        submit all of them at once. By default execute() is called for
+        every tuple.
+        """
+        for task, stdout_path, stderr_path in tasks:
+            self.execute(task, stdout_path, stderr_path)
+
     def finished(self, task):
         """finished(task : Task)
 
@@ -55,6 +79,15 @@ class EngineInterface(object):
         """
         raise NotImplementedError
 
+    def get_free_slots(self):
+        """get_free_slots() -> int
+
+        Returns the number of tasks which can be given to execute_many()
+        now. By default 1 when accepting_tasks() is True, engines
+        implementing execute_many() should override it.
+        """
+        return 1 if self.accepting_tasks() else 0
+
     def get_max_tasks(self):
         """get_max_tasks() -> int
         
@@ -68,7 +101,10 @@ class EngineInterface(object):
         Loads the options from the given dictionary.
         
         Normally the options dictionary is loaded from a particular
-        config file with a [engine class name] section.
+        config file with a [engine class name] section. The serializer
+        option (see common.SERIALIZERS) selects how messages are
+        serialized, "out_of_band" sends large NumPy arrays without
+        pickling them.
         """
 
 def get_num_cores():
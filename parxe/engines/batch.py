@@ -0,0 +1,628 @@
+# -*- coding: utf-8 -*-
+"""Batch engine, executes tasks as jobs of a cluster queue system.
+
+Tasks are pickled into a bundle file in a shared directory and submitted
+as a job with a qsub/sbatch-like command. Several tasks given together to
+execute_many() are submitted as one array job sharing the same bundle, and
+every array index loads only its own task. The job executes this module
+as a script, which loads the task, runs it and sends back the reply to the
+engine through a nanomsg TCP socket. Job states are updated by a monitor
+thread, which calls the status command once per poll interval for all the
+jobs.
+
+Commands of every supported queue system are given in SCHEDULERS, and the
+fake scheduler executes jobs in the local host using fakeq.sh script,
+which allows testing this engine without a cluster."""
+
+import cPickle as pkl
+import itertools
+import logging as log
+import os
+import re
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+from pipes import quote
+from time import time
+
+import nanomsg as nmsg
+import parxe.common as common
+
+from parxe.engines import EngineInterface
+from parxe.common import Singleton, overrides, serialize, deserialize
+
+SCHEDULER_OPTION = "scheduler"
+SUBMIT_COMMAND_OPTION = "submit_command"
+STATUS_COMMAND_OPTION = "status_command"
+CANCEL_COMMAND_OPTION = "cancel_command"
+SUBMIT_ARRAY_COMMAND_OPTION = "submit_array_command"
+CANCEL_INDEX_COMMAND_OPTION = "cancel_index_command"
+INDEX_VAR_OPTION = "index_var"
+INDEX_BASE_OPTION = "index_base"
+STATE_COLUMN_OPTION = "state_column"
+MAX_TASKS_OPTION = "max_tasks"
+POLL_INTERVAL_OPTION = "poll_interval"
+LOST_TIMEOUT_OPTION = "lost_timeout"
+TASKS_DIR_OPTION = "tasks_dir"
+HOST_OPTION = "host"
+PORT_OPTION = "port"
+PYTHON_OPTION = "python"
+
+FAKEQ_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "fakeq.sh")
+
+# Commands are formatted with quoted strings: submit command receives
+# script, stdout, stderr and name, submit_array command receives also the
+# size and the last index of the array, cancel command receives a list of
+# jobs and cancel_index receives a job and an index of its array. The
+# status command prints a line per job starting with its id, and the job
+# state at state_column. Array jobs know their index by the environment
+# variable index_var, which starts at index_base.
+SCHEDULERS = {
+    "sge" : {
+        "submit" : "qsub -terse -o {stdout} -e {stderr} -N {name} {script}",
+        "submit_array" : ("qsub -terse -t 1-{size} -o {stdout} -e {stderr} "
+                          "-N {name} {script}"),
+        "status" : "qstat",
+        "cancel" : "qdel {jobs}",
+        "cancel_index" : "qdel {job} -t {index}",
+        "state_column" : 4,
+        "index_var" : "SGE_TASK_ID",
+        "index_base" : 1,
+    },
+    "pbs" : {
+        "submit" : "qsub -o {stdout} -e {stderr} -N {name} {script}",
+        "submit_array" : ("qsub -t 0-{last} -o {stdout} -e {stderr} "
+                          "-N {name} {script}"),
+        "status" : "qstat",
+        "cancel" : "qdel {jobs}",
+        "cancel_index" : "qdel -t {index} {job}",
+        "state_column" : 4,
+        "index_var" : "PBS_ARRAYID",
+        "index_base" : 0,
+    },
+    "slurm" : {
+        "submit" : ("sbatch --parsable -o {stdout} -e {stderr} -J {name} "
+                    "{script}"),
+        "submit_array" : ("sbatch --parsable --array=0-{last} -o {stdout} "
+                          "-e {stderr} -J {name} {script}"),
+        "status" : "squeue -h -u $USER -o '%i %t'",
+        "cancel" : "scancel {jobs}",
+        "cancel_index" : "scancel {job}_{index}",
+        "state_column" : 1,
+        "index_var" : "SLURM_ARRAY_TASK_ID",
+        "index_base" : 0,
+    },
+    "fake" : {
+        "submit" : ("sh " + quote(FAKEQ_PATH) +
+                    " submit {stdout} {stderr} {name} {script}"),
+        "submit_array" : ("sh " + quote(FAKEQ_PATH) +
+                          " submit_array {stdout} {stderr} {name} {size} "
+                          "{script}"),
+        "status" : "sh " + quote(FAKEQ_PATH) + " status",
+        "cancel" : "sh " + quote(FAKEQ_PATH) + " cancel {jobs}",
+        "cancel_index" : None,
+        "state_column" : 1,
+        "index_var" : "FAKEQ_TASK_ID",
+        "index_base" : 0,
+    },
+}
+
+DEFAULT_SCHEDULER = "sge"
+# Usual limit of running and queued jobs per user
+DEFAULT_MAX_TASKS = 64
+DEFAULT_POLL_INTERVAL = 5 # seconds
+# Jobs missing in the status command output during this time, without
+# having replied, are considered lost and their tasks finished with an error
+DEFAULT_LOST_TIMEOUT = 60 # seconds
+# Should be visible from the cluster nodes
+DEFAULT_TASKS_DIR = os.path.join(os.getenv("HOME", "/tmp"), ".pyparxe",
+                                 "tasks")
+# Maximum time a job waits the engine confirmation of its reply
+REPLY_TIMEOUT = 600 # seconds
+# Maximum time the engine waits the planner confirmation of replies of
+# lost jobs, the planner may have been stopped
+CLIENT_TIMEOUT = 10 # seconds
+# Errors replied by the engine for tasks of lost and cancelled jobs
+LOST_ERROR = ("JobLost", "Job finished without reply", "")
+ABORTED_ERROR = ("JobAborted", "Job cancelled", "")
+
+BUNDLE_SUFFIX = ".tasks"
+SCRIPT_SUFFIX = ".sh"
+
+JOB_SCRIPT = """#!/bin/sh
+PYTHONPATH={pythonpath}
+export PYTHONPATH
+exec {python} -m parxe.engines.batch {bundle} {index}
+"""
+
+# Scheduler job ids start with a number, followed by the server name,
+# the array index or other decorations depending on the queue system
+_JOB_NUMBER_RE = re.compile(r"\d+")
+_BUNDLE_HEADER = struct.Struct("!Q")
+
+def _job_number(job_id):
+    """Returns the leading number of a scheduler job id"""
+    match = _JOB_NUMBER_RE.match(job_id)
+    return match.group() if match else job_id
+
+def _write_bundle(path, tasks, header):
+    """Writes a bundle of (task, stdout_path, stderr_path) tuples.
+
+    The bundle starts with the pickled header dictionary, which contains
+    the offset of every pickled tuple, so a job reads only its own one.
+    """
+    blobs = [pkl.dumps(entry, pkl.HIGHEST_PROTOCOL) for entry in tasks]
+    offsets = []
+    pos = 0
+    for blob in blobs:
+        offsets.append((pos, len(blob)))
+        pos += len(blob)
+    header = dict(header, offsets=offsets)
+    data = pkl.dumps(header, pkl.HIGHEST_PROTOCOL)
+    with open(path, "wb") as f:
+        f.write(_BUNDLE_HEADER.pack(len(data)))
+        f.write(data)
+        for blob in blobs:
+            f.write(blob)
+
+def _read_bundle(path, index):
+    """_read_bundle(path : str, index : int) -> (dict, tuple)
+
+    Returns the header of the bundle and its index-th tuple.
+    """
+    with open(path, "rb") as f:
+        length, = _BUNDLE_HEADER.unpack(f.read(_BUNDLE_HEADER.size))
+        header = pkl.loads(f.read(length))
+        start, size = header["offsets"][index]
+        f.seek(_BUNDLE_HEADER.size + length + start)
+        return header, pkl.loads(f.read(size))
+
+def _redirect(stdout_path, stderr_path):
+    """Redirects the process stdout and stderr to the given paths."""
+    for path, fd in ((stdout_path, 1), (stderr_path, 2)):
+        with open(path, "w") as f:
+            os.dup2(f.fileno(), fd)
+
+def _run_task(task):
+    """Executes the given task in its working directory, and returns a
+    (result, error) tuple, see common.capture_error()."""
+    os.chdir(task.wd)
+    try:
+        return task.run(), None
+    except Exception:
+        traceback.print_exc()
+        return None, common.capture_error()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+def _worker_main(bundle_path, index):
+    """Entry point of every job, executes the index-th task of the bundle.
+
+    Output of single jobs is written by the queue system into the task
+    logs, while array jobs redirect it here. The reply is sent through a
+    REQ socket, the engine answer confirms that the reply has been
+    delivered before finishing the job.
+    """
+    header, (task, stdout_path, stderr_path) = _read_bundle(bundle_path,
+                                                            index)
+    if header["array"]:
+        _redirect(stdout_path, stderr_path)
+    result, error = _run_task(task)
+    results = nmsg.Socket(nmsg.REQ)
+    results.set_int_option(nmsg.SOL_SOCKET, nmsg.RCVTIMEO,
+                           REPLY_TIMEOUT * 1000)
+    results.connect(header["results_uri"])
+    try:
+        header["serialize"]({"id":task.id, "result":result, "error":error,
+                             "hash":header["hash"], "reply":True},
+                            results)
+        _ = deserialize(results)
+    finally:
+        results.close()
+
+def _free_port():
+    """Returns a free TCP port of the local host."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+class _Job(object):
+    """State of a submitted task.
+
+    Tasks of an array job share the job id and the bundle name, and
+    index is their position in the array, None for single jobs.
+    """
+    def __init__(self, task, job_id, name, index=None):
+        self.task = task
+        self.job_id = job_id
+        self.name = name
+        self.index = index
+        # last state given by the status command, None if not listed
+        self.state = None
+        # time of the first status without this job
+        self.missing_since = None
+
+@Singleton
+class BatchEngine(EngineInterface):
+    """Batch engine class, executes tasks as jobs of a cluster queue system.
+
+    The maximum number of tasks, which should be the queue limit of jobs
+    per user, is given by max_tasks option. The scheduler option selects
+    the commands of a queue system in SCHEDULERS, and they can be
+    overwritten using submit_command, status_command and cancel_command
+    options.
+    """
+
+    def __init__(self):
+        """Initializes the engine with default attributes.
+
+        This method is not callable directly because this class is a
+        singleton, you should use get_instance() instead.
+        """
+        # hash_value is used for identification of this engine client
+        # connections
+        tmpfile, hash_value = common.mktempfile()
+        self._tmpfile = tmpfile
+        self._hash = hash_value
+        self._scheduler = dict(SCHEDULERS[DEFAULT_SCHEDULER])
+        self._max_tasks = DEFAULT_MAX_TASKS
+        self._poll_interval = DEFAULT_POLL_INTERVAL
+        self._lost_timeout = DEFAULT_LOST_TIMEOUT
+        self._tasks_dir = DEFAULT_TASKS_DIR
+        self._host = None
+        self._port = None
+        self._python = sys.executable
+        # Function used to serialize replies, see set_options()
+        self._serialize = serialize
+        # URI where jobs send their replies, given at connect()
+        self._results_uri = None
+        # A dictionary of _Job objects indexed by task id, shared with the
+        # monitor thread
+        self._jobs = {}
+        # Number of unfinished tasks of every bundle, indexed by its name
+        self._bundles = {}
+        self._bundle_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._monitor_thread = None
+        self._stop_event = threading.Event()
+        # Tasks of cancelled jobs waiting for their reply, given by the
+        # monitor thread once woken up by this event
+        self._aborted = []
+        self._wakeup_event = threading.Event()
+        # Forward declaration of sockets, for attention of the reader.
+        self._server = None
+        self._client = None
+
+    def _run(self, cmd):
+        """Executes cmd returning its output, raises RuntimeError when it
+        fails."""
+        f = common.popen(cmd)
+        try:
+            output = f.read()
+        finally:
+            status = f.close()
+        if status is not None:
+            raise RuntimeError("Command failed with status {}: {}".format(
+                status, cmd))
+        return output
+
+    def _submit(self, script_path, stdout_path, stderr_path, name,
+                size=None):
+        """Submits the given job script and returns its job id. When size
+        is given, it is submitted as an array job of this size."""
+        command = self._scheduler["submit" if size is None else
+                                  "submit_array"]
+        cmd = command.format(script=quote(script_path),
+                             stdout=quote(stdout_path),
+                             stderr=quote(stderr_path),
+                             name=quote(name),
+                             size=size,
+                             last=(size or 1) - 1)
+        output = self._run(cmd).split()
+        if not output:
+            raise RuntimeError("Job id not found in the output of: " + cmd)
+        # sbatch --parsable prints job_id;cluster_name
+        return output[0].split(";")[0]
+
+    def _status(self):
+        """Returns a dictionary with the state of every job in the queue
+        system, indexed by job id."""
+        column = int(self._scheduler["state_column"])
+        states = {}
+        for line in self._run(self._scheduler["status"]).splitlines():
+            fields = line.split()
+            if fields and _JOB_NUMBER_RE.match(fields[0]):
+                # every array index may be listed in its own line
+                states.setdefault(_job_number(fields[0]),
+                                  fields[column] if column < len(fields)
+                                  else "")
+        return states
+
+    def _cancel(self, jobs):
+        """Cancels the given list of _Job objects with one command."""
+        ids = sorted(set(quote(job.job_id) for job in jobs))
+        if ids:
+            self._run(self._scheduler["cancel"].format(jobs=" ".join(ids)))
+
+    def _cancel_index(self, job):
+        """Cancels one task of an array job, when supported by the queue
+        system, and returns False when it is not supported."""
+        command = self._scheduler["cancel_index"]
+        if command is None:
+            log.warning("Array job %s cannot be cancelled by index",
+                        job.job_id)
+            return False
+        index = job.index + int(self._scheduler["index_base"])
+        self._run(command.format(job=quote(job.job_id), index=index))
+        return True
+
+    def _release(self, job):
+        """Removes the bundle and script files of the given job once every
+        task of its bundle has finished."""
+        self._bundles[job.name] -= 1
+        if self._bundles[job.name] > 0:
+            return
+        del self._bundles[job.name]
+        self._remove_files(job.name)
+
+    def _remove_files(self, name):
+        """Removes the bundle and script files with the given name."""
+        for suffix in (BUNDLE_SUFFIX, SCRIPT_SUFFIX):
+            try:
+                os.remove(os.path.join(self._tasks_dir, name + suffix))
+            except OSError:
+                pass
+
+    def _reply_error(self, task, error):
+        """Finishes a task whose job was lost or cancelled with the given
+        error, so the planner may retry it. Nothing is sent once
+        disconnect() has been called."""
+        if self._stop_event.is_set():
+            return
+        self._serialize({"id":task.id, "result":None, "error":error,
+                         "hash":self._hash, "reply":True},
+                        self._client)
+        _ = deserialize(self._client)
+
+    def _update(self):
+        """Updates the state of every job calling once the status command,
+        and finishes tasks of lost jobs.
+
+        Lost jobs are removed before replying, so a late reply of the job
+        and the JobLost one are never both followed by finished().
+        """
+        with self._lock:
+            jobs = self._jobs.values()
+        if not jobs:
+            return
+        states = self._status()
+        now = time()
+        lost = []
+        with self._lock:
+            for job in jobs:
+                if self._jobs.get(job.task.id) is not job:
+                    continue # finished meanwhile
+                job.state = states.get(_job_number(job.job_id))
+                if job.state is not None:
+                    job.missing_since = None
+                elif job.missing_since is None:
+                    job.missing_since = now
+                elif now - job.missing_since >= self._lost_timeout:
+                    del self._jobs[job.task.id]
+                    self._release(job)
+                    lost.append(job)
+        for job in lost:
+            log.error("Job %s of task %d finished without reply",
+                      job.job_id, job.task.id)
+            self._reply_error(job.task, LOST_ERROR)
+
+    def _monitor(self):
+        """Target of the monitor thread, replies tasks of cancelled jobs
+        when woken up by abort() and updates jobs once per poll
+        interval."""
+        next_update = time() + self._poll_interval
+        while True:
+            self._wakeup_event.wait(max(0, next_update - time()))
+            self._wakeup_event.clear()
+            if self._stop_event.is_set():
+                return
+            with self._lock:
+                aborted, self._aborted = self._aborted, []
+            try:
+                for task in aborted:
+                    self._reply_error(task, ABORTED_ERROR)
+                if time() >= next_update:
+                    next_update = time() + self._poll_interval
+                    self._update()
+            except Exception:
+                log.exception("Batch jobs status update failed")
+
+    def job_state(self, task):
+        """job_state(task : Task) -> str or None
+
+        Returns the state of the task job given by the last status
+        command, or None when the job is not listed.
+        """
+        with self._lock:
+            job = self._jobs.get(task.id)
+            return job.state if job is not None else None
+
+    @overrides(EngineInterface)
+    def connect(self):
+        if self._server is None:
+            if not os.path.isdir(self._tasks_dir):
+                os.makedirs(self._tasks_dir)
+            host = self._host or socket.getfqdn()
+            port = self._port or _free_port()
+            self._results_uri = "tcp://{}:{}".format(host, port)
+            self._server = nmsg.Socket(nmsg.REP)
+            self._server.bind("tcp://*:{}".format(port))
+            # used to reply tasks of lost jobs
+            self._client = nmsg.Socket(nmsg.REQ)
+            self._client.set_int_option(nmsg.SOL_SOCKET, nmsg.RCVTIMEO,
+                                        CLIENT_TIMEOUT * 1000)
+            self._client.connect(self._results_uri)
+            self._stop_event.clear()
+            self._wakeup_event.clear()
+            self._monitor_thread = threading.Thread(target=self._monitor)
+            self._monitor_thread.daemon = True
+            self._monitor_thread.start()
+        return self._server
+
+    @overrides(EngineInterface)
+    def disconnect(self):
+        if self._server is not None:
+            self._stop_event.set()
+            self._wakeup_event.set()
+            self._monitor_thread.join()
+            self._monitor_thread = None
+            with self._lock:
+                jobs = self._jobs.values()
+                names = self._bundles.keys()
+                self._jobs = {}
+                self._bundles = {}
+                self._aborted = []
+            try:
+                self._cancel(jobs)
+            except RuntimeError as e:
+                log.warning("Jobs cannot be cancelled: %s", e)
+            for name in names:
+                self._remove_files(name)
+            self._client.close()
+            self._server.close()
+            self._client = None
+            self._server = None
+
+    @overrides(EngineInterface)
+    def abort(self, task):
+        """Cancels the job of the given task, which releases its slot at
+        once and is replied with a JobAborted error by the monitor
+        thread. When the cancel command fails, the task is replied once
+        its job is lost."""
+        with self._lock:
+            job = self._jobs.get(task.id)
+        if job is None:
+            return
+        try:
+            if job.index is None:
+                self._cancel([job])
+            elif not self._cancel_index(job):
+                return
+        except RuntimeError as e:
+            log.warning("Job %s cannot be cancelled: %s", job.job_id, e)
+            return
+        with self._lock:
+            if self._jobs.get(task.id) is not job:
+                return # replied meanwhile
+            del self._jobs[task.id]
+            self._release(job)
+            self._aborted.append(task)
+        self._wakeup_event.set()
+
+    @overrides(EngineInterface)
+    def execute(self, task, stdout_path, stderr_path):
+        self.execute_many([(task, stdout_path, stderr_path)])
+
+    @overrides(EngineInterface)
+    def execute_many(self, tasks):
+        """Submits the given tasks as one array job, or as a single job
+        when only one task is given."""
+        array = len(tasks) > 1
+        name = "parxe-{}-{}".format(self._hash, next(self._bundle_ids))
+        bundle_path = os.path.join(self._tasks_dir, name + BUNDLE_SUFFIX)
+        _write_bundle(bundle_path, tasks, {
+            "results_uri" : self._results_uri,
+            "hash" : self._hash,
+            "serialize" : self._serialize,
+            "array" : array,
+        })
+        if array:
+            index = "$(({} - {}))".format(self._scheduler["index_var"],
+                                          int(self._scheduler["index_base"]))
+        else:
+            index = "0"
+        script_path = os.path.join(self._tasks_dir, name + SCRIPT_SUFFIX)
+        with open(script_path, "w") as f:
+            f.write(JOB_SCRIPT.format(
+                pythonpath=quote(os.pathsep.join(sys.path)),
+                python=quote(self._python),
+                bundle=quote(bundle_path),
+                index=index,
+            ))
+        if array:
+            # every task redirects its output, see _worker_main()
+            job_id = self._submit(script_path, os.devnull, os.devnull, name,
+                                  size=len(tasks))
+        else:
+            _, stdout_path, stderr_path = tasks[0]
+            job_id = self._submit(script_path, stdout_path, stderr_path, name)
+        with self._lock:
+            self._bundles[name] = len(tasks)
+            for i, (task, _, _) in enumerate(tasks):
+                self._jobs[task.id] = _Job(task, job_id, name,
+                                           i if array else None)
+
+    @overrides(EngineInterface)
+    def finished(self, task):
+        with self._lock:
+            job = self._jobs.pop(task.id, None)
+            if job is not None:
+                self._release(job)
+
+    @overrides(EngineInterface)
+    def accepting_tasks(self):
+        return self.get_free_slots() > 0
+
+    @overrides(EngineInterface)
+    def get_free_slots(self):
+        with self._lock:
+            return max(0, self._max_tasks - len(self._jobs))
+
+    @overrides(EngineInterface)
+    def get_max_tasks(self):
+        return self._max_tasks
+
+    @overrides(EngineInterface)
+    def set_options(self, options):
+        self._serialize = common.get_serializer(options)
+        if SCHEDULER_OPTION in options:
+            self._scheduler = dict(SCHEDULERS[options[SCHEDULER_OPTION]])
+        for option, key in ((SUBMIT_COMMAND_OPTION, "submit"),
+                            (SUBMIT_ARRAY_COMMAND_OPTION, "submit_array"),
+                            (STATUS_COMMAND_OPTION, "status"),
+                            (CANCEL_COMMAND_OPTION, "cancel"),
+                            (CANCEL_INDEX_COMMAND_OPTION, "cancel_index"),
+                            (STATE_COLUMN_OPTION, "state_column"),
+                            (INDEX_VAR_OPTION, "index_var"),
+                            (INDEX_BASE_OPTION, "index_base")):
+            if option in options:
+                self._scheduler[key] = options[option]
+        if MAX_TASKS_OPTION in options:
+            self._max_tasks = int(options[MAX_TASKS_OPTION])
+        if POLL_INTERVAL_OPTION in options:
+            self._poll_interval = float(options[POLL_INTERVAL_OPTION])
+        if LOST_TIMEOUT_OPTION in options:
+            self._lost_timeout = float(options[LOST_TIMEOUT_OPTION])
+        if TASKS_DIR_OPTION in options:
+            self._tasks_dir = os.path.expanduser(options[TASKS_DIR_OPTION])
+        if HOST_OPTION in options:
+            self._host = options[HOST_OPTION]
+        if PORT_OPTION in options:
+            self._port = int(options[PORT_OPTION])
+        if PYTHON_OPTION in options:
+            self._python = options[PYTHON_OPTION]
+
+def get_instance():
+    """Wrapper of BatchEngine.get_instance()"""
+    return BatchEngine.get_instance()
+
+if __name__ == "__main__":
+    _worker_main(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,60 @@
+#!/bin/sh
+# A stand-in for batch queue systems, which executes jobs as background
+# processes of the local host. It allows testing BatchEngine offline.
+#
+# Usage:
+#   fakeq.sh submit STDOUT STDERR NAME SCRIPT   prints the job id
+#   fakeq.sh submit_array STDOUT STDERR NAME SIZE SCRIPT
+#                                               prints the job id, every
+#                                               index runs with FAKEQ_TASK_ID
+#                                               variable from 0 to SIZE-1
+#   fakeq.sh status                             prints "JOB_ID STATE" lines
+#   fakeq.sh cancel JOB_ID...
+#
+# Job ids are process ids, tracked as files in FAKEQ_DIR directory.
+
+FAKEQ_DIR=${FAKEQ_DIR:-${TMPDIR:-/tmp}/fakeq-$(id -u)}
+mkdir -p "$FAKEQ_DIR" || exit 1
+
+case "$1" in
+    submit)
+        [ $# -eq 5 ] || { echo "fakeq: wrong submit arguments" >&2; exit 1; }
+        nohup sh "$5" > "$2" 2> "$3" < /dev/null &
+        echo "$4" > "$FAKEQ_DIR/$!"
+        echo $!
+        ;;
+    submit_array)
+        [ $# -eq 6 ] || { echo "fakeq: wrong submit arguments" >&2; exit 1; }
+        nohup sh -c 'i=0
+            while [ $i -lt "$1" ]; do
+                FAKEQ_TASK_ID=$i sh "$2" &
+                i=$((i + 1))
+            done
+            wait' fakeq "$5" "$6" > "$2" 2> "$3" < /dev/null &
+        echo "$4" > "$FAKEQ_DIR/$!"
+        echo $!
+        ;;
+    status)
+        for job in "$FAKEQ_DIR"/*; do
+            [ -e "$job" ] || continue
+            id=$(basename "$job")
+            # finished jobs may be zombies until their parent reaps them
+            case $(ps -o stat= -p "$id") in
+                ""|Z*) rm -f "$job" ;;
+                *) echo "$id r" ;;
+            esac
+        done
+        ;;
+    cancel)
+        shift
+        for id in "$@"; do
+            pkill -TERM -P "$id"
+            kill -TERM "$id" 2> /dev/null
+            rm -f "$FAKEQ_DIR/$id"
+        done
+        ;;
+    *)
+        echo "usage: fakeq.sh submit|submit_array|status|cancel ..." >&2
+        exit 1
+        ;;
+esac
@@ -1,2 +1,331 @@
 # -*- coding: utf-8 -*-
-"""Summary"""
+"""Local engine, executes tasks in a pool of worker processes.
+
+The pool is started once when the engine is connected and the same worker
+processes are reused for every task, avoiding the cost of forking and
+importing modules once per task. By default tasks are pulled by idle
+workers: every worker has its own tasks socket and receives a new task
+only after replying the previous one, so no task waits behind a slow one
+while other workers are idle. Results with large NumPy arrays are
+given back through shared memory files, see parxe.shm module."""
+
+import collections
+import errno
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import traceback
+
+import nanomsg as nmsg
+import parxe.common as common
+import parxe.shm as shm
+
+from parxe.engines import EngineInterface, get_num_cores
+from parxe.common import Singleton, overrides, serialize, deserialize
+
+NUM_WORKERS_OPTION = "num_workers"
+SHARED_MEMORY_OPTION = "shared_memory"
+# "pull" sends a task to an idle worker, "push" distributes tasks round
+# robin through a socket shared by every worker
+DISPATCH_OPTION = "dispatch"
+PULL_DISPATCH = "pull"
+PUSH_DISPATCH = "push"
+TRUE_VALUES = ("1", "yes", "true", "on")
+# Signal sent to a worker to abort its running task
+ABORT_SIGNAL = signal.SIGUSR1
+# Number of finished tasks whose worker is remembered, tasks depending on
+# them are given to the same worker when it is idle
+MAX_LOCALITY_ENTRIES = 10000
+
+class TaskAborted(Exception):
+    """Raised into a task function when its task is aborted"""
+
+# Indicates if the worker process is executing a task function, abort
+# signals received out of task functions are ignored
+_task_running = False
+
+def _abort_handler(signum, frame):
+    if _task_running:
+        raise TaskAborted()
+
+def _retry_interrupted(func, *args):
+    """Calls func(*args) again while it fails because an abort signal
+    interrupted a socket call out of task functions."""
+    while True:
+        try:
+            return func(*args)
+        except nmsg.NanoMsgAPIError as e:
+            if getattr(e, "errno", None) != errno.EINTR:
+                raise
+
+def _redirect(path, fd):
+    """Redirects the given file descriptor to the file at path."""
+    with open(path, "w") as f:
+        os.dup2(f.fileno(), fd)
+
+def _run_task(task, stdout_path, stderr_path):
+    """Executes the given task redirecting its output to the given paths,
+    and returns a (result, error) tuple, see common.capture_error().
+
+    The process stdout and stderr are restored after the execution, so the
+    same worker can be reused for following tasks. Aborted tasks fail with
+    TaskAborted error, abort signals are ignored once the task function
+    returns.
+    """
+    global _task_running
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+    try:
+        _redirect(stdout_path, 1)
+        _redirect(stderr_path, 2)
+        os.chdir(task.wd)
+        try:
+            _task_running = True
+            try:
+                result = task.run()
+            finally:
+                _task_running = False
+            return result, None
+        except Exception:
+            traceback.print_exc()
+            return None, common.capture_error()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_stdout, 1)
+        os.dup2(saved_stderr, 2)
+        os.close(saved_stdout)
+        os.close(saved_stderr)
+
+def _worker_loop(tasks, results, hash_value, serialize=serialize,
+                 shm_dir=None):
+    """Receives (task, stdout_path, stderr_path) tuples from tasks socket
+    and sends back the reply through results socket using the given
+    serialize function. When shm_dir is given, large results are stored
+    in shm_dir and the reply contains only their handle.
+
+    A None message indicates the worker to stop. Abort signals received
+    while waiting in a socket call are ignored.
+    """
+    while True:
+        msg = _retry_interrupted(deserialize, tasks)
+        if msg is None:
+            break
+        task, stdout_path, stderr_path = msg
+        try:
+            result, error = _run_task(task, stdout_path, stderr_path)
+        except TaskAborted:
+            # the task is always replied, keeping the worker in the pool
+            result, error = None, common.capture_error()
+        if shm_dir is not None:
+            result = shm.share(result, shm_dir)
+        _retry_interrupted(serialize,
+                           {"id":task.id, "result":result, "error":error,
+                            "hash":hash_value, "reply":False},
+                           results)
+
+def _worker_main(tasks_uri, results_uri, hash_value, serialize, shm_dir):
+    """Entry point of every worker process in the pool."""
+    signal.signal(ABORT_SIGNAL, _abort_handler)
+    tasks = nmsg.Socket(nmsg.PULL)
+    tasks.connect(tasks_uri)
+    results = nmsg.Socket(nmsg.PUSH)
+    results.connect(results_uri)
+    try:
+        _worker_loop(tasks, results, hash_value, serialize, shm_dir)
+    finally:
+        tasks.close()
+        results.close()
+
+@Singleton
+class LocalEngine(EngineInterface):
+    """Local engine class, executes tasks in parallel using the local host.
+
+    A pool of long-lived worker processes, by default one per core, is
+    forked when connect() is called. Tasks are distributed to workers
+    through nanomsg PUSH sockets, one per worker in pull dispatch mode,
+    and results are gathered back with a PULL socket, which is the socket
+    returned by connect().
+    """
+
+    def __init__(self):
+        """Initializes the engine with default attributes.
+
+        This method is not callable directly because this class is a
+        singleton, you should use get_instance() instead.
+        """
+        # hash_value is used for identification of this engine client
+        # connections
+        tmpfile, hash_value = common.mktempfile()
+        self._tmpfile = tmpfile
+        self._hash = hash_value
+        # The URIs describe how nanomsg will connect workers to this engine
+        prefix = os.path.join(tempfile.gettempdir(), "parxe-" + self._hash)
+        self._tasks_uri = "ipc://" + prefix + "-tasks.ipc"
+        self._results_uri = "ipc://" + prefix + "-results.ipc"
+        self._num_workers = None
+        self._workers = []
+        # Number of tasks executing or waiting in workers queues
+        self._num_running = 0
+        self._dispatch = PULL_DISPATCH
+        # In pull dispatch mode, the tasks socket of every worker, the list
+        # of idle worker indices and the worker index of every task id
+        self._worker_tasks = []
+        self._idle_workers = []
+        self._task_workers = {}
+        # The worker index of last finished tasks, indexed by task id
+        self._finished_workers = collections.OrderedDict()
+        # Function used to serialize tasks and replies, see set_options()
+        self._serialize = serialize
+        # Results are given through shared memory files in this directory,
+        # unless disabled by set_options()
+        self._shm_dir = os.path.join(shm.get_shm_dir(), "parxe-" + self._hash)
+        self._use_shm = True
+        # Forward declaration of sockets, for attention of the reader.
+        self._server = None
+        self._tasks = None
+
+    def _worker_tasks_uri(self, index):
+        """Returns the tasks URI of the given worker index."""
+        if self._dispatch == PUSH_DISPATCH:
+            return self._tasks_uri
+        return self._tasks_uri.replace(".ipc", "-{}.ipc".format(index))
+
+    def _start_workers(self):
+        """Forks the pool of worker processes."""
+        for i in range(self.get_max_tasks()):
+            worker = multiprocessing.Process(
+                target=_worker_main,
+                args=(self._worker_tasks_uri(i), self._results_uri,
+                      self._hash, self._serialize,
+                      self._shm_dir if self._use_shm else None),
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    @overrides(EngineInterface)
+    def connect(self):
+        if self._server is None:
+            if self._use_shm and not os.path.isdir(self._shm_dir):
+                os.mkdir(self._shm_dir)
+            # workers are forked before creating nanomsg sockets in this
+            # process, nanomsg sockets are not safe across fork() calls
+            self._start_workers()
+            self._server = nmsg.Socket(nmsg.PULL)
+            self._server.bind(self._results_uri)
+            if self._dispatch == PUSH_DISPATCH:
+                self._tasks = nmsg.Socket(nmsg.PUSH)
+                self._tasks.bind(self._tasks_uri)
+            else:
+                for i in range(len(self._workers)):
+                    tasks = nmsg.Socket(nmsg.PUSH)
+                    tasks.bind(self._worker_tasks_uri(i))
+                    self._worker_tasks.append(tasks)
+                self._idle_workers = range(len(self._workers))
+        return self._server
+
+    @overrides(EngineInterface)
+    def disconnect(self):
+        if self._server is not None:
+            for worker in self._workers:
+                worker.terminate()
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+            if self._tasks is not None:
+                self._tasks.close()
+            for tasks in self._worker_tasks:
+                tasks.close()
+            self._server.close()
+            self._tasks = None
+            self._worker_tasks = []
+            self._idle_workers = []
+            self._task_workers = {}
+            self._finished_workers.clear()
+            self._server = None
+            self._num_running = 0
+            # Planner.stop() loads results of live futures before, the
+            # remaining files are not referenced anymore
+            shutil.rmtree(self._shm_dir, ignore_errors=True)
+
+    @overrides(EngineInterface)
+    def abort(self, task):
+        """In pull dispatch mode, the worker running the task is signaled
+        to interrupt it, and the task is replied with a None result. In
+        push dispatch mode the worker is unknown and the task runs until
+        completion. Workers ignore the signal when it arrives out of the
+        task function, see _retry_interrupted()."""
+        worker = self._task_workers.get(task.id)
+        if worker is not None:
+            os.kill(self._workers[worker].pid, ABORT_SIGNAL)
+
+    def _pick_worker(self, task):
+        """Removes from the idle list and returns the worker for the given
+        task, preferring a worker which executed any of its dependencies."""
+        for dependency in task.dependencies:
+            worker = self._finished_workers.get(dependency)
+            if worker in self._idle_workers:
+                self._idle_workers.remove(worker)
+                return worker
+        return self._idle_workers.pop(0)
+
+    @overrides(EngineInterface)
+    def execute(self, task, stdout_path, stderr_path):
+        if self._dispatch == PUSH_DISPATCH:
+            tasks = self._tasks
+        else:
+            # the planner never gives more tasks than free slots, so there
+            # is always an idle worker
+            worker = self._pick_worker(task)
+            self._task_workers[task.id] = worker
+            tasks = self._worker_tasks[worker]
+        self._serialize((task, stdout_path, stderr_path), tasks)
+        self._num_running += 1
+
+    @overrides(EngineInterface)
+    def finished(self, task):
+        self._num_running -= 1
+        worker = self._task_workers.pop(task.id, None)
+        if worker is not None:
+            self._idle_workers.append(worker)
+            self._finished_workers[task.id] = worker
+            if len(self._finished_workers) > MAX_LOCALITY_ENTRIES:
+                self._finished_workers.popitem(last=False)
+
+    @overrides(EngineInterface)
+    def accepting_tasks(self):
+        return self._num_running < self.get_max_tasks()
+
+    @overrides(EngineInterface)
+    def get_free_slots(self):
+        return max(0, self.get_max_tasks() - self._num_running)
+
+    @overrides(EngineInterface)
+    def get_max_tasks(self):
+        if self._num_workers is None:
+            self._num_workers = get_num_cores()
+        return self._num_workers
+
+    @overrides(EngineInterface)
+    def set_options(self, options):
+        self._serialize = common.get_serializer(options)
+        if NUM_WORKERS_OPTION in options:
+            self._num_workers = int(options[NUM_WORKERS_OPTION])
+        if SHARED_MEMORY_OPTION in options:
+            value = options[SHARED_MEMORY_OPTION].lower()
+            self._use_shm = value in TRUE_VALUES
+        if DISPATCH_OPTION in options:
+            if options[DISPATCH_OPTION] not in (PULL_DISPATCH, PUSH_DISPATCH):
+                raise ValueError("Unknown dispatch mode: " +
+                                 options[DISPATCH_OPTION])
+            self._dispatch = options[DISPATCH_OPTION]
+
+def get_instance():
+    """Wrapper of LocalEngine.get_instance()"""
+    return LocalEngine.get_instance()
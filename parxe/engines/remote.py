@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""Remote engine, executes tasks in worker daemons of other hosts.
+
+Worker daemons are started by hand, or by any other means, in the hosts
+which will execute tasks:
+
+    python -m parxe.engines.remote daemon DRIVER_HOST [PORT] [-n NUM_WORKERS]
+
+Every daemon registers itself in the engine with its number of worker
+processes, one per core by default, and keeps registering periodically as
+a heartbeat. The engine answers the first registration with the ports of
+a PUSH socket bound for every worker of this daemon, each worker pulls
+tasks from its own socket and pushes replies back to the engine PULL
+socket, as LocalEngine workers do in pull mode, so the capacity of the
+engine is the sum of the workers of every live daemon. Tasks are given to
+idle workers only, preferring the worker which executed a dependency of
+the task. Tasks running in a daemon which is lost or unregistered are
+finished with a WorkerLost error, so the planner may retry them. Aborted
+tasks are interrupted through a control socket bound for every daemon,
+which signals the worker running the task.
+
+The engine binds two consecutive TCP ports, PORT for registration and
+PORT+1 for results, a free port for the tasks of every worker, and a
+free port for the control messages of every daemon. As in
+BatchEngine, the logs directory of the planner and the working directory
+of tasks should be visible from every host."""
+
+import argparse
+import collections
+import logging as log
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+
+from time import time
+
+import nanomsg as nmsg
+import parxe.common as common
+
+from parxe.engines import EngineInterface, get_num_cores
+from parxe.engines.batch import _free_port
+from parxe.engines.local import ABORT_SIGNAL, MAX_LOCALITY_ENTRIES, \
+    _worker_main
+from parxe.common import Singleton, overrides, serialize, deserialize
+
+HOST_OPTION = "host"
+PORT_OPTION = "port"
+HEARTBEAT_TIMEOUT_OPTION = "heartbeat_timeout"
+
+DEFAULT_PORT = 5995
+# Time between registrations of a daemon
+HEARTBEAT_INTERVAL = 5 # seconds
+# Daemons without registration during this time are removed
+DEFAULT_HEARTBEAT_TIMEOUT = 3 * HEARTBEAT_INTERVAL # seconds
+# Maximum time the registration thread waits for messages
+REGISTER_POLL_STEP = 0.5 # seconds
+
+REGISTER = "register"
+UNREGISTER = "unregister"
+# Error replied for tasks running in lost daemons
+LOST_ERROR_TYPE = "WorkerLost"
+
+def _uris(host, port):
+    """Returns registration and results URIs for the given host and base
+    port."""
+    return ["tcp://{}:{}".format(host, port + i) for i in range(2)]
+
+class _Daemon(object):
+    """State of a registered daemon: the time of its last registration,
+    the sockets pushing tasks to each of its workers and their ports, the
+    socket pushing abort messages and its port, the indexes of its idle
+    workers, and the worker of every running task."""
+    def __init__(self, tasks, tasks_ports, control, control_port):
+        self.last = None
+        self.tasks = tasks
+        self.tasks_ports = tasks_ports
+        self.control = control
+        self.control_port = control_port
+        self.idle = list(range(len(tasks)))
+        self.running = {}
+
+    @property
+    def workers(self):
+        return len(self.tasks)
+
+@Singleton
+class RemoteEngine(EngineInterface):
+    """Remote engine class, executes tasks in worker daemons connected
+    through TCP.
+
+    The engine accepts tasks while the number of running tasks is below
+    the number of workers of the registered daemons. Daemons can be
+    started before or after connecting the engine.
+    """
+
+    def __init__(self):
+        """Initializes the engine with default attributes.
+
+        This method is not callable directly because this class is a
+        singleton, you should use get_instance() instead.
+        """
+        # hash_value is used for identification of this engine client
+        # connections
+        tmpfile, hash_value = common.mktempfile()
+        self._tmpfile = tmpfile
+        self._hash = hash_value
+        self._host = "*"
+        self._port = DEFAULT_PORT
+        self._heartbeat_timeout = DEFAULT_HEARTBEAT_TIMEOUT
+        # Serializer of tasks and replies, see set_options()
+        self._serializer = common.PICKLE_SERIALIZER
+        self._serialize = serialize
+        # A dictionary of _Daemon objects indexed by daemon id, and the
+        # daemon id of every running task, shared with the registration
+        # thread
+        self._daemons = {}
+        self._task_daemons = {}
+        # (daemon id, worker index) of recently finished tasks, indexed by
+        # task id, for running tasks in the worker of their dependencies
+        self._finished_workers = collections.OrderedDict()
+        # Tasks sockets of removed daemons, closed by the planner thread,
+        # which is the only one sending through them
+        self._removed_sockets = []
+        self._lock = threading.Lock()
+        self._register_thread = None
+        self._stop_event = threading.Event()
+        # Forward declaration of sockets, for attention of the reader.
+        self._server = None
+        self._register = None
+        # Sends replies of tasks of lost daemons to the server socket
+        self._lost = None
+
+    def _add_daemon(self, daemon_id, workers):
+        """Binds the tasks sockets of the workers of a new daemon and its
+        control socket, and returns its _Daemon object. Called with the
+        lock acquired."""
+        log.info("Daemon %s registered with %d workers", daemon_id, workers)
+        sockets = []
+        ports = []
+        for _ in range(workers):
+            port = _free_port()
+            tasks = nmsg.Socket(nmsg.PUSH)
+            tasks.bind("tcp://{}:{}".format(self._host, port))
+            sockets.append(tasks)
+            ports.append(port)
+        control_port = _free_port()
+        control = nmsg.Socket(nmsg.PUSH)
+        control.bind("tcp://{}:{}".format(self._host, control_port))
+        daemon = _Daemon(sockets, ports, control, control_port)
+        self._daemons[daemon_id] = daemon
+        return daemon
+
+    def _remove_daemon(self, daemon_id):
+        """Removes the given daemon and returns the ids of its running
+        tasks. Called with the lock acquired."""
+        daemon = self._daemons.pop(daemon_id, None)
+        if daemon is None:
+            return []
+        self._removed_sockets.extend(daemon.tasks)
+        self._removed_sockets.append(daemon.control)
+        for task_id in daemon.running:
+            del self._task_daemons[task_id]
+        return list(daemon.running)
+
+    def _pick_worker(self, task):
+        """Removes from its idle list and returns the (daemon id, worker
+        index) pair for the given task, preferring a worker which executed
+        any of its dependencies, then the daemon with more idle workers.
+        Returns (None, None) if no worker is idle. Called with the lock
+        acquired."""
+        for dependency in task.dependencies:
+            daemon_id, worker = self._finished_workers.get(dependency,
+                                                           (None, None))
+            daemon = self._daemons.get(daemon_id)
+            if daemon is not None and worker in daemon.idle:
+                daemon.idle.remove(worker)
+                return daemon_id, worker
+        if self._daemons:
+            daemon_id, daemon = max(self._daemons.items(),
+                                    key=lambda item: len(item[1].idle))
+            if daemon.idle:
+                return daemon_id, daemon.idle.pop(0)
+        return None, None
+
+    def _reply_lost(self, task_ids, reason):
+        """Finishes the given tasks with a WorkerLost error."""
+        error = (LOST_ERROR_TYPE, reason, "")
+        for task_id in task_ids:
+            self._serialize({"id":task_id, "result":None, "error":error,
+                             "hash":self._hash, "reply":False},
+                            self._lost)
+
+    def _handle_message(self, msg, now):
+        """Updates the registered daemons with the given message and returns
+        the answer for the daemon."""
+        answer = {"hash":self._hash, "serializer":self._serializer}
+        lost = []
+        with self._lock:
+            if msg["type"] == UNREGISTER:
+                lost = self._remove_daemon(msg["daemon"])
+            else:
+                daemon = self._daemons.get(msg["daemon"])
+                if daemon is None:
+                    daemon = self._add_daemon(msg["daemon"], msg["workers"])
+                daemon.last = now
+                answer["tasks_ports"] = daemon.tasks_ports
+                answer["control_port"] = daemon.control_port
+        self._reply_lost(lost, "Daemon {} unregistered".format(msg["daemon"]))
+        return answer
+
+    def _expire(self, now):
+        """Removes daemons without registration since heartbeat_timeout,
+        finishing their running tasks with a WorkerLost error."""
+        lost = {}
+        with self._lock:
+            for daemon_id, daemon in self._daemons.items():
+                if now - daemon.last > self._heartbeat_timeout:
+                    log.warning("Daemon %s lost", daemon_id)
+                    lost[daemon_id] = self._remove_daemon(daemon_id)
+        for daemon_id, task_ids in lost.items():
+            self._reply_lost(task_ids, "Daemon {} lost".format(daemon_id))
+
+    def _registration_loop(self):
+        """Target of the registration thread"""
+        fd = self._register.recv_fd
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([fd], [], [], REGISTER_POLL_STEP)
+            if readable:
+                msg = deserialize(self._register)
+                serialize(self._handle_message(msg, time()), self._register)
+            self._expire(time())
+
+    def get_daemons(self):
+        """get_daemons() -> dict
+
+        Returns the number of workers of every registered daemon, indexed
+        by daemon id.
+        """
+        with self._lock:
+            return {daemon_id: daemon.workers
+                    for daemon_id, daemon in self._daemons.items()}
+
+    @overrides(EngineInterface)
+    def connect(self):
+        if self._server is None:
+            register_uri, results_uri = _uris(self._host, self._port)
+            lost_uri = "inproc://parxe-{}-lost".format(self._hash)
+            self._server = nmsg.Socket(nmsg.PULL)
+            self._server.bind(results_uri)
+            self._server.bind(lost_uri)
+            self._lost = nmsg.Socket(nmsg.PUSH)
+            self._lost.connect(lost_uri)
+            self._register = nmsg.Socket(nmsg.REP)
+            self._register.bind(register_uri)
+            self._stop_event.clear()
+            self._register_thread = threading.Thread(
+                target=self._registration_loop
+            )
+            self._register_thread.daemon = True
+            self._register_thread.start()
+        return self._server
+
+    @overrides(EngineInterface)
+    def disconnect(self):
+        if self._server is not None:
+            self._stop_event.set()
+            self._register_thread.join()
+            self._register_thread = None
+            # daemons stop their workers when registration fails
+            self._register.close()
+            with self._lock:
+                sockets = [tasks for daemon in self._daemons.values()
+                           for tasks in daemon.tasks]
+                sockets.extend(daemon.control
+                               for daemon in self._daemons.values())
+                sockets.extend(self._removed_sockets)
+                self._daemons = {}
+                self._task_daemons = {}
+                self._finished_workers.clear()
+                self._removed_sockets = []
+            for tasks in sockets:
+                tasks.close()
+            self._lost.close()
+            self._server.close()
+            self._register = None
+            self._lost = None
+            self._server = None
+
+    @overrides(EngineInterface)
+    def abort(self, task):
+        """The daemon running the task is asked to signal its worker, which
+        interrupts the task and replies it with a TaskAborted error, as
+        LocalEngine workers do in pull dispatch mode."""
+        with self._lock:
+            daemon_id = self._task_daemons.get(task.id)
+            if daemon_id is None:
+                return
+            daemon = self._daemons[daemon_id]
+            worker = daemon.running[task.id]
+        # control sockets are closed by this thread, see execute()
+        serialize({"worker":worker}, daemon.control)
+
+    @overrides(EngineInterface)
+    def execute(self, task, stdout_path, stderr_path):
+        """Pushes the task to the socket of an idle worker. When every
+        daemon has been lost since the planner asked for free slots, the
+        task is finished with a WorkerLost error."""
+        tasks = None
+        with self._lock:
+            removed, self._removed_sockets = self._removed_sockets, []
+            daemon_id, worker = self._pick_worker(task)
+            if daemon_id is not None:
+                daemon = self._daemons[daemon_id]
+                daemon.running[task.id] = worker
+                self._task_daemons[task.id] = daemon_id
+                tasks = daemon.tasks[worker]
+        for removed_tasks in removed:
+            removed_tasks.close()
+        if tasks is None:
+            self._reply_lost([task.id], "No daemon available")
+        else:
+            self._serialize((task, stdout_path, stderr_path), tasks)
+
+    @overrides(EngineInterface)
+    def finished(self, task):
+        with self._lock:
+            daemon_id = self._task_daemons.pop(task.id, None)
+            if daemon_id is None:
+                return
+            daemon = self._daemons[daemon_id]
+            worker = daemon.running.pop(task.id)
+            daemon.idle.append(worker)
+            self._finished_workers[task.id] = (daemon_id, worker)
+            if len(self._finished_workers) > MAX_LOCALITY_ENTRIES:
+                self._finished_workers.popitem(last=False)
+
+    @overrides(EngineInterface)
+    def accepting_tasks(self):
+        return self.get_free_slots() > 0
+
+    @overrides(EngineInterface)
+    def get_free_slots(self):
+        with self._lock:
+            return sum(len(daemon.idle) for daemon in self._daemons.values())
+
+    @overrides(EngineInterface)
+    def get_max_tasks(self):
+        with self._lock:
+            return sum(daemon.workers for daemon in self._daemons.values())
+
+    @overrides(EngineInterface)
+    def set_options(self, options):
+        self._serialize = common.get_serializer(options)
+        self._serializer = options.get(common.SERIALIZER_OPTION,
+                                       common.PICKLE_SERIALIZER)
+        if HOST_OPTION in options:
+            self._host = options[HOST_OPTION]
+        if PORT_OPTION in options:
+            self._port = int(options[PORT_OPTION])
+        if HEARTBEAT_TIMEOUT_OPTION in options:
+            self._heartbeat_timeout = float(options[HEARTBEAT_TIMEOUT_OPTION])
+
+def get_instance():
+    """Wrapper of RemoteEngine.get_instance()"""
+    return RemoteEngine.get_instance()
+
+#################
+# WORKER DAEMON #
+#################
+
+def _request(register, msg):
+    """Sends msg through the register REQ socket and returns the answer,
+    or None if the engine doesn't answer."""
+    try:
+        serialize(msg, register)
+        return deserialize(register)
+    except nmsg.NanoMsgAPIError:
+        return None
+
+def _start_workers(host, results_uri, info):
+    """Starts a worker process for every tasks port of the engine described
+    by info.
+
+    Workers are executed as new processes instead of forked, nanomsg
+    sockets are not safe across fork() calls.
+    """
+    return [subprocess.Popen([sys.executable, "-m", "parxe.engines.remote",
+                              "worker", "tcp://{}:{}".format(host, port),
+                              results_uri, info["hash"], info["serializer"]])
+            for port in info["tasks_ports"]]
+
+def _serve_control(control, workers, timeout):
+    """Receives abort messages from the control socket during timeout
+    seconds, and signals the worker given by every message."""
+    fd = control.recv_fd
+    deadline = time() + timeout
+    while True:
+        remaining = deadline - time()
+        if remaining <= 0:
+            return
+        readable, _, _ = select.select([fd], [], [], remaining)
+        if readable:
+            msg = deserialize(control)
+            os.kill(workers[msg["worker"]].pid, ABORT_SIGNAL)
+
+def _stop_workers(workers):
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.wait()
+
+def _daemon_main(host, port, num_workers, once=False):
+    """Registers this daemon in the engine at host:port and runs its
+    workers while the engine answers.
+
+    When the engine is lost, workers are stopped and the daemon waits for
+    a new engine, unless once is True. Workers are restarted when the
+    engine gives new tasks ports, after losing this daemon.
+    """
+    register_uri, results_uri = _uris(host, port)
+    register = nmsg.Socket(nmsg.REQ)
+    register.set_int_option(nmsg.SOL_SOCKET, nmsg.RCVTIMEO,
+                            int(HEARTBEAT_INTERVAL * 1000))
+    register.connect(register_uri)
+    daemon = "{}:{}".format(socket.gethostname(), os.getpid())
+    workers = []
+    control = None
+    engine_hash = None
+    tasks_ports = None
+    try:
+        while True:
+            info = _request(register, {"type":REGISTER, "daemon":daemon,
+                                       "workers":num_workers})
+            if engine_hash is not None and \
+               (info is None or info["hash"] != engine_hash):
+                log.info("Engine %s lost", engine_hash)
+                _stop_workers(workers)
+                control.close()
+                workers = []
+                control = None
+                engine_hash = None
+                if once:
+                    return
+            if engine_hash is not None and \
+               info["tasks_ports"] != tasks_ports:
+                log.info("Daemon registered again by engine %s", engine_hash)
+                _stop_workers(workers)
+                control.close()
+                workers = []
+                control = None
+                engine_hash = None
+            if info is not None and engine_hash is None:
+                workers = _start_workers(host, results_uri, info)
+                control = nmsg.Socket(nmsg.PULL)
+                control.connect("tcp://{}:{}".format(host,
+                                                     info["control_port"]))
+                engine_hash = info["hash"]
+                tasks_ports = info["tasks_ports"]
+            if info is not None:
+                _serve_control(control, workers, HEARTBEAT_INTERVAL)
+    finally:
+        _stop_workers(workers)
+        if control is not None:
+            control.close()
+        if engine_hash is not None:
+            _request(register, {"type":UNREGISTER, "daemon":daemon})
+        register.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PARXE remote worker")
+    subparsers = parser.add_subparsers(dest="command")
+    daemon_parser = subparsers.add_parser("daemon")
+    daemon_parser.add_argument("host")
+    daemon_parser.add_argument("port", type=int, nargs="?",
+                               default=DEFAULT_PORT)
+    daemon_parser.add_argument("-n", "--num-workers", type=int,
+                               default=None)
+    daemon_parser.add_argument("--once", action="store_true",
+                               help="exit when the engine is lost")
+    worker_parser = subparsers.add_parser("worker")
+    for arg in ("tasks_uri", "results_uri", "hash", "serializer"):
+        worker_parser.add_argument(arg)
+    args = parser.parse_args(argv)
+    if args.command == "daemon":
+        _daemon_main(args.host, args.port,
+                     args.num_workers or get_num_cores(), args.once)
+    else:
+        _worker_main(args.tasks_uri, args.results_uri, args.hash,
+                     common.SERIALIZERS[args.serializer], None)
+
+if __name__ == "__main__":
+    main()
@@ -35,6 +35,11 @@ class SeqEngine(EngineInterface):
         # The URI describes how nanomsg will connect to this engine
         self._uri = "inproc://" + self._hash
         self._results = []
+        # REQ sockets only allow one request at a time, so this engine
+        # accepts a new task after the previous one has finished
+        self._running = False
+        # Function used to serialize replies, see set_options()
+        self._serialize = serialize
         # Forward declaration of server socket and binded endpoint identifier,
         # for attention of the reader.
         self._server = None
@@ -54,36 +59,55 @@ class SeqEngine(EngineInterface):
             self._client_endpoint = self._client.connect(self._uri)
         return self._server
 
+    @overrides(EngineInterface)
+    def disconnect(self):
+        if self._server is not None:
+            self._client.close()
+            self._server.close()
+            self._client = None
+            self._server = None
+
     @overrides(EngineInterface)
     def abort(self, task):
-        """Aborts the given task id"""
-        raise NotImplementedError
+        """Tasks are executed by execute() method, so they are finished
+        when they could be aborted, nothing is done."""
+        pass
 
     @overrides(EngineInterface)
     def execute(self, task, stdout_path, stderr_path):
         os.chdir(task.wd)
-        func = task.func
-        args = task.args
-        kwargs = task.kwargs
-        result = func(*args, **kwargs)
         open(stdout_path, "w").close()
         open(stderr_path, "w").close()
-        serialize({"id":task.id, "result":result,
-                   "hash":self._hash, "reply":True},
-                  self._client)
+        # exceptions are given back in the reply as done by workers of
+        # other engines, instead of being raised in the planner thread
+        try:
+            result, error = task.run(), None
+        except Exception:
+            result, error = None, common.capture_error()
+            with open(stderr_path, "w") as f:
+                f.write(error[2])
+        self._serialize({"id":task.id, "result":result, "error":error,
+                         "hash":self._hash, "reply":True},
+                        self._client)
+        self._running = True
 
     @overrides(EngineInterface)
     def finished(self, task):
         _ = deserialize(self._client)
+        self._running = False
 
     @overrides(EngineInterface)
     def accepting_tasks(self):
-        return True
+        return not self._running
 
     @overrides(EngineInterface)
     def get_max_tasks(self):
         return 1
 
+    @overrides(EngineInterface)
+    def set_options(self, options):
+        self._serialize = common.get_serializer(options)
+
 def get_instance():
     """Wrapper of SeqEngine.get_instance()"""
     return SeqEngine.get_instance()
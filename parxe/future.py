@@ -5,15 +5,38 @@ Future objects are the result of asynchronous functions execution. Their
 value is unknown at construction, so they offer an interface for gathering
 this value when it is computed, or wait until it is available."""
 
+import atexit
+import itertools
+import logging as log
 import operator
+import os
+import Queue
+import sys
 import threading
 
+from time import time
+
 from parxe.common import overrides, wait_until_exists
+from parxe.logs import ConcatLogReader, LogReader, StringLogReader
+from parxe.shm import SharedResult
 
 PENDING_STATE = "pending"
 RUNNING_STATE = "running"
 FINISHED_STATE = "finished"
 
+# Maximum number of threads used to execute do_work functions
+MAX_EXECUTOR_THREADS = 16
+# Maximum time waited for executor threads at interpreter exit
+SHUTDOWN_TIMEOUT = 1 # seconds
+
+class FutureAborted(Exception):
+    """Raised by get() method of aborted futures."""
+    pass
+
+class FutureTimeout(Exception):
+    """Raised by as_completed() when its timeout is over."""
+    pass
+
 def _cast(obj):
     """Casts non Future objects to NonFuture."""
     if isinstance(obj, Future):
@@ -23,18 +46,122 @@ def _cast(obj):
 
 def _thread_run_for_result(future, func, *args):
     """This function executes func(*args) and stores
-    its result by means of future.set_result() method."""
-    result = func(future, *args)
-    future._set_result(result)
+    its result by means of future.set_result() method.
+
+    Exceptions raised by func are stored into the future and raised again
+    by its get() method. When func gets the value of an aborted future, this
+    future is aborted too. Nothing is done for futures aborted before
+    func execution."""
+    if future.finished():
+        return
+    try:
+        result = func(future, *args)
+    except FutureAborted:
+        future._set_aborted()
+    except Exception:
+        future._set_exception(sys.exc_info())
+    else:
+        future._set_result(result)
+
+class _Executor(object):
+    """A bounded pool of daemon threads shared by all Future objects.
+
+    Threads are started on demand, up to max_threads, and reused for
+    following functions. Functions are executed in submission order. A
+    None item in the queue stops the thread which receives it.
+    """
+    def __init__(self, max_threads):
+        self._max_threads = max_threads
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._num_threads = 0
+        self._num_idle = 0
+
+    def submit(self, func, *args):
+        """Executes func(*args) in one of the pool threads."""
+        with self._lock:
+            self._queue.put((func, args))
+            if self._num_idle > 0:
+                self._num_idle -= 1
+            elif self._num_threads < self._max_threads:
+                self._num_threads += 1
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        """Stops every pool thread once queued functions are executed,
+        waiting for them at most timeout seconds.
+
+        Called at interpreter exit, so idle threads are not blocked in the
+        queue while module globals are cleared.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            self._num_threads = 0
+            self._num_idle = 0
+            for _ in threads:
+                self._queue.put(None)
+        deadline = time() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time()))
+
+    def _work(self):
+        """Target of every pool thread"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            func, args = item
+            func(*args)
+            with self._lock:
+                # threads of a previous shutdown() are not counted
+                if threading.current_thread() in self._threads:
+                    self._num_idle += 1
+
+_executor = _Executor(MAX_EXECUTOR_THREADS)
+atexit.register(_executor.shutdown)
+
+def _after_all(values, callback):
+    """Calls callback() once every Future in values list is finished.
+
+    Non Future values are ignored, and callback() is called immediately
+    when no Future is found in the list.
+    """
+    futures = [val for val in values if isinstance(val, Future)]
+    if not futures:
+        callback()
+        return
+    lock = threading.Lock()
+    remaining = [len(futures)]
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            is_last = remaining[0] == 0
+        if is_last:
+            callback()
+    for fut in futures:
+        fut.add_done_callback(done)
+
+def _abort_after_any(values, future):
+    """Aborts future as soon as any Future in values list is aborted."""
+    def done(fut):
+        if fut.aborted():
+            future.abort()
+    for val in values:
+        if isinstance(val, Future):
+            val.add_done_callback(done)
 
 class Future(object):
     """Future class for result of parallel functions execution.
 
     Instances of this class execute do_work function given in the
-    constructor using a dedicated Python thread (from threading
-    library). The do_work function has the responsability of
-    indicating the running state of the object by calling
-    set_as_running() method. This do_work function receives
+    constructor using a thread from a pool shared by all futures, so
+    the constructor returns without waiting for it. The do_work function
+    has the responsibility of indicating the running state of the object
+    by calling set_as_running() method. This do_work function receives
     as arguments the future object and a variable list of arguments
     given to __init__ constructor.
     
@@ -49,19 +176,42 @@ class Future(object):
     """
 
     def __init__(self, do_work, *args):
-        """do_work(self, *args) will be executed in a Python thread."""
+        """do_work(self, *args) will be executed in a pool thread.
+
+        When do_work is None no thread is executed, and the result should
+        be given by means of _set_result() method.
+        """
         self._result = None
         self._stdout = None
         self._stderr = None
         self._state = PENDING_STATE
         self._err = None
         self._out = None
+        self._exc_info = None
+        self._aborted = False
         self._running_condition = threading.Condition()
-        self._do_work_thread = threading.Thread(
-            target=_thread_run_for_result,
-            args=[self, do_work] + list(args),
-        )
-        self._do_work_thread.run()
+        self._finished_event = threading.Event()
+        self._callbacks = []
+        if do_work is not None:
+            self._submit(do_work, *args)
+
+    def _submit(self, do_work, *args):
+        """Executes do_work(self, *args) in a pool thread."""
+        _executor.submit(_thread_run_for_result, self, do_work, *args)
+
+    def add_done_callback(self, callback):
+        """Appends a function which will be called as callback(self) when
+        this future is finished.
+
+        If the future is in finished state, callback is called immediately.
+        Callbacks are executed by the thread finishing the future, so they
+        should be short and should not block.
+        """
+        with self._running_condition:
+            if not self.finished():
+                self._callbacks.append(callback)
+                return
+        callback(self)
 
     def set_stdout(self, value):
         self._stdout = value
@@ -72,25 +222,41 @@ class Future(object):
     def set_as_running(self):
         """Changes the state of the object from pending to running.
         
-        This method should be called by do_work function."""
+        This method should be called by do_work function. Nothing is
+        done when the future has been aborted."""
         with self._running_condition:
+            if self._aborted:
+                return
             assert self._state == PENDING_STATE
             self._state = RUNNING_STATE
-            self._running_condition.notify()
+            self._running_condition.notify_all()
 
     def abort(self):
-        """Aborts the computation of this future."""
-        raise NotImplementedError
+        """abort() -> bool
+
+        Aborts the computation of this future, which is finished at once
+        and its get() method raises FutureAborted. Futures depending on
+        this one are aborted too. Returns False when the future was
+        already finished.
+
+        The do_work function is not interrupted when it is running, but
+        its result is discarded.
+        """
+        return self._set_aborted()
 
     def get(self):
         """Waits until the future is finished and returns the result
         of this execution.
 
         If the object is in finished state, this method returns the
-        result without any waiting.
+        result without any waiting. An exception raised by do_work
+        function is raised again by this method.
         """
         if not self.finished():
             self.wait()
+        if self._exc_info is not None:
+            exc_type, exc_value, exc_traceback = self._exc_info
+            raise exc_type, exc_value, exc_traceback
         return self._result
 
     def wait(self, timeout=None):
@@ -106,7 +272,7 @@ class Future(object):
         Once this method returns True indicating finished state,
         it cannot be called again.
         """
-        self._do_work_thread.join(timeout)
+        self._finished_event.wait(timeout)
         return self.finished()
 
     def wait_until_running(self, timeout=None):
@@ -118,8 +284,8 @@ class Future(object):
 
         This method will return False when finishing because of the timeout.
         """
-        if self.pending():
-            with self._running_condition:
+        with self._running_condition:
+            if self.pending():
                 self._running_condition.wait(timeout)
         return not self.pending()
 
@@ -128,10 +294,40 @@ class Future(object):
 
         Besides, this method sets the future state to finished. This
         method is called by the thread target function and should not
-        be called by anyone else out of this module.
+        be called by anyone else out of this module. Results given to
+        finished futures, as aborted ones, are ignored.
         """
-        self._result = value
-        self._state = FINISHED_STATE
+        return self._finish(value, None)
+
+    def _finish(self, value, exc_info, aborted=False):
+        """Sets the future state to finished unless it was finished before,
+        and returns True when the state is changed."""
+        with self._running_condition:
+            if self._state == FINISHED_STATE:
+                return False
+            self._result = value
+            self._exc_info = exc_info
+            self._aborted = aborted
+            self._state = FINISHED_STATE
+            self._running_condition.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+        self._finished_event.set()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                log.exception("Error in Future callback")
+        return True
+
+    def _set_exception(self, exc_info):
+        """Stores the exception raised by do_work function, given as a
+        sys.exc_info() tuple, and sets the future state to finished."""
+        return self._finish(None, exc_info)
+
+    def _set_aborted(self):
+        """Sets the future state to finished with a FutureAborted error."""
+        error = FutureAborted("Future has been aborted")
+        return self._finish(None, (FutureAborted, error, None), aborted=True)
 
     def finished(self):
         """Indicates if the future is in finished state"""
@@ -145,24 +341,65 @@ class Future(object):
         """Indicates if the future is in pending state"""
         return self._state == PENDING_STATE
 
+    def aborted(self):
+        """Indicates if the future has been aborted"""
+        return self._aborted
+
+    def failed(self):
+        """Indicates if the future is finished with an error, which is
+        raised by get() method"""
+        return self.finished() and self._exc_info is not None and \
+            not self._aborted
+
     def get_stderr(self):
-        """Reads stderr file content or the error state field."""
+        """Reads stderr file content or the error state field.
+
+        The whole content is loaded in memory, use stderr_log() for large
+        logs.
+        """
         _ = self.get() # force finished wait
         if self._stderr is not None:
             if wait_until_exists(self._stderr):
                 with open(self._stderr) as f:
-                    self._err = f.read()
+                    return f.read()
         return self._err
 
     def get_stdout(self):
-        """Reads stdout file content or the output state field."""
+        """Reads stdout file content or the output state field.
+
+        The whole content is loaded in memory, use stdout_log() for large
+        logs.
+        """
         _ = self.get() # force finished wait
         if self._stdout is not None:
             if wait_until_exists(self._stdout):
                 with open(self._stdout) as f:
-                    self._out = f.read()
+                    return f.read()
         return self._out
 
+    def _log(self, path, value):
+        _ = self.get() # force finished wait
+        if path is not None:
+            wait_until_exists(path)
+            return LogReader(path)
+        return StringLogReader(value)
+
+    def stderr_log(self):
+        """stderr_log() -> BaseLogReader
+
+        Returns a reader over stderr file or the error state field, which
+        allows to read it by chunks, lines, head, tail or byte ranges.
+        """
+        return self._log(self._stderr, self._err)
+
+    def stdout_log(self):
+        """stdout_log() -> BaseLogReader
+
+        Returns a reader over stdout file or the output state field, which
+        allows to read it by chunks, lines, head, tail or byte ranges.
+        """
+        return self._log(self._stdout, self._out)
+
     def __str__(self):
         """Represents a future with a string as:
         Future in RUNNING state
@@ -173,30 +410,31 @@ class Future(object):
         """Appends the execution of a function over the output of this Future.
         
         The function will be called as func(self.get()) when the result of this
-        Future is ready.
+        Future is ready. As arithmetic operators, it builds a lazy
+        ExpressionFuture.
         """
-        return ConditionedFuture(func, self)
+        return _expression(func, self)
 
     def __add__(self, other):
-        return ConditionedFuture(operator.__add__, self, _cast(other))
+        return _expression(operator.__add__, self, other)
 
     def __sub__(self, other):
-        return ConditionedFuture(operator.__sub__, self, _cast(other))
+        return _expression(operator.__sub__, self, other)
 
     def __mul__(self, other):
-        return ConditionedFuture(operator.__mul__, self, _cast(other))
+        return _expression(operator.__mul__, self, other)
 
     def __div__(self, other):
-        return ConditionedFuture(operator.__div__, self, _cast(other))
+        return _expression(operator.__div__, self, other)
 
     def __pow__(self, other):
-        return ConditionedFuture(operator.__pow__, self, _cast(other))
+        return _expression(operator.__pow__, self, other)
 
     def __mod__(self, other):
-        return ConditionedFuture(operator.__mod__, self, _cast(other))
+        return _expression(operator.__mod__, self, other)
 
     def __neg__(self):
-        return ConditionedFuture(operator.__neg__, self)
+        return _expression(operator.__neg__, self)
 
 ############################
 # CONDITIONED FUTURE CLASS #
@@ -216,39 +454,197 @@ class ConditionedFuture(Future):
 
     The function computation is delayed until all the arguments
     given in the constructor are finished. It allow to mix together
-    Future and non Future objects.
+    Future and non Future objects. No thread is used while waiting for
+    the arguments, the function is sent to the pool once all of them
+    are finished.
+
+    The future is aborted as soon as any of its arguments is aborted.
     """
     def __init__(self, func, *args):
-        super(ConditionedFuture, self)\
-        .__init__(
-            _conditioned_do_work,
-            func,
-            *args
-        )
+        super(ConditionedFuture, self).__init__(None)
+        _abort_after_any(args, self)
+        _after_all(args, lambda: self._submit(_conditioned_do_work,
+                                              func, *args))
 
     @overrides(Future)
     def abort(self):
-        raise NotImplementedError
+        """Aborts this future, the function is never executed when its
+        arguments are not finished. The arguments are not aborted, they
+        may be shared with other futures."""
+        return super(ConditionedFuture, self).abort()
+
+###########################
+# EXPRESSION FUTURE CLASS #
+###########################
+
+def _fold(arg):
+    """Replaces finished NonFuture objects by their constant value."""
+    if isinstance(arg, NonFuture):
+        return arg.get()
+    return arg
+
+def _expression(func, *args):
+    """Builds an ExpressionFuture for func(*args).
+
+    When no argument is a Future, func(*args) is computed ahead of time
+    and returned as a NonFuture.
+    """
+    args = [_fold(arg) for arg in args]
+    if not any(isinstance(arg, Future) for arg in args):
+        try:
+            return NonFuture(func(*args))
+        except Exception:
+            # the error will be raised when getting the expression value
+            pass
+    return ExpressionFuture(func, *args)
+
+def _expression_do_work(self, nodes):
+    """Evaluates the given list of nodes, sorted in post-order, finishing
+    every node with its value, and returns the value of the last one."""
+    self.set_as_running()
+    for node in nodes[:-1]:
+        if node.finished():
+            continue
+        node.set_as_running()
+        try:
+            node._set_result(node._evaluate())
+        except Exception:
+            node._set_exception(sys.exc_info())
+    return self._evaluate()
+
+class ExpressionFuture(Future):
+    """A lazy Future for expressions built by Future operators.
+
+    Arguments of arithmetic operators and after() method which are
+    ExpressionFuture objects not yet evaluated become nodes of a tree, so
+    an expression as -(a*b + c) % d is evaluated in one step once a, b, c
+    and d are finished. The evaluation is started when the value is
+    required by get(), wait(), wait_until_running() or
+    add_done_callback() methods. Every node of the tree is finished with
+    its value, so nodes shared with other expressions are evaluated only
+    once.
+    """
+    def __init__(self, func, *args):
+        super(ExpressionFuture, self).__init__(None)
+        self._func = func
+        self._args = [_fold(arg) for arg in args]
+        self._forced = False
+
+    def _claim(self):
+        """Marks the evaluation of this expression as started, and returns
+        False when it was started before."""
+        with self._running_condition:
+            if self._forced:
+                return False
+            self._forced = True
+            return True
+
+    def _evaluate(self):
+        """Returns func(*args) given the values of finished arguments"""
+        args = [arg.get() if isinstance(arg, Future) else arg
+                for arg in self._args]
+        return self._func(*args)
+
+    def _nodes(self):
+        """Returns the lazy expressions of the tree rooted at this object
+        sorted in post-order, claiming their evaluation. Expressions
+        claimed before by other trees are their leaves."""
+        nodes = []
+        visited = set()
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                nodes.append(node)
+            elif id(node) not in visited:
+                visited.add(id(node))
+                stack.append((node, True))
+                for arg in node._args:
+                    if isinstance(arg, ExpressionFuture) and arg._claim():
+                        stack.append((arg, False))
+        return nodes
+
+    def _force(self):
+        """Starts the evaluation of the expression once every Future in its
+        leaves is finished."""
+        if not self._claim():
+            return
+        nodes = self._nodes()
+        node_ids = set(id(node) for node in nodes)
+        leaves = [arg for node in nodes for arg in node._args
+                  if isinstance(arg, Future) and id(arg) not in node_ids]
+        _abort_after_any(leaves, self)
+        Future.add_done_callback(self,
+                                 lambda fut: fut._release_nodes(nodes))
+        _after_all(leaves, lambda: self._submit(_expression_do_work, nodes))
+
+    def _release_nodes(self, nodes):
+        """Called once this expression is finished. When it has been
+        aborted before evaluating its nodes, every unfinished node is
+        evaluated on its own, as they may be shared with other
+        expressions."""
+        pending = [node for node in nodes[:-1] if not node.finished()]
+        for node in pending:
+            with node._running_condition:
+                node._forced = False
+        for node in pending:
+            node._force()
+
+    @overrides(Future)
+    def get(self):
+        self._force()
+        return super(ExpressionFuture, self).get()
+
+    @overrides(Future)
+    def wait(self, timeout=None):
+        self._force()
+        return super(ExpressionFuture, self).wait(timeout)
+
+    @overrides(Future)
+    def wait_until_running(self, timeout=None):
+        self._force()
+        return super(ExpressionFuture, self).wait_until_running(timeout)
+
+    @overrides(Future)
+    def add_done_callback(self, callback):
+        self._force()
+        super(ExpressionFuture, self).add_done_callback(callback)
+
+    @overrides(Future)
+    def abort(self):
+        """Aborts this expression, its operands are not aborted."""
+        return super(ExpressionFuture, self).abort()
 
 ######################
 # UNION FUTURE CLASS #
 ######################
 
-def _union_do_work(self, args_list):
+def _union_do_work(self, args_list, chain):
     self.set_as_running()
     values = list(args_list[:])
     for i, val in enumerate(values):
         values[i] = _cast(val).get()
+    if chain:
+        return list(itertools.chain.from_iterable(values))
     return values
 
 class UnionFuture(Future):
     """A Future over a list of Futures.
 
-    The result of this Future is a list of values.
+    The result of this Future is a list of values. When chain=True, the
+    result of every Future in the list should be a list, and the result
+    of this Future is their concatenation. The list is gathered once
+    every Future in the list is finished.
+
+    The future is aborted as soon as any Future in the list is aborted,
+    and aborting it aborts the whole list.
     """
-    def __init__(self, args_list):
-        super(UnionFuture, self).__init__(_union_do_work, args_list)
+    def __init__(self, args_list, chain=False):
+        super(UnionFuture, self).__init__(None)
         self._args_list = args_list
+        _abort_after_any(args_list, self)
+        _after_all(args_list, lambda: self._submit(_union_do_work,
+                                                   args_list, chain))
 
     @overrides(Future)
     def get_stdout(self):
@@ -262,26 +658,185 @@ class UnionFuture(Future):
         stderr = [val.get_stderr() for val in self._args_list]
         return '\n'.join(stderr)
 
+    @overrides(Future)
+    def stdout_log(self):
+        """A reader over the concatenation of stdout of every Future in the
+        list, which are read lazily."""
+        _ = self.get() # force finished wait
+        return ConcatLogReader([_cast(val).stdout_log()
+                                for val in self._args_list])
+
+    @overrides(Future)
+    def stderr_log(self):
+        """A reader over the concatenation of stderr of every Future in the
+        list, which are read lazily."""
+        _ = self.get() # force finished wait
+        return ConcatLogReader([_cast(val).stderr_log()
+                                for val in self._args_list])
+
     @overrides(Future)
     def abort(self):
-        raise NotImplementedError
+        """Aborts this future and every unfinished Future in the list, as
+        the tasks of a dmap() call."""
+        aborted = super(UnionFuture, self).abort()
+        for val in self._args_list:
+            if isinstance(val, Future):
+                val.abort()
+        return aborted
 
 
 ####################
 # NON FUTURE CLASS #
 ####################
 
-def _non_future_do_work(self, value):
-    self.set_as_running()
-    return value
-
 class NonFuture(Future):
     """A fake one wrapping a non future object.
 
-    This class is useful to mix together Future and NonFuture objects."""
+    This class is useful to mix together Future and NonFuture objects. It
+    is finished at construction, without using any thread."""
     def __init__(self, value):
-        super(NonFuture, self).__init__(_non_future_do_work, value)
+        super(NonFuture, self).__init__(None)
+        self.set_as_running()
+        self._set_result(value)
 
     @overrides(Future)
     def abort(self):
-        raise NotImplementedError
+        """NonFuture objects are finished, nothing is done."""
+        return False
+
+
+#####################
+# TASK FUTURE CLASS #
+#####################
+
+class TaskFuture(Future):
+    """A Future for the result of a Task executed by an engine.
+
+    No thread is executed by this class, the planner is responsible of
+    changing its state when the task is dispatched and when the engine
+    replies with the task result. When given, abort_task(task) is called
+    once the future is aborted, allowing the planner to abort the task.
+    """
+    def __init__(self, task, abort_task=None):
+        super(TaskFuture, self).__init__(None)
+        self._task = task
+        self._abort_task = abort_task
+        # Number of tasks with the SharedResult of this future as argument
+        # which are not finished, and the path of its file once loaded
+        self._consumers = 0
+        self._shared_path = None
+
+    @property
+    def task(self):
+        return self._task
+
+    @overrides(Future)
+    def get(self):
+        """As Future.get(), but results given by the engine as a SharedResult
+        are loaded in the first call."""
+        result = super(TaskFuture, self).get()
+        if isinstance(result, SharedResult):
+            with self._running_condition:
+                if isinstance(self._result, SharedResult):
+                    remove = self._consumers == 0
+                    if not remove:
+                        self._shared_path = self._result.path
+                    self._result = self._result.load(remove)
+                result = self._result
+        return result
+
+    def _share(self):
+        """Returns the result of this finished future to be given as
+        argument of other task.
+
+        A SharedResult not loaded is returned as is, and its file is kept
+        until _release() is called.
+        """
+        with self._running_condition:
+            if isinstance(self._result, SharedResult):
+                self._consumers += 1
+                return self._result
+        return self.get()
+
+    def _release(self):
+        """Called when a task given the result of _share() is finished.
+
+        The file is removed once every such task is finished. A result not
+        loaded yet is mapped into memory before, so get() still returns
+        it.
+        """
+        with self._running_condition:
+            self._consumers -= 1
+            if self._consumers > 0:
+                return
+            if isinstance(self._result, SharedResult):
+                self._result = self._result.load()
+                return
+            path, self._shared_path = self._shared_path, None
+        if path is not None:
+            os.remove(path)
+
+    @overrides(Future)
+    def abort(self):
+        """Aborts this future and its task, which is removed from the
+        planner queue or aborted by the engine."""
+        if not super(TaskFuture, self).abort():
+            return False
+        if self._abort_task is not None:
+            self._abort_task(self._task)
+        return True
+
+#####################
+# WAITING FUNCTIONS #
+#####################
+
+def _remaining(deadline):
+    """Returns the seconds until deadline, or None for no deadline"""
+    if deadline is None:
+        return None
+    return max(0, deadline - time())
+
+def as_completed(futures, timeout=None):
+    """as_completed(futures, timeout=None) -> generator
+
+    Yields the given futures as soon as they are finished, in finishing
+    order, so results can be processed while the rest are computed. Non
+    Future values are yielded as finished NonFuture objects.
+
+    When timeout is given, FutureTimeout is raised if not every future is
+    finished after timeout seconds since the call.
+    """
+    deadline = None if timeout is None else time() + timeout
+    futures = [_cast(fut) for fut in futures]
+    done = Queue.Queue()
+    for fut in futures:
+        fut.add_done_callback(done.put)
+    for _ in futures:
+        try:
+            yield done.get(timeout=_remaining(deadline))
+        except Queue.Empty:
+            raise FutureTimeout("Futures not finished after {} seconds"
+                                .format(timeout))
+
+def wait_any(futures, timeout=None):
+    """wait_any(futures, timeout=None) -> Future or None
+
+    Waits until any of the given futures is finished and returns it.
+    None is returned when the timeout is over or the list is empty.
+    """
+    try:
+        return next(as_completed(futures, timeout))
+    except (FutureTimeout, StopIteration):
+        return None
+
+def wait_all(futures, timeout=None):
+    """wait_all(futures, timeout=None) -> bool
+
+    Waits until every given future is finished, or until the timeout is
+    over. Returns True when every future is finished.
+    """
+    deadline = None if timeout is None else time() + timeout
+    for fut in futures:
+        if not _cast(fut).wait(_remaining(deadline)):
+            return False
+    return True
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""This module implements readers over stdout and stderr of tasks.
+
+Logs of tasks can be very large, so readers never load a whole log in
+memory. They allow to read byte ranges, iterate over chunks or lines, and
+to take the first or the last lines of the log, keeping memory bounded by
+CHUNK_SIZE and the length of the requested lines."""
+
+import os
+
+# Maximum number of bytes read from a log at once
+CHUNK_SIZE = 64 * 1024
+# Default number of lines returned by head() and tail()
+DEFAULT_NUM_LINES = 10
+
+class BaseLogReader(object):
+    """Base class of log readers.
+
+    Derived classes implement size() and _read_range() methods, the rest
+    of the interface is implemented in terms of them.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self._chunk_size = chunk_size
+
+    def size(self):
+        """size() -> int
+
+        Returns the number of bytes of the log.
+        """
+        raise NotImplementedError
+
+    def _read_range(self, start, end):
+        """Returns the bytes between start and end, where end - start is
+        never larger than chunk_size."""
+        raise NotImplementedError
+
+    def _bounds(self, start, end):
+        size = self.size()
+        if end is None or end > size:
+            end = size
+        return max(0, start), end
+
+    def chunks(self, start=0, end=None):
+        """chunks(start=0, end=None) -> iterator of str
+
+        Iterates over the bytes of the log between start and end offsets,
+        in chunks of at most chunk_size bytes.
+        """
+        start, end = self._bounds(start, end)
+        while start < end:
+            stop = min(end, start + self._chunk_size)
+            data = self._read_range(start, stop)
+            if not data:
+                return
+            yield data
+            start += len(data)
+
+    def read(self, start=0, end=None):
+        """read(start=0, end=None) -> str
+
+        Returns the bytes of the log between start and end offsets.
+        """
+        return "".join(self.chunks(start, end))
+
+    def lines(self):
+        """lines() -> iterator of str
+
+        Iterates over the lines of the log, keeping line terminators as
+        file objects do.
+        """
+        pending = ""
+        for data in self.chunks():
+            pending += data
+            pos = 0
+            while True:
+                eol = pending.find("\n", pos)
+                if eol < 0:
+                    break
+                yield pending[pos:eol + 1]
+                pos = eol + 1
+            pending = pending[pos:]
+        if pending:
+            yield pending
+
+    def __iter__(self):
+        return self.lines()
+
+    def head(self, n=DEFAULT_NUM_LINES):
+        """head(n=10) -> list of str
+
+        Returns the first n lines of the log.
+        """
+        result = []
+        if n <= 0:
+            return result
+        for line in self.lines():
+            result.append(line)
+            if len(result) == n:
+                break
+        return result
+
+    def tail(self, n=DEFAULT_NUM_LINES):
+        """tail(n=10) -> list of str
+
+        Returns the last n lines of the log, reading it backwards.
+        """
+        if n <= 0:
+            return []
+        pos = self.size()
+        data = ""
+        # a trailing line terminator doesn't start a new line
+        while pos > 0 and data[:-1].count("\n") < n:
+            start = max(0, pos - self._chunk_size)
+            data = self._read_range(start, pos) + data
+            pos = start
+        return data.splitlines(True)[-n:]
+
+    def __str__(self):
+        return self.read()
+
+class LogReader(BaseLogReader):
+    """A reader over a log file.
+
+    A None path is read as an empty log.
+    """
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        super(LogReader, self).__init__(chunk_size)
+        self._path = path
+
+    @property
+    def path(self):
+        return self._path
+
+    def size(self):
+        if self._path is None:
+            return 0
+        try:
+            return os.path.getsize(self._path)
+        except OSError:
+            return 0
+
+    def _read_range(self, start, end):
+        with open(self._path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def chunks(self, start=0, end=None):
+        """As BaseLogReader.chunks(), but the file is opened once."""
+        start, end = self._bounds(start, end)
+        if start >= end:
+            return
+        with open(self._path, "rb") as f:
+            f.seek(start)
+            while start < end:
+                data = f.read(min(self._chunk_size, end - start))
+                if not data:
+                    return
+                yield data
+                start += len(data)
+
+class StringLogReader(BaseLogReader):
+    """A reader over a log given as a string."""
+    def __init__(self, data, chunk_size=CHUNK_SIZE):
+        super(StringLogReader, self).__init__(chunk_size)
+        self._data = data or ""
+
+    def size(self):
+        return len(self._data)
+
+    def _read_range(self, start, end):
+        return self._data[start:end]
+
+class ConcatLogReader(BaseLogReader):
+    """A reader over the concatenation of several log readers.
+
+    Readers are joined by the given separator, as str.join() does, but
+    the logs are read lazily, only when their bytes are requested.
+    """
+    def __init__(self, readers, separator="\n", chunk_size=CHUNK_SIZE):
+        super(ConcatLogReader, self).__init__(chunk_size)
+        self._readers = []
+        for i, reader in enumerate(readers):
+            if i > 0 and separator:
+                self._readers.append(StringLogReader(separator, chunk_size))
+            self._readers.append(reader)
+        self._sizes = None
+
+    def _reader_sizes(self):
+        if self._sizes is None:
+            self._sizes = [reader.size() for reader in self._readers]
+        return self._sizes
+
+    def size(self):
+        return sum(self._reader_sizes())
+
+    def chunks(self, start=0, end=None):
+        """As BaseLogReader.chunks(), but chunks never cross the boundary
+        between two logs."""
+        start, end = self._bounds(start, end)
+        offset = 0
+        for reader, size in zip(self._readers, self._reader_sizes()):
+            if offset >= end:
+                return
+            if start < offset + size:
+                for data in reader.chunks(max(0, start - offset),
+                                          end - offset):
+                    yield data
+            offset += size
+
+    def _read_range(self, start, end):
+        return "".join(self.chunks(start, end))
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""This module implements FileNotifier class.
+
+A FileNotifier allows waiting for the creation of files without polling the
+filesystem. It uses Linux inotify through ctypes, watching the directory of
+every waited file. One thread serves all the waited files, and files in
+network filesystems, where inotify doesn't see changes done by other hosts,
+are checked periodically by the same thread."""
+
+import ctypes
+import ctypes.util
+import errno
+import logging as log
+import os
+import select
+import struct
+import threading
+
+# Maximum time between checks of files which cannot be watched by inotify
+DEFAULT_POLL_STEP = 0.5 # seconds
+# Filesystem types where inotify cannot be used
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smbfs", "smb3", "lustre",
+                       "gpfs", "fuse.sshfs", "afs", "ceph", "glusterfs")
+MOUNTS_PATH = "/proc/mounts"
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+def _load_libc():
+    """Returns libc with inotify functions, or None if not available"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+def _read_mounts():
+    """Returns a list of (mount point, filesystem type) tuples"""
+    try:
+        with open(MOUNTS_PATH) as f:
+            return [(fields[1], fields[2])
+                    for fields in (line.split() for line in f)
+                    if len(fields) > 2]
+    except IOError:
+        return []
+
+def is_network_filesystem(path, mounts=None):
+    """Indicates if the given path belongs to a network filesystem."""
+    if mounts is None:
+        mounts = _read_mounts()
+    path = os.path.realpath(path)
+    fs_type = None
+    best = -1
+    for mount_point, mount_type in mounts:
+        prefix = mount_point.rstrip("/") + "/"
+        if (path + "/").startswith(prefix) and len(prefix) > best:
+            best = len(prefix)
+            fs_type = mount_type
+    return fs_type in NETWORK_FILESYSTEMS
+
+class FileNotifier(object):
+    """Notifies the creation of files to threads waiting for them.
+
+    Use wait() method from any thread. The watcher thread is started with
+    the first wait() call.
+    """
+    def __init__(self, poll_step=DEFAULT_POLL_STEP):
+        self._poll_step = poll_step
+        self._lock = threading.Lock()
+        # path -> [threading.Event, number of waiting threads, poll step]
+        self._waiting = {}
+        # directory -> inotify watch descriptor, None when polled
+        self._watches = {}
+        # inotify watch descriptor -> directory
+        self._directories = {}
+        self._mounts = None
+        self._thread = None
+        self._libc = _load_libc()
+        self._fd = None
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+
+    def _watch(self, directory):
+        """Adds an inotify watch for directory, or None when it should be
+        polled."""
+        if self._fd is None or not os.path.isdir(directory):
+            return None
+        if self._mounts is None:
+            self._mounts = _read_mounts()
+        if is_network_filesystem(directory, self._mounts):
+            return None
+        wd = self._libc.inotify_add_watch(self._fd, directory, _WATCH_MASK)
+        if wd < 0:
+            log.debug("inotify_add_watch failed: %s",
+                      os.strerror(ctypes.get_errno()))
+            return None
+        self._directories[wd] = directory
+        return wd
+
+    def _register(self, path, poll_step):
+        """Returns the Event which will be set when path exists"""
+        with self._lock:
+            waiting = self._waiting.get(path)
+            if waiting is None:
+                waiting = self._waiting[path] = [threading.Event(), 0,
+                                                 self._poll_step]
+                directory = os.path.dirname(path)
+                if directory not in self._watches:
+                    self._watches[directory] = self._watch(directory)
+            waiting[1] += 1
+            if poll_step is not None:
+                waiting[2] = min(waiting[2], poll_step)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop)
+                self._thread.daemon = True
+                self._thread.start()
+        return waiting[0]
+
+    def _unregister(self, path):
+        """Removes path, and the watch of its directory if not needed"""
+        with self._lock:
+            waiting = self._waiting[path]
+            waiting[1] -= 1
+            if waiting[1] > 0:
+                return
+            del self._waiting[path]
+            directory = os.path.dirname(path)
+            if any(os.path.dirname(p) == directory for p in self._waiting):
+                return
+            wd = self._watches.pop(directory, None)
+            if wd is not None:
+                self._directories.pop(wd, None)
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _notify(self, path):
+        """Sets the Event of path, if any"""
+        with self._lock:
+            waiting = self._waiting.get(path)
+        if waiting is not None:
+            waiting[0].set()
+
+    def _read_events(self):
+        """Reads inotify events, notifying created files"""
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        pos = 0
+        while pos < len(data):
+            wd, _, _, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            with self._lock:
+                directory = self._directories.get(wd)
+            if directory is not None and name:
+                self._notify(os.path.join(directory, name))
+
+    def _poll_files(self):
+        """Checks the existence of files in directories without a watch"""
+        with self._lock:
+            paths = [path for path in self._waiting
+                     if self._watches.get(os.path.dirname(path)) is None]
+        for path in paths:
+            if os.path.isfile(path):
+                self._notify(path)
+
+    def _loop(self):
+        """Target of the watcher thread"""
+        fds = [self._fd] if self._fd is not None else []
+        # module globals are cleared at interpreter exit, while this daemon
+        # thread may still be running
+        select_ = select.select
+        while True:
+            with self._lock:
+                poll_step = min([self._poll_step] +
+                                [w[2] for w in self._waiting.values()])
+            readable, _, _ = select_(fds, [], [], poll_step)
+            if readable:
+                self._read_events()
+            self._poll_files()
+
+    def wait(self, path, timeout=None, poll_step=None):
+        """Waits until path exists or the timeout expires.
+
+        Returns True when path exists, False when the timeout expired. When
+        path cannot be watched by inotify, it is checked every poll_step
+        seconds, or every DEFAULT_POLL_STEP seconds if poll_step is larger.
+        """
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            return True
+        event = self._register(path, poll_step)
+        try:
+            # the file may have been created before adding the watch
+            if os.path.isfile(path):
+                return True
+            event.wait(timeout)
+            return event.is_set() or os.path.isfile(path)
+        finally:
+            self._unregister(path)
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+def get_notifier():
+    """Returns the FileNotifier shared by all the threads."""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = FileNotifier()
+        return _notifier
@@ -1,7 +1,106 @@
 # -*- coding: utf-8 -*-
 """This module implements Planner class."""
 
-from parxe.common import Singleton, serialize, deserialize
+import collections
+import heapq
+import itertools
+import logging as log
+import math
+import os
+import select
+import shutil
+import tempfile
+import threading
+import weakref
+
+from time import time
+
+from parxe.broadcast import store
+from parxe.common import Singleton, TaskError, serialize, deserialize
+from parxe.future import Future, TaskFuture, _after_all
+from parxe.results_cache import task_key
+from parxe.shm import SharedResult, discard
+from parxe.task import Task
+
+STDOUT_SUFFIX = ".out"
+STDERR_SUFFIX = ".err"
+# While tasks are pending, the event loop checks the engine free slots at
+# least once per interval, engines capacity may grow without replies
+DISPATCH_INTERVAL = 0.1 # seconds
+# While tasks are running with speculative execution enabled, the event
+# loop looks for stragglers at least once per interval
+SPECULATION_INTERVAL = 1.0 # seconds
+# Number of last task durations used to compute the speculative percentile
+DURATIONS_WINDOW = 1000
+# Stragglers are not looked for until this number of tasks have finished
+MIN_SPECULATION_SAMPLES = 10
+# Delay before the first retry of a failed task, doubled by every retry
+DEFAULT_RETRY_BACKOFF = 1.0 # seconds
+# Submitters tags behind the last popped task are forgotten when there
+# are more than this number of them
+MAX_SUBMITTER_TAGS = 1024
+
+def _percentile(values, percentile):
+    """Returns the given percentile, between 0 and 100, of values"""
+    values = sorted(values)
+    index = int(math.ceil(percentile / 100.0 * len(values))) - 1
+    return values[min(len(values) - 1, max(0, index))]
+
+class _TaskQueue(object):
+    """A priority queue of tasks with fair share between submitters.
+
+    Tasks with higher priority are popped first. Tasks with the same
+    priority are interleaved between submitters by start-time fair
+    queueing: every task is tagged one step after the previous task of
+    its submitter, but never behind the tag of the last popped task, so a
+    submitter arriving late is not stuck behind the tasks queued by other
+    submitters. Push, pop and remove are O(log n), removed tasks are
+    dropped when they reach the top of the heap.
+    """
+    def __init__(self):
+        # Heap of [-priority, tag, sequence number, task] lists, where task
+        # is None for removed tasks
+        self._heap = []
+        self._entries = {}
+        self._tags = {}
+        self._last_tag = 0
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def push(self, task, submitter=None):
+        """Appends the given task to the queue of submitter."""
+        tag = max(self._last_tag, self._tags.get(submitter, 0)) + 1
+        self._tags[submitter] = tag
+        entry = [-task.priority, tag, next(self._sequence), task]
+        self._entries[task.id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def pop(self):
+        """Removes and returns the next task, the queue should not be
+        empty."""
+        while True:
+            entry = heapq.heappop(self._heap)
+            task = entry[3]
+            if task is not None:
+                break
+        del self._entries[task.id]
+        self._last_tag = max(self._last_tag, entry[1])
+        if len(self._tags) > MAX_SUBMITTER_TAGS:
+            self._tags = {submitter: tag
+                          for submitter, tag in self._tags.items()
+                          if tag > self._last_tag}
+        return task
+
+    def remove(self, task_id):
+        """Removes the task with the given id, returns False when it is
+        not in the queue."""
+        entry = self._entries.pop(task_id, None)
+        if entry is None:
+            return False
+        entry[3] = None
+        return True
 
 @Singleton
 class Planner(object):
@@ -11,13 +110,542 @@ class Planner(object):
     the tasks in a particular worker host. When a task is enqueued,
     a Task object is constructed and a future is returned. This future
     allow to control the operation result in an asynchronous way.
+
+    Pending tasks are sent to the engine by priority, and tasks with the
+    same priority are shared fairly between submitters, so the tasks of
+    a short dmap() call are not executed after those of a larger one
+    enqueued before.
+
+    Tasks can be given futures as arguments, building a graph of tasks:
+    they are enqueued once their arguments are finished, executed by the
+    engine with their values.
+
+    The planner runs an event loop in a background thread, started by
+    start() method. This loop sends pending tasks to the engine while it
+    is accepting tasks, and polls engine sockets waiting for replies.
+
+    With speculative execution, tasks running longer than a percentile of
+    the durations of finished tasks are executed again in free engine
+    slots. The first attempt replied gives the result of the future, and
+    the other ones are aborted.
+
+    Aborted futures remove their tasks from the queue, or abort them
+    through the engine when they are running.
+
+    Tasks failing with an error are enqueued again, after a backoff
+    delay, while they have retries left. Otherwise their futures fail
+    with a TaskError which keeps the remote traceback.
     """
 
     def __init__(self):
-        # Used in nmsg.poll() function
+        # Used in poll() function, indexed by file descriptor
         self._poll_fds = {}
         # A dictionary indexed by task id with futures related to run
         # tasks
         self._pending_futures = {}
-        self._pending_tasks = []
-        
+        self._pending_tasks = _TaskQueue()
+        # Ids of running tasks whose futures have been aborted, which
+        # should be aborted by the event loop
+        self._aborted_tasks = []
+        self._task_ids = itertools.count()
+        self._engine = None
+        self._logs_dir = None
+        self._remove_logs_dir = False
+        # Files of broadcast objects, removed by stop()
+        self._broadcast_paths = set()
+        # Futures finished with a SharedResult, loaded by stop() before the
+        # engine removes their files
+        self._shared_futures = weakref.WeakSet()
+        self._results_cache = None
+        # Results cache keys indexed by task id
+        self._cache_keys = {}
+        # Attributes used only by the event loop thread: a dictionary of
+        # [task, start time, attempts] lists indexed by task id, where
+        # attempts is the list of running tasks for the same future,
+        # durations of last finished tasks, and ids of aborted attempts
+        self._running = {}
+        self._durations = collections.deque(maxlen=DURATIONS_WINDOW)
+        self._losers = set()
+        self._speculative_percentile = None
+        # [retries left, retries done] lists indexed by task id, and a
+        # heap of (time, task id, task) tuples with failed tasks waiting
+        # for their backoff delay
+        self._task_retries = {}
+        self._retry_tasks = []
+        self._retries = 0
+        self._retry_backoff = DEFAULT_RETRY_BACKOFF
+        self._thread = None
+        self._stopping = False
+        # Protects the attributes shared between the event loop thread and
+        # the threads enqueuing tasks
+        self._lock = threading.Lock()
+        # A pipe allowing to wake up the event loop when it is waiting in
+        # poll() function
+        self._wakeup_r = None
+        self._wakeup_w = None
+
+    @property
+    def engine(self):
+        """Returns the engine given at start() or None"""
+        return self._engine
+
+    def started(self):
+        """Indicates if the planner event loop is running"""
+        return self._thread is not None
+
+    def start(self, engine, logs_dir=None, results_cache=None,
+              speculative_percentile=None, retries=0,
+              retry_backoff=DEFAULT_RETRY_BACKOFF):
+        """start(engine : EngineInterface, logs_dir=None, results_cache=None,
+                 speculative_percentile=None, retries=0,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF)
+
+        Connects the given engine and starts the event loop thread.
+
+        The stdout and stderr of every task are written into logs_dir,
+        which should be visible from the engine workers. By default a
+        temporary directory is used.
+
+        When a ResultsCache is given, tasks found in it are completed
+        without being sent to the engine, and results of finished tasks
+        are stored in it.
+
+        When speculative_percentile is given, a number between 0 and 100,
+        tasks running longer than this percentile of finished tasks
+        durations are executed again when the engine has free slots.
+
+        Failed tasks are executed again up to retries times, unless other
+        value is given to enqueue(). The n-th retry waits
+        retry_backoff * 2**(n-1) seconds.
+        """
+        if self.started():
+            raise RuntimeError("Planner has been started")
+        self._engine = engine
+        self._results_cache = results_cache
+        self._speculative_percentile = speculative_percentile
+        self._running = {}
+        self._durations.clear()
+        self._losers = set()
+        self._aborted_tasks = []
+        self._task_retries = {}
+        self._retry_tasks = []
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._cache_keys = {}
+        if logs_dir is None:
+            self._logs_dir = tempfile.mkdtemp(prefix="parxe-")
+            self._remove_logs_dir = True
+        else:
+            self._logs_dir = logs_dir
+            self._remove_logs_dir = False
+        socket = engine.connect()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._poll_fds = { socket.recv_fd : socket }
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the event loop thread and disconnects the engine.
+
+        Logs of finished tasks are removed when logs_dir was not given to
+        start() method. Files of broadcast objects are always removed.
+        Results in shared memory files not loaded yet are mapped into
+        memory before disconnecting the engine, so get() still returns
+        them.
+        """
+        if not self.started():
+            raise RuntimeError("Planner has not been started")
+        with self._lock:
+            self._stopping = True
+        self._wakeup()
+        self._thread.join()
+        self._thread = None
+        wakeup_r, wakeup_w = self._wakeup_r, self._wakeup_w
+        # _wakeup() never writes into a closed or reused descriptor
+        self._wakeup_r = self._wakeup_w = None
+        os.close(wakeup_r)
+        os.close(wakeup_w)
+        self._poll_fds = {}
+        for future in list(self._shared_futures):
+            future.get()
+        self._shared_futures = weakref.WeakSet()
+        self._engine.disconnect()
+        self._engine = None
+        self._results_cache = None
+        for path in self._broadcast_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self._broadcast_paths = set()
+        if self._remove_logs_dir:
+            shutil.rmtree(self._logs_dir, ignore_errors=True)
+
+    def enqueue(self, func, args=[], kwargs={}, retries=None, priority=0,
+                submitter=None):
+        """enqueue(func, args=[], kwargs={}, retries=None, priority=0,
+                   submitter=None) -> TaskFuture
+
+        Constructs a Task for the execution of func(*args, **kwargs) and
+        enqueues it for its execution by the engine. The returned future
+        will contain the result of the task.
+
+        When retries is None, the number of retries given to start() is
+        used. Tasks with higher priority are executed first. The engine
+        slots are shared between submitters, any hashable value, and by
+        default every thread is a different submitter.
+
+        Futures in args and kwargs, without nesting, are replaced by their
+        values, and the task waits until all of them are finished. Results
+        of other tasks in shared memory files are given to the task without
+        being loaded by the planner, and engines prefer to execute the task
+        where those tasks were executed. When any of these futures fails
+        or is aborted, so is the returned one.
+        """
+        if not self.started():
+            raise RuntimeError("Planner has not been started")
+        if submitter is None:
+            submitter = threading.current_thread().ident
+        inputs = [value for value in list(args) + kwargs.values()
+                  if isinstance(value, Future)]
+        with self._lock:
+            task = Task(next(self._task_ids), func, working_dir=os.getcwd(),
+                        args=args, kwargs=kwargs, priority=priority)
+        future = TaskFuture(task, self.abort)
+        if inputs:
+            _after_all(inputs, lambda: self._enqueue_ready(future, inputs,
+                                                           retries,
+                                                           submitter))
+            return future
+        results_cache = self._results_cache
+        key = task_key(task) if results_cache is not None else None
+        if key is not None:
+            found, result = results_cache.get(key)
+            if found:
+                task.result = result
+                future.set_as_running()
+                future._set_result(result)
+                return future
+        self._push(task, future, retries, submitter, key)
+        return future
+
+    def _push(self, task, future, retries, submitter, key=None):
+        """Appends the given task to the queue, unless its future has been
+        aborted."""
+        with self._lock:
+            if future.finished():
+                return
+            if key is not None:
+                self._cache_keys[task.id] = key
+            self._pending_futures[task.id] = future
+            self._pending_tasks.push(task, submitter)
+            self._task_retries[task.id] = [
+                self._retries if retries is None else retries, 0
+            ]
+        self._wakeup()
+
+    def _enqueue_ready(self, future, inputs, retries, submitter):
+        """Enqueues the task of future once its input futures are finished,
+        replacing them by their values."""
+        if not self.started():
+            error = RuntimeError("Planner has been stopped")
+            future._set_exception((RuntimeError, error, None))
+            return
+        for value in inputs:
+            if value.aborted():
+                future.abort()
+                return
+            if value.failed():
+                future._set_exception(value._exc_info)
+                return
+        shared = []
+        def resolve(value):
+            if isinstance(value, TaskFuture):
+                result = value._share()
+                if isinstance(result, SharedResult):
+                    shared.append(value)
+                return result
+            if isinstance(value, Future):
+                return value.get()
+            return value
+        task = future.task
+        args = [resolve(value) for value in task.args]
+        kwargs = {key: resolve(value) for key, value in task.kwargs.items()}
+        dependencies = [value.task.id for value in inputs
+                        if isinstance(value, TaskFuture)]
+        future._task = Task(task.id, task.func, working_dir=task.wd,
+                            args=args, kwargs=kwargs, priority=task.priority,
+                            dependencies=dependencies)
+        if shared:
+            # shared memory files are kept until the task is finished
+            future.add_done_callback(
+                lambda fut: [value._release() for value in shared]
+            )
+        self._push(future.task, future, retries, submitter)
+
+    def broadcast(self, obj):
+        """broadcast(obj) -> Broadcast
+
+        Stores obj into logs_dir and returns a small handle which can be
+        given to any number of tasks instead of obj, see parxe.broadcast
+        module. Tasks call get() on the handle to obtain obj, which is
+        loaded once by every worker.
+        """
+        if not self.started():
+            raise RuntimeError("Planner has not been started")
+        handle = store(obj, self._logs_dir)
+        with self._lock:
+            self._broadcast_paths.add(handle.path)
+        return handle
+
+    def abort(self, task):
+        """abort(task : Task)
+
+        Aborts the given task, called by TaskFuture.abort(). Pending tasks
+        are removed from the queue at once, running tasks are aborted by
+        the engine from the event loop and their replies are discarded, and
+        tasks waiting for a retry are removed by the event loop.
+        """
+        if not self.started():
+            raise RuntimeError("Planner has not been started")
+        with self._lock:
+            if self._pending_futures.get(task.id) is None:
+                return
+            if self._pending_tasks.remove(task.id):
+                del self._pending_futures[task.id]
+                del self._task_retries[task.id]
+                self._cache_keys.pop(task.id, None)
+                return
+            self._aborted_tasks.append(task.id)
+        self._wakeup()
+
+    def _wakeup(self):
+        """Wakes up the event loop if it is waiting in poll()"""
+        wakeup_w = self._wakeup_w
+        if wakeup_w is not None:
+            os.write(wakeup_w, b"x")
+
+    def _log_paths(self, task):
+        """Returns stdout and stderr paths of the given task"""
+        return (os.path.join(self._logs_dir, str(task.id) + STDOUT_SUFFIX),
+                os.path.join(self._logs_dir, str(task.id) + STDERR_SUFFIX))
+
+    def _dispatch(self):
+        """Executes pending tasks while the engine is accepting them.
+
+        Tasks are given to the engine in batches of its free slots, so
+        engines can submit them at once, in the order of the queue.
+        """
+        while True:
+            with self._lock:
+                num_tasks = min(len(self._pending_tasks),
+                                self._engine.get_free_slots())
+                if num_tasks <= 0:
+                    return
+                tasks = [self._pending_tasks.pop() for _ in range(num_tasks)]
+                futures = [self._pending_futures[task.id] for task in tasks]
+            batch = []
+            now = time()
+            for task, future in zip(tasks, futures):
+                stdout_path, stderr_path = self._log_paths(task)
+                future.set_stdout(stdout_path)
+                future.set_stderr(stderr_path)
+                if future.pending(): # retried tasks are running
+                    future.set_as_running()
+                self._running[task.id] = [task, now, [task]]
+                batch.append((task, stdout_path, stderr_path))
+            self._engine.execute_many(batch)
+
+    def _abort_tasks(self):
+        """Aborts through the engine every attempt of running tasks whose
+        futures have been aborted, and removes them from the retries
+        heap."""
+        with self._lock:
+            task_ids, self._aborted_tasks = self._aborted_tasks, []
+        retry_tasks = [item for item in self._retry_tasks
+                       if item[1] not in task_ids]
+        if len(retry_tasks) < len(self._retry_tasks):
+            heapq.heapify(retry_tasks)
+            self._retry_tasks = retry_tasks
+            with self._lock:
+                for task_id in task_ids:
+                    if task_id not in self._running:
+                        self._pending_futures.pop(task_id, None)
+                        self._task_retries.pop(task_id, None)
+                        self._cache_keys.pop(task_id, None)
+        for task_id in task_ids:
+            if task_id not in self._running:
+                continue # its reply has been processed
+            _, _, attempts = self._running[task_id]
+            for attempt in attempts:
+                if attempt.id not in self._losers:
+                    self._losers.add(attempt.id)
+                    self._engine.abort(attempt)
+
+    def _speculate(self):
+        """Executes again running tasks slower than the speculative
+        percentile, while the engine has free slots and no task is
+        pending."""
+        if self._speculative_percentile is None or \
+           len(self._durations) < MIN_SPECULATION_SAMPLES:
+            return
+        with self._lock:
+            if self._pending_tasks:
+                return
+            num_slots = self._engine.get_free_slots()
+        if num_slots <= 0:
+            return
+        threshold = _percentile(self._durations, self._speculative_percentile)
+        now = time()
+        # only one speculative attempt per task, the oldest tasks first
+        stragglers = sorted((start, task.id)
+                            for task, start, attempts
+                            in self._running.values()
+                            if len(attempts) == 1 and
+                            task.id not in self._losers and
+                            now - start > threshold)
+        batch = []
+        for _, task_id in stragglers[:num_slots]:
+            task, _, attempts = self._running[task_id]
+            with self._lock:
+                attempt = Task(next(self._task_ids), task.func,
+                               working_dir=task.wd, args=task.args,
+                               kwargs=task.kwargs, priority=task.priority)
+                future = self._pending_futures[task.id]
+                self._pending_futures[attempt.id] = future
+            attempts.append(attempt)
+            self._running[attempt.id] = [attempt, now, attempts]
+            batch.append((attempt,) + self._log_paths(attempt))
+        if batch:
+            self._engine.execute_many(batch)
+
+    def _enqueue_retries(self):
+        """Moves to the queue failed tasks whose backoff delay is over, as
+        tasks of a new submitter."""
+        now = time()
+        tasks = []
+        while self._retry_tasks and self._retry_tasks[0][0] <= now:
+            tasks.append(heapq.heappop(self._retry_tasks)[2])
+        if tasks:
+            with self._lock:
+                for task in tasks:
+                    self._pending_tasks.push(task)
+
+    def _retry(self, future):
+        """Schedules a new execution of the task of the given future after
+        its backoff delay, and returns False when it has no retries left."""
+        task = future.task
+        with self._lock:
+            retries = self._task_retries[task.id]
+            if retries[0] <= 0 or future.finished():
+                return False
+            retries[0] -= 1
+            retries[1] += 1
+            self._pending_futures[task.id] = future
+        delay = self._retry_backoff * 2**(retries[1] - 1)
+        heapq.heappush(self._retry_tasks, (time() + delay, task.id, task))
+        return True
+
+    def _process_reply(self, socket):
+        """Receives one reply from the given socket and finishes its future.
+
+        Replies are dictionaries with id, result, error, hash and reply
+        keys. When reply is True, the engine expects an answer through the
+        same socket. The error is None or a (type name, message, traceback)
+        tuple given by common.capture_error(). Replies of unknown tasks, as
+        repeated replies, are dropped.
+        """
+        msg = deserialize(socket)
+        if msg["reply"]:
+            serialize({"id":msg["id"]}, socket)
+        running = self._running.pop(msg["id"], None)
+        with self._lock:
+            future = self._pending_futures.pop(msg["id"], None)
+        if running is None or future is None:
+            log.warning("Dropping reply of unknown task %s", msg["id"])
+            discard(msg.get("result"))
+            return
+        task, start, attempts = running
+        attempts.remove(task)
+        self._engine.finished(task)
+        if task.id in self._losers:
+            self._losers.remove(task.id)
+            discard(msg.get("result"))
+            if not attempts:
+                with self._lock:
+                    self._task_retries.pop(future.task.id, None)
+                    self._cache_keys.pop(future.task.id, None)
+            return
+        error = msg.get("error")
+        if error is not None:
+            if attempts:
+                return # other attempts of the same task are running
+            if self._retry(future):
+                log.warning("Task %d failed with %s, retrying",
+                            future.task.id, error[0])
+                return
+        else:
+            self._durations.append(time() - start)
+        with self._lock:
+            self._task_retries.pop(future.task.id, None)
+            key = self._cache_keys.pop(future.task.id, None)
+        # the first finished attempt wins, the other ones are aborted
+        for attempt in attempts:
+            self._losers.add(attempt.id)
+            self._engine.abort(attempt)
+        if task is not future.task:
+            stdout_path, stderr_path = self._log_paths(task)
+            future.set_stdout(stdout_path)
+            future.set_stderr(stderr_path)
+        if error is not None:
+            future._set_exception((TaskError, TaskError(*error), None))
+            return
+        result = msg["result"]
+        if key is not None and not future.finished():
+            # stored before finishing the future, so it is found by
+            # tasks enqueued once the future is done
+            if isinstance(result, SharedResult):
+                result = result.load()
+            self._results_cache.put(key, result)
+        future.task.result = result
+        if not future._set_result(result):
+            discard(result) # aborted meanwhile
+        elif isinstance(result, SharedResult):
+            self._shared_futures.add(future)
+
+    def _loop(self):
+        """Event loop executed by the planner thread"""
+        poller = select.poll()
+        poller.register(self._wakeup_r, select.POLLIN)
+        for fd in self._poll_fds:
+            poller.register(fd, select.POLLIN)
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+            self._abort_tasks()
+            self._enqueue_retries()
+            self._dispatch()
+            self._speculate()
+            with self._lock:
+                pending = bool(self._pending_tasks)
+            if pending:
+                timeout = DISPATCH_INTERVAL * 1000
+            elif self._speculative_percentile is not None and self._running:
+                timeout = SPECULATION_INTERVAL * 1000
+            else:
+                timeout = None
+            if self._retry_tasks:
+                delay = max(0, self._retry_tasks[0][0] - time()) * 1000
+                timeout = delay if timeout is None else min(timeout, delay)
+            for fd, _ in poller.poll(timeout):
+                if fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 4096)
+                    continue
+                try:
+                    self._process_reply(self._poll_fds[fd])
+                except Exception:
+                    # a bad reply never stops the event loop
+                    log.exception("Error processing a reply")
+
+planner = Planner.get_instance()
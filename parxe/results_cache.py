@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""This module implements ResultsCache class.
+
+Results of tasks are stored in a directory, indexed by a hash of the task
+function and its arguments, so a task executed again, even after restarting
+the driver, can be completed without sending it to the engine."""
+
+import cPickle as pkl
+import hashlib
+import logging as log
+import os
+import tempfile
+import types
+
+from threading import Lock
+
+DEFAULT_MAX_BYTES = 1024**3 # 1GB
+RESULT_SUFFIX = ".pkl"
+# After an eviction the cache size is below this ratio of max_bytes
+EVICTION_RATIO = 0.9
+
+def _update_code_hash(h, code):
+    """Updates h with the bytecode, names and constants of code object"""
+    h.update(code.co_code)
+    h.update(repr(code.co_names))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code_hash(h, const)
+        else:
+            h.update(repr(const))
+
+def _update_func_hash(h, func):
+    """Updates h with the qualified name and the code of func"""
+    h.update(getattr(func, "__module__", None) or "")
+    h.update(getattr(func, "__name__", None) or repr(func))
+    code = getattr(func, "func_code", None)
+    if code is not None:
+        _update_code_hash(h, code)
+
+def task_key(task):
+    """task_key(task : Task) -> str or None
+
+    Returns a hexadecimal hash of task function and arguments, or None
+    when they cannot be pickled. Functions given as arguments, as in
+    dmap() chunks, are hashed with their code, so changing them changes
+    the key.
+    """
+    h = hashlib.sha1()
+    _update_func_hash(h, task.func)
+    kwargs = sorted(task.kwargs.items())
+    for arg in list(task.args) + [value for _, value in kwargs]:
+        if isinstance(arg, types.FunctionType):
+            _update_func_hash(h, arg)
+    try:
+        h.update(pkl.dumps((task.args, kwargs), pkl.HIGHEST_PROTOCOL))
+    except Exception:
+        return None
+    return h.hexdigest()
+
+class ResultsCache(object):
+    """A cache of task results stored in a directory.
+
+    The directory can be local or shared between several hosts. The cache
+    is bounded by max_bytes, evicting the least recently used results.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._num_bytes = sum(size for _, _, size in self._files())
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key + RESULT_SUFFIX)
+
+    def _files(self):
+        """Returns a list of (last use time, path, size) tuples"""
+        files = []
+        for root, _, filenames in os.walk(self._directory):
+            for filename in filenames:
+                if filename.endswith(RESULT_SUFFIX):
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, path, st.st_size))
+        return files
+
+    def get(self, key):
+        """get(key : str) -> (bool, object)
+
+        Returns (True, result) when key is found, (False, None) otherwise.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = pkl.load(f)
+            # modification time is used to sort results by last use
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, pkl.UnpicklingError):
+            return False, None
+        return True, result
+
+    def put(self, key, result):
+        """put(key : str, result)
+
+        Stores result with the given key, evicting old results if needed.
+        The file is written atomically, so concurrent drivers sharing the
+        directory never read partial results.
+        """
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.mkdir(directory)
+            except OSError:
+                pass # created by another process
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pkl.dump(result, f, pkl.HIGHEST_PROTOCOL)
+            try:
+                # the size of an overwritten result is counted no more
+                old_bytes = os.path.getsize(path)
+            except OSError:
+                old_bytes = 0
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            log.warning("Result of %s cannot be cached", key)
+            return
+        with self._lock:
+            self._num_bytes += os.path.getsize(path) - old_bytes
+            if self._num_bytes > self._max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Removes least recently used results until the cache size is
+        below EVICTION_RATIO * max_bytes."""
+        files = sorted(self._files())
+        self._num_bytes = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self._num_bytes <= EVICTION_RATIO * self._max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass # removed by another process
+            self._num_bytes -= size
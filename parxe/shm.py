@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""This module implements the shared memory transport of results.
+
+Workers running in the same host than the planner write results with large
+NumPy arrays into files of a shared memory filesystem, and reply with a
+SharedResult handle instead of the pickled result. The planner maps the
+file into memory when the result is requested, without copying it.
+Handles given as arguments of other tasks are loaded by the workers in
+the same way, so large intermediate results are not copied between
+processes."""
+
+import mmap
+import os
+import tempfile
+
+from parxe.common import dumps_out_of_band, loads_out_of_band
+
+# Directory of the POSIX shared memory filesystem in Linux hosts
+SHM_DIR = "/dev/shm"
+
+def get_shm_dir():
+    """Returns SHM_DIR when available, otherwise the temporary directory"""
+    if os.path.isdir(SHM_DIR):
+        return SHM_DIR
+    return tempfile.gettempdir()
+
+class SharedResult(object):
+    """A handle to a result stored in a file by share().
+
+    The file is removed once load() has mapped it into memory, unless
+    other processes should load it too, the mapping is released when the
+    returned arrays are garbage collected.
+    """
+    def __init__(self, path, size):
+        self._path = path
+        self._size = size
+
+    @property
+    def path(self):
+        return self._path
+
+    def load(self, remove=True):
+        """Maps the file and returns the object stored in it. The file is
+        removed when remove is True.
+
+        Arrays are copy-on-write views over the mapping, so they can be
+        modified without changing the file.
+        """
+        with open(self._path, "rb") as f:
+            data = mmap.mmap(f.fileno(), self._size, access=mmap.ACCESS_COPY)
+        if remove:
+            os.remove(self._path)
+        return loads_out_of_band(data)
+
+    def remove(self):
+        """Removes the file of a result which will never be loaded."""
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+def share(obj, directory):
+    """Stores obj into a file in the given directory when it contains large
+    NumPy arrays, returning its SharedResult handle. Otherwise obj is
+    returned as is."""
+    parts, offsets, size = dumps_out_of_band(obj)
+    if len(parts) == 2:
+        return obj
+    fd, path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        for part, offset in zip(parts, offsets):
+            f.seek(offset)
+            f.write(buffer(part))
+        f.truncate(size)
+    return SharedResult(path, size)
+
+def discard(result):
+    """Removes the file of result when it is a SharedResult."""
+    if isinstance(result, SharedResult):
+        result.remove()
+
+def load(result, remove=True):
+    """Returns the object stored by a SharedResult, or result as is when it
+    is not a SharedResult."""
+    if isinstance(result, SharedResult):
+        return result.load(remove)
+    return result
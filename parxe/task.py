@@ -1,15 +1,24 @@
 # -*- coding: utf-8 -*-
 """This module implements Task class."""
 
+from parxe.shm import load
+
 class Task(object):
     """This class is intented as a simple container of data.
     
     It principal attributes are an id value, the working directory in the
     worker host, the function to be executed, and the args and kwargs required
-    by the function. Finally, the result of the operation will be also tracked
-    by instances of this class."""
-    def __init__(self, id, func, working_dir="./", args=[], kwargs={}):
+    by the function. Pending tasks with higher priority are executed first.
+    Finally, the result of the operation will be also tracked by instances of
+    this class.
+
+    Dependencies are the ids of tasks whose results are given as arguments,
+    engines may use them to execute the task where those results are."""
+    def __init__(self, id, func, working_dir="./", args=[], kwargs={},
+                 priority=0, dependencies=()):
         self._id = id
+        self._priority = priority
+        self._dependencies = tuple(dependencies)
         self._working_dir = working_dir
         self._func = func
         self._args = args
@@ -35,6 +44,25 @@ class Task(object):
     def id(self):
         return self._id
 
+    @property
+    def priority(self):
+        return self._priority
+
+    @property
+    def dependencies(self):
+        return self._dependencies
+
+    def run(self):
+        """Executes func(*args, **kwargs) and returns its result.
+
+        Results of other tasks given as arguments by means of a shared
+        memory handle are loaded before, keeping their files for other
+        tasks."""
+        args = [load(arg, remove=False) for arg in self._args]
+        kwargs = {key: load(value, remove=False)
+                  for key, value in self._kwargs.items()}
+        return self._func(*args, **kwargs)
+
     @property
     def result(self):
         return self._result
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from unittest import TestCase
+from mock import MagicMock
+
+import parxe.aio as aio
+
+from parxe.future import Future, NonFuture
+
+VALUE = 10
+
+class TestCopyState(TestCase):
+
+    def setUp(self):
+        self.aio_future = MagicMock()
+        self.aio_future.cancelled.return_value = False
+
+    def test_result(self):
+        aio._copy_state(NonFuture(VALUE), self.aio_future)
+
+        self.aio_future.set_result.assert_called_once_with(VALUE)
+
+    def test_exception(self):
+        fut = Future(None)
+        error = ValueError()
+        fut._set_exception((ValueError, error, None))
+
+        aio._copy_state(fut, self.aio_future)
+
+        self.aio_future.set_exception.assert_called_once_with(error)
+
+    def test_aborted(self):
+        fut = Future(None)
+        fut.abort()
+
+        aio._copy_state(fut, self.aio_future)
+
+        self.aio_future.cancel.assert_called_once_with()
+        self.aio_future.set_result.assert_not_called()
+
+    def test_cancelled(self):
+        self.aio_future.cancelled.return_value = True
+
+        aio._copy_state(NonFuture(VALUE), self.aio_future)
+
+        self.aio_future.set_result.assert_not_called()
+
+@unittest.skipIf(aio.asyncio is None, "asyncio is not available")
+class TestWrapFuture(TestCase):
+
+    def setUp(self):
+        self.loop = aio.asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_wrap_future(self):
+        fut = Future(None)
+        fut.set_as_running()
+        self.loop.call_later(0.01, fut._set_result, VALUE)
+
+        aio_future = aio.wrap_future(fut, self.loop)
+
+        self.assertEqual(self.loop.run_until_complete(aio_future), VALUE)
+
+    def test_cancel(self):
+        fut = Future(None)
+
+        aio.wrap_future(fut, self.loop).cancel()
+        # runs the callbacks of the cancelled future
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+        self.assertTrue(fut.aborted())
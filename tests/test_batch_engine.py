@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import cPickle as pkl
+import os
+import shutil
+import tempfile
+import unittest
+
+from time import sleep, time
+from unittest import TestCase
+from mock import patch, MagicMock, Mock
+
+import parxe.engines.batch as batch_engine
+
+from parxe.common import serialize
+from parxe.task import Task
+
+ID = 0
+STDOUT = "/dev/null"
+STDERR = "/dev/null"
+MAX_TASKS = 2
+TIMEOUT = 5 # seconds
+
+def square(x):
+    return x**2
+
+class TestBatchEngine(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tasks_dir = os.path.join(self.directory, "tasks")
+        os.mkdir(self.tasks_dir)
+        self.environ = patch.dict(os.environ, {
+            "FAKEQ_DIR" : os.path.join(self.directory, "fakeq")
+        })
+        self.environ.start()
+        self.engine = batch_engine.get_instance()
+        self.engine.set_options({
+            batch_engine.SCHEDULER_OPTION : "fake",
+            batch_engine.MAX_TASKS_OPTION : str(MAX_TASKS),
+            batch_engine.LOST_TIMEOUT_OPTION : "0",
+            batch_engine.TASKS_DIR_OPTION : self.tasks_dir,
+            # jobs finish without executing tasks
+            batch_engine.PYTHON_OPTION : "true",
+        })
+        self.client_mock = Mock()
+        self.engine._client = self.client_mock
+        self.engine._results_uri = "tcp://localhost:5555"
+
+    def tearDown(self):
+        self.engine._cancel(self.engine._jobs.values())
+        self.engine._jobs = {}
+        self.engine._client = None
+        self.environ.stop()
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def bundle_path(self, job):
+        return os.path.join(self.tasks_dir,
+                            job.name + batch_engine.BUNDLE_SUFFIX)
+
+    def submit(self, cmd):
+        script = self.path("job.sh")
+        with open(script, "w") as f:
+            f.write(cmd + "\n")
+        return self.engine._submit(script, self.path("job.out"),
+                                   self.path("job.err"), "job")
+
+    def wait_status(self, job_id, listed):
+        t0 = time()
+        while (job_id in self.engine._status()) != listed:
+            self.assertTrue(time() - t0 < TIMEOUT)
+            sleep(0.01)
+
+    def test_fake_scheduler(self):
+        job_id = self.submit("echo hello")
+        self.wait_status(job_id, False)
+
+        with open(self.path("job.out")) as f:
+            self.assertEqual(f.read(), "hello\n")
+
+    def test_cancel(self):
+        job_id = self.submit("sleep 60")
+        self.assertEqual(self.engine._status().get(job_id), "r")
+
+        self.engine._cancel([batch_engine._Job(None, job_id, "job")])
+        self.wait_status(job_id, False)
+
+    def test_execute(self):
+        tasks = [Task(i, square, args=[i]) for i in range(MAX_TASKS)]
+        for task in tasks:
+            self.assertTrue(self.engine.accepting_tasks())
+            self.engine.execute(task, self.path("out"), self.path("err"))
+        self.assertFalse(self.engine.accepting_tasks())
+
+        bundle_path = self.bundle_path(self.engine._jobs[ID])
+        header, (task, stdout, _) = batch_engine._read_bundle(bundle_path, 0)
+        self.assertEqual((task.id, task.args), (ID, [ID]))
+        self.assertEqual(stdout, self.path("out"))
+        self.assertEqual(header["results_uri"], self.engine._results_uri)
+        self.assertFalse(header["array"])
+
+        self.engine.finished(tasks[0])
+        self.assertTrue(self.engine.accepting_tasks())
+        self.assertFalse(os.path.exists(bundle_path))
+
+    def test_execute_many(self):
+        tasks = [(Task(i, square, args=[i]), self.path("%d.out" % i),
+                  self.path("%d.err" % i)) for i in range(MAX_TASKS)]
+        self.engine.execute_many(tasks)
+        self.assertEqual(self.engine.get_free_slots(), 0)
+
+        jobs = [self.engine._jobs[i] for i in range(MAX_TASKS)]
+        self.assertEqual(len(set(job.job_id for job in jobs)), 1)
+        self.assertEqual([job.index for job in jobs], range(MAX_TASKS))
+        bundle_path = self.bundle_path(jobs[0])
+        for i in range(MAX_TASKS):
+            header, (task, _, stderr) = batch_engine._read_bundle(
+                bundle_path, i
+            )
+            self.assertEqual(task.args, [i])
+            self.assertEqual(stderr, self.path("%d.err" % i))
+        self.assertTrue(header["array"])
+        self.wait_status(jobs[0].job_id, False)
+
+        self.engine.finished(tasks[0][0])
+        self.assertTrue(os.path.exists(bundle_path))
+        self.engine.finished(tasks[1][0])
+        self.assertFalse(os.path.exists(bundle_path))
+
+    def test_lost_job(self):
+        self.client_mock.recv = MagicMock(return_value=pkl.dumps({"id":ID}))
+        task = Task(ID, square, args=[4])
+        self.engine.execute(task, self.path("out"), self.path("err"))
+        self.wait_status(self.engine._jobs[ID].job_id, False)
+
+        self.engine._update()
+        self.client_mock.send.assert_not_called()
+        self.engine._update()
+
+        reply = pkl.loads(self.client_mock.send.call_args[0][0])
+        self.assertEqual(reply["id"], ID)
+        self.assertIsNone(reply["result"])
+        self.assertEqual(reply["error"][0], "JobLost")
+        self.assertNotIn(ID, self.engine._jobs)
+        self.assertEqual(self.engine.get_free_slots(), MAX_TASKS)
+        self.assertEqual(os.listdir(self.tasks_dir), [])
+        # the job is replied only once
+        self.engine._update()
+        self.assertEqual(self.client_mock.send.call_count, 1)
+
+    def test_abort(self):
+        self.client_mock.recv = MagicMock(return_value=pkl.dumps({"id":ID}))
+        task = Task(ID, square, args=[4])
+        self.engine.execute(task, self.path("out"), self.path("err"))
+        job_id = self.engine._jobs[ID].job_id
+
+        self.engine.abort(task)
+
+        self.assertNotIn(ID, self.engine._jobs)
+        self.assertEqual(self.engine.get_free_slots(), MAX_TASKS)
+        self.assertEqual(self.engine._aborted, [task])
+        self.assertTrue(self.engine._wakeup_event.is_set())
+        self.wait_status(job_id, False)
+        self.engine._reply_error(task, batch_engine.ABORTED_ERROR)
+        reply = pkl.loads(self.client_mock.send.call_args[0][0])
+        self.assertEqual(reply["error"][0], "JobAborted")
+        self.engine._aborted = []
+        self.engine._wakeup_event.clear()
+
+    def test_lost_job_stopped(self):
+        task = Task(ID, square, args=[4])
+        self.engine.execute(task, self.path("out"), self.path("err"))
+        self.engine._stop_event.set()
+        try:
+            self.engine._reply_error(task, batch_engine.LOST_ERROR)
+        finally:
+            self.engine._stop_event.clear()
+
+        self.client_mock.send.assert_not_called()
+
+    def test_status_parsing(self):
+        output = "\n".join([
+            "job-ID  prior   name       user  state submit/start at",
+            "-----------------------------------------------------",
+            "   101 0.5 parxe-a-0  user  r   01/01/2017 10:00:00",
+            "   102 0.5 parxe-a-1  user  qw  01/01/2017 10:00:00",
+        ])
+        self.engine._scheduler = dict(batch_engine.SCHEDULERS["sge"])
+        with patch.object(self.engine, "_run", return_value=output):
+            states = self.engine._status()
+
+        self.assertEqual(states["101"], "r")
+        self.assertEqual(states["102"], "qw")
+
+    def test_array_status_parsing(self):
+        output = "\n".join(["101_[2-9] PD", "101_0 R", "101_1 R"])
+        self.engine._scheduler = dict(batch_engine.SCHEDULERS["slurm"])
+        with patch.object(self.engine, "_run", return_value=output):
+            states = self.engine._status()
+
+        self.assertEqual(states, {"101":"PD"})
+
+class TestBatchWorker(TestCase):
+
+    def test_worker_main(self):
+        fd, bundle_path = tempfile.mkstemp()
+        os.close(fd)
+        batch_engine._write_bundle(
+            bundle_path,
+            [(Task(i, square, args=[i]), STDOUT, STDERR) for i in range(3)],
+            {"results_uri":"tcp://localhost:5555", "hash":"hash",
+             "serialize":serialize, "array":False}
+        )
+        socket_mock = Mock()
+        socket_mock.recv = MagicMock(return_value=pkl.dumps({"id":ID}))
+
+        with patch('parxe.engines.batch.nmsg') as nmsg_mock:
+            nmsg_mock.Socket.return_value = socket_mock
+            batch_engine._worker_main(bundle_path, 2)
+        os.remove(bundle_path)
+
+        reply = pkl.loads(socket_mock.send.call_args[0][0])
+        self.assertEqual(reply, {"id":2, "result":4, "error":None,
+                                 "hash":"hash", "reply":True})
+        socket_mock.recv.assert_called_once()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import cPickle as pkl
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from unittest import TestCase
+
+import parxe.broadcast
+
+# parxe package exports broadcast function with the same name of its module
+broadcast = sys.modules['parxe.broadcast']
+
+OBJ = {"table": range(10000)}
+
+class TestBroadcast(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        broadcast.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        broadcast.clear()
+
+    def test_store(self):
+        handle = broadcast.store(OBJ, self.directory)
+
+        self.assertTrue(os.path.isfile(handle.path))
+        self.assertIs(handle.get(), OBJ)
+        self.assertLess(len(pkl.dumps(handle, pkl.HIGHEST_PROTOCOL)), 200)
+
+    def test_content_hash(self):
+        first = broadcast.store(OBJ, self.directory)
+        second = broadcast.store(dict(OBJ), self.directory)
+
+        self.assertEqual(first.key, second.key)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertNotEqual(broadcast.store([1], self.directory).key,
+                            first.key)
+
+    def test_worker_load(self):
+        handle = pkl.loads(pkl.dumps(broadcast.store(OBJ, self.directory)))
+        # simulates a worker process which has not loaded the object
+        broadcast.clear()
+
+        value = handle.get()
+        os.remove(handle.path)
+
+        self.assertEqual(value, OBJ)
+        self.assertIsNot(value, OBJ)
+        self.assertIs(handle.get(), value)
+
+    def test_eviction(self):
+        handles = [broadcast.store(i, self.directory)
+                   for i in range(broadcast.MAX_OBJECTS + 1)]
+        handles[0].get()
+        os.remove(handles[1].path)
+
+        with self.assertRaises(IOError):
+            handles[1].get()
+        self.assertEqual(len(broadcast._objects), broadcast.MAX_OBJECTS)
@@ -2,6 +2,9 @@
 import cPickle as pkl
 import logging as log
 import os
+import threading
+
+import numpy as np
 
 from time import time
 from unittest import TestCase
@@ -75,6 +78,18 @@ class TestCommonFunctions(TestCase):
 
         self.assertEqual(socket.data, pkl.dumps(OBJ))
 
+    def test_capture_error(self):
+        try:
+            raise ValueError("wrong value")
+        except ValueError:
+            error = common.capture_error()
+        exc = common.TaskError(*pkl.loads(pkl.dumps(error)))
+
+        self.assertEqual(exc.type_name, "ValueError")
+        self.assertEqual(exc.message, "wrong value")
+        self.assertIn("test_capture_error", exc.remote_traceback)
+        self.assertIn("ValueError: wrong value", str(exc))
+
     def test_deserialize(self):
         class MockSocket:
             def __init__(self):
@@ -87,6 +102,35 @@ class TestCommonFunctions(TestCase):
 
         self.assertEqual(obj, OBJ)
 
+    def test_serialize_out_of_band(self):
+        class MockSocket:
+            def __init__(self):
+                self.data = None
+            def send(self, data):
+                self.data = data
+            def recv(self):
+                return self.data
+        socket = MockSocket()
+        big = np.arange(common.OUT_OF_BAND_MIN_BYTES, dtype=np.float32)
+        big = big.reshape(-1, 16)
+        obj = {"id":4, "result":[big, np.asfortranarray(big), big[:3]]}
+
+        common.serialize_out_of_band(obj, socket)
+
+        self.assertTrue(buffer(socket.data)[:].startswith(
+            common.OUT_OF_BAND_MAGIC))
+        result = common.deserialize(socket)
+        self.assertEqual(result["id"], 4)
+        for expected, value in zip(obj["result"], result["result"]):
+            self.assertTrue(np.array_equal(expected, value))
+        self.assertTrue(result["result"][1].flags.f_contiguous)
+
+    def test_get_serializer(self):
+        self.assertEqual(common.get_serializer({}), common.serialize)
+        options = {common.SERIALIZER_OPTION:common.OUT_OF_BAND_SERIALIZER}
+        self.assertEqual(common.get_serializer(options),
+                         common.serialize_out_of_band)
+
 class TestWaitUntilExists(TestCase):
     def setUp(self):
         self.filename = DUMMY_FILENAME
@@ -126,3 +170,72 @@ class TestCache(TestCase):
 
         func.assert_not_called()
         self.assertEqual(result, return_value)
+
+    def test_cache_lru(self):
+        func = MagicMock(side_effect=lambda x: x**2)
+        cache = common.Cache(max_entries=2)
+
+        self.assertEqual(cache(func, 1), 1)
+        self.assertEqual(cache(func, 2), 4)
+        self.assertEqual(cache(func, 1), 1)
+        self.assertEqual(cache(func, 3), 9) # evicts 2
+        self.assertEqual(cache(func, 1), 1)
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(cache(func, 2), 4)
+        self.assertEqual(func.call_count, 4)
+        self.assertEqual(len(cache), 2)
+
+        stats = cache.stats(func)
+        self.assertEqual((stats.hits, stats.misses, stats.evictions),
+                         (2, 4, 2))
+
+    def test_cache_max_bytes(self):
+        func = MagicMock(side_effect=lambda n: np.zeros(n, dtype=np.uint8))
+        cache = common.Cache(max_entries=None, max_bytes=100)
+
+        cache(func, 60)
+        cache(func, 30)
+        cache(func, 20) # evicts 60
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats(func).evictions, 1)
+
+    def test_cache_ttl(self):
+        func = MagicMock(return_value=HELLO_WORLD_STR)
+        cache = common.Cache(ttl=10)
+
+        with patch('parxe.common.time', MagicMock(return_value=0)):
+            cache(func, 1)
+            cache(func, 1)
+        self.assertEqual(func.call_count, 1)
+        with patch('parxe.common.time', MagicMock(return_value=11)):
+            cache(func, 1)
+        self.assertEqual(func.call_count, 2)
+
+    def test_cache_concurrent(self):
+        event = threading.Event()
+        calls = []
+        def slow(x):
+            calls.append(x)
+            event.wait()
+            return x
+        cache = common.Cache()
+        threads = [threading.Thread(target=lambda: cache(slow, 1))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        event.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(cache.stats(slow).hits, 3)
+
+    def test_memoize(self):
+        func = MagicMock(return_value=HELLO_WORLD_STR)
+        func.__name__ = "func"
+        memoized = common.memoize(cache=common.Cache())(func)
+
+        self.assertEqual(memoized(1, a=2), HELLO_WORLD_STR)
+        self.assertEqual(memoized(1, a=2), HELLO_WORLD_STR)
+        func.assert_called_once_with(1, a=2)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import operator
+import sys
+import unittest
+
+from unittest import TestCase
+from mock import patch, MagicMock
+
+import parxe.dmap
+
+from parxe.future import Future, NonFuture
+
+# parxe package exports dmap function with the same name of its module
+dmap_module = sys.modules['parxe.dmap']
+
+NUM_ITEMS = 1600
+NUM_SLOTS = 4
+
+def double(x):
+    return 2*x
+
+def run_chunk(func, args, retries=None, priority=0, submitter=None):
+    """Replaces planner.enqueue() executing the chunk in place."""
+    args = [arg.get() if isinstance(arg, Future) else arg for arg in args]
+    return NonFuture(func(*args))
+
+class TestDMap(TestCase):
+
+    def setUp(self):
+        self.planner_mock = MagicMock()
+        self.planner_mock.engine.get_max_tasks.return_value = NUM_SLOTS
+        self.planner_mock.enqueue.side_effect = run_chunk
+        self.patcher = patch.object(dmap_module, 'planner',
+                                    self.planner_mock)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_chunk_size(self):
+        self.assertEqual(dmap_module._chunk_size(NUM_ITEMS, NUM_SLOTS),
+                         NUM_ITEMS / (NUM_SLOTS * dmap_module.CHUNKS_PER_SLOT))
+        self.assertEqual(dmap_module._chunk_size(3, NUM_SLOTS), 1)
+        self.assertEqual(dmap_module._chunk_size(0, NUM_SLOTS), 1)
+
+    def test_guided_chunk_sizes(self):
+        sizes = dmap_module._guided_chunk_sizes(NUM_ITEMS, NUM_SLOTS)
+        min_size = (dmap_module._chunk_size(NUM_ITEMS, NUM_SLOTS) //
+                    dmap_module.MIN_CHUNK_RATIO)
+
+        self.assertEqual(sum(sizes), NUM_ITEMS)
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertEqual(sizes[0],
+                         NUM_ITEMS / (dmap_module.GUIDED_FACTOR * NUM_SLOTS))
+        self.assertTrue(all(size >= min_size for size in sizes[:-1]))
+        self.assertEqual(dmap_module._guided_chunk_sizes(0, NUM_SLOTS), [])
+
+    def test_dmap(self):
+        result = dmap_module.dmap(double, range(NUM_ITEMS)).get()
+
+        self.assertEqual(result, map(double, range(NUM_ITEMS)))
+        self.assertEqual(
+            self.planner_mock.enqueue.call_count,
+            len(dmap_module._guided_chunk_sizes(NUM_ITEMS, NUM_SLOTS))
+        )
+
+    def test_dmap_chunksize(self):
+        result = dmap_module.dmap(double, range(NUM_ITEMS), chunksize=500)
+
+        self.assertEqual(result.get(), map(double, range(NUM_ITEMS)))
+        self.assertEqual(self.planner_mock.enqueue.call_count, 4)
+
+    def test_dmap_submitters(self):
+        dmap_module.dmap(double, range(10), chunksize=5, priority=3)
+        dmap_module.dmap(double, range(10), chunksize=5)
+
+        calls = self.planner_mock.enqueue.call_args_list
+        submitters = [kwargs["submitter"] for _, kwargs in calls]
+        self.assertEqual([kwargs["priority"] for _, kwargs in calls],
+                         [3, 3, 0, 0])
+        self.assertEqual(submitters[0], submitters[1])
+        self.assertNotEqual(submitters[1], submitters[2])
+
+    def test_dimap(self):
+        result = dmap_module.dimap(double, range(NUM_ITEMS))
+
+        self.assertTrue(self.planner_mock.enqueue.called)
+        self.assertEqual(list(result), map(double, range(NUM_ITEMS)))
+
+    def test_dreduce(self):
+        result = dmap_module.dreduce(operator.add, range(NUM_ITEMS),
+                                     fanout=4, chunksize=100)
+
+        self.assertEqual(result.get(), sum(range(NUM_ITEMS)))
+        # 16 chunks reduced by 4 tasks and the root one
+        self.assertEqual(self.planner_mock.enqueue.call_count, 16 + 4 + 1)
+
+    def test_dreduce_order(self):
+        letters = [chr(ord('a') + i % 26) for i in range(100)]
+
+        result = dmap_module.dreduce(operator.add, letters, fanout=3,
+                                     chunksize=7)
+
+        self.assertEqual(result.get(), "".join(letters))
+
+    def test_dreduce_single_chunk(self):
+        result = dmap_module.dreduce(operator.add, range(10), chunksize=10)
+
+        self.assertEqual(result.get(), 45)
+        self.assertEqual(self.planner_mock.enqueue.call_count, 1)
+
+    def test_dreduce_errors(self):
+        with self.assertRaises(TypeError):
+            dmap_module.dreduce(operator.add, [])
+        with self.assertRaises(ValueError):
+            dmap_module.dreduce(operator.add, range(10), fanout=1)
+
+    def test_dreduce_tree(self):
+        # 4 chunks, 2 reductions of two chunks and the root one
+        tasks = [Future(None) for _ in range(7)]
+        self.planner_mock.enqueue.side_effect = tasks
+
+        result = dmap_module.dreduce(operator.add, range(8), fanout=2,
+                                     chunksize=2)
+
+        calls = self.planner_mock.enqueue.call_args_list
+        self.assertEqual(len(calls), 7)
+        # partial results are given as futures, never got by the driver
+        self.assertEqual(calls[4][0][1], [operator.add] + tasks[0:2])
+        self.assertEqual(calls[6][0][1], [operator.add] + tasks[4:6])
+        tasks[6]._set_result(28)
+        self.assertEqual(result.get(), 28)
+
+    def test_dreduce_abort(self):
+        tasks = [Future(None) for _ in range(7)]
+        self.planner_mock.enqueue.side_effect = tasks
+
+        result = dmap_module.dreduce(operator.add, range(8), fanout=2,
+                                     chunksize=2)
+
+        self.assertTrue(result.abort())
+        self.assertTrue(all(fut.aborted() for fut in tasks))
+
+    def test_dmap_unordered(self):
+        result = dmap_module.dmap_unordered(double, range(NUM_ITEMS))
+
+        self.assertEqual(sorted(result), map(double, range(NUM_ITEMS)))
@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import threading
 import unittest
 
 from unittest import TestCase
 from mock import mock_open, patch, MagicMock
 
+import parxe.future as future
+
 from parxe.future import (
     Future,
     ConditionedFuture,
+    FutureAborted,
+    FutureTimeout,
     UnionFuture,
     NonFuture,
+    TaskFuture,
+    as_completed,
+    wait_all,
+    wait_any,
 )
 
 ARG = 10
@@ -54,6 +63,111 @@ class TestFuture(TestCase):
         self.assertEqual(data, DATA)
         m.assert_called_once_with(DUMMY_STDERR)
 
+    def test_stdout_log(self):
+        with patch('os.path.isfile', MagicMock(return_value=True)):
+            reader = self.fut.stdout_log()
+        self.assertEqual(reader.path, DUMMY_STDOUT)
+
+class TestUnionFutureLogs(TestCase):
+
+    def test_stdout_log(self):
+        futures = [NonFuture(i) for i in range(3)]
+        for i, fut in enumerate(futures):
+            fut._out = "output %d" % i
+        union = UnionFuture(futures)
+
+        reader = union.stdout_log()
+
+        self.assertEqual(reader.read(), "output 0\noutput 1\noutput 2")
+        self.assertEqual(reader.tail(1), ["output 2"])
+
+class TestFutureExecution(TestCase):
+
+    def test_asynchronous_construction(self):
+        event = threading.Event()
+        def wait_event(self):
+            self.set_as_running()
+            event.wait()
+            return ARG
+        fut = Future(wait_event)
+
+        self.assertTrue(fut.wait_until_running(1))
+        self.assertFalse(fut.wait(0.01))
+        event.set()
+        self.assertEqual(fut.get(), ARG)
+
+    def test_bounded_threads(self):
+        num_threads = threading.active_count()
+        futures = [NonFuture(i) for i in range(1000)]
+
+        self.assertEqual([fut.get() for fut in futures], range(1000))
+        self.assertTrue(threading.active_count() - num_threads <=
+                        future.MAX_EXECUTOR_THREADS)
+
+    def test_executor_shutdown(self):
+        executor = future._Executor(2)
+        results = []
+        for i in range(4):
+            executor.submit(results.append, i)
+        threads = list(executor._threads)
+
+        executor.shutdown()
+
+        self.assertEqual(results, range(4))
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        executor.submit(results.append, 4)
+        executor.shutdown()
+        self.assertEqual(results, range(5))
+
+    def test_exception(self):
+        def raise_error(self):
+            raise ValueError
+        fut = Future(raise_error)
+
+        self.assertTrue(fut.wait(1))
+        with self.assertRaises(ValueError):
+            fut.get()
+
+class TestFutureCallbacks(TestCase):
+
+    def test_add_done_callback(self):
+        event = threading.Event()
+        def wait_event(self):
+            event.wait()
+            return ARG
+        fut = Future(wait_event)
+        done = []
+        fut.add_done_callback(done.append)
+
+        self.assertEqual(done, [])
+        event.set()
+        fut.wait()
+        self.assertEqual(done, [fut])
+
+    def test_callback_when_finished(self):
+        fut = NonFuture(ARG)
+        done = []
+        fut.add_done_callback(done.append)
+
+        self.assertEqual(done, [fut])
+
+    def test_no_waiting_threads(self):
+        event = threading.Event()
+        def wait_event(self):
+            event.wait()
+            return 0
+        root = Future(wait_event)
+        root.wait(0.01)
+        num_threads = threading.active_count()
+        fut = root
+        for i in range(1000):
+            fut = fut + 1
+
+        self.assertEqual(threading.active_count(), num_threads)
+        self.assertFalse(fut.finished())
+        event.set()
+        self.assertEqual(fut.get(), 1000)
+
 class TestFutureOperators(TestCase):
     
     def test_add(self):
@@ -98,6 +212,76 @@ class TestFutureOperators(TestCase):
 
         self.assertEqual(f3.get(), F1_VALUE ** F2_VALUE)
 
+    def test_neg(self):
+        f1 = NonFuture(F1_VALUE)
+        f2 = Future(square, F2_VALUE)
+        f3 = -f2
+
+        self.assertEqual(f3.get(), -(F2_VALUE**2))
+        self.assertEqual((-f1).get(), -F1_VALUE)
+
+
+class TestExpressionFuture(TestCase):
+
+    def test_constant_folding(self):
+        f1 = NonFuture(F1_VALUE) + F2_VALUE
+
+        self.assertIsInstance(f1, NonFuture)
+        self.assertEqual(f1.get(), F1_VALUE + F2_VALUE)
+
+    def test_fusion(self):
+        a, b, c, d = [Future(square, x) for x in range(2, 6)]
+        for fut in (a, b, c, d):
+            fut.wait()
+
+        with patch.object(future._executor, 'submit',
+                          wraps=future._executor.submit) as submit:
+            expr = -(a*b + c) % (d + NonFuture(2) * 3)
+            self.assertIsInstance(expr, future.ExpressionFuture)
+            self.assertFalse(expr.finished())
+            result = expr.get()
+
+        self.assertEqual(submit.call_count, 1)
+        self.assertEqual(result, -(4*9 + 16) % (25 + 6))
+
+    def test_shared_subexpression(self):
+        a = Future(square, F2_VALUE)
+        b = a + 1
+        c = b * b
+
+        self.assertEqual(c.get(), (F2_VALUE**2 + 1)**2)
+        self.assertEqual(b.get(), F2_VALUE**2 + 1)
+
+    def test_shared_node_evaluated_once(self):
+        calls = []
+        def side(x):
+            calls.append(x)
+            return x
+        a = Future(square, F2_VALUE)
+        shared = a.after(side)
+        first = shared + 1
+        second = shared * 2
+
+        self.assertEqual(first.get(), F2_VALUE**2 + 1)
+        self.assertEqual(second.get(), F2_VALUE**2 * 2)
+        self.assertEqual(shared.get(), F2_VALUE**2)
+        self.assertEqual(calls, [F2_VALUE**2])
+
+    def test_aborted_root_evaluates_shared_node(self):
+        a = Future(None)
+        shared = a + 1
+        root = shared * 2
+        root.wait(0)
+
+        self.assertTrue(root.abort())
+        a._set_result(F2_VALUE)
+
+        self.assertEqual(shared.get(), F2_VALUE + 1)
+
+    def test_after(self):
+        a = Future(square, F2_VALUE)
+
+        self.assertEqual(a.after(str).get(), str(F2_VALUE**2))
 
 class TestUnionFuture(TestCase):
 
@@ -108,6 +292,114 @@ class TestUnionFuture(TestCase):
 
         self.assertEqual(f3.get(), [F1_VALUE, F2_VALUE])
 
+class TestFutureAbort(TestCase):
+
+    def test_abort(self):
+        fut = Future(None)
+
+        self.assertTrue(fut.abort())
+        self.assertFalse(fut.abort())
+        fut._set_result(ARG)
+
+        self.assertTrue(fut.finished())
+        self.assertTrue(fut.aborted())
+        with self.assertRaises(FutureAborted):
+            fut.get()
+
+    def test_failed(self):
+        fut = Future(None)
+        fut._set_exception((ValueError, ValueError(), None))
+
+        self.assertTrue(fut.failed())
+        self.assertFalse(fut.aborted())
+        fut = Future(None)
+        fut.abort()
+        self.assertFalse(fut.failed())
+
+    def test_abort_finished(self):
+        fut = NonFuture(ARG)
+
+        self.assertFalse(fut.abort())
+        self.assertFalse(fut.aborted())
+        self.assertEqual(fut.get(), ARG)
+
+    def test_conditioned_cascade(self):
+        f1 = Future(None)
+        f2 = Future(None)
+        f3 = ConditionedFuture(lambda a, b: a+b, f1, f2)
+        f4 = f3 * 2
+
+        f1.abort()
+
+        self.assertTrue(f3.aborted())
+        self.assertTrue(f4.wait(1))
+        self.assertTrue(f4.aborted())
+        self.assertFalse(f2.aborted())
+
+    def test_union_bulk_abort(self):
+        futures = [Future(None) for _ in range(3)]
+        futures[0].set_as_running()
+        futures[0]._set_result(ARG)
+        union = UnionFuture(futures + [ARG])
+
+        self.assertTrue(union.abort())
+
+        self.assertEqual([fut.aborted() for fut in futures],
+                         [False, True, True])
+        self.assertTrue(union.aborted())
+
+    def test_task_future(self):
+        abort_task = MagicMock()
+        fut = TaskFuture("task", abort_task)
+
+        fut.abort()
+        fut.abort()
+
+        abort_task.assert_called_once_with("task")
+
+class TestWaitingFunctions(TestCase):
+
+    def setUp(self):
+        self.futures = [Future(None) for _ in range(3)]
+        for fut in self.futures:
+            fut.set_as_running()
+
+    def test_as_completed(self):
+        self.futures[2]._set_result(2)
+        self.futures[0]._set_result(0)
+        generator = as_completed(self.futures + [ARG])
+
+        done = [next(generator) for _ in range(3)]
+        self.assertEqual(sorted(fut.get() for fut in done), [0, 2, ARG])
+        self.futures[1]._set_result(1)
+        self.assertIs(next(generator), self.futures[1])
+        with self.assertRaises(StopIteration):
+            next(generator)
+
+    def test_as_completed_timeout(self):
+        self.futures[1]._set_result(1)
+        generator = as_completed(self.futures, timeout=0.01)
+
+        self.assertIs(next(generator), self.futures[1])
+        with self.assertRaises(FutureTimeout):
+            next(generator)
+
+    def test_wait_any(self):
+        self.assertIsNone(wait_any(self.futures, timeout=0.01))
+        self.assertIsNone(wait_any([]))
+
+        threading.Timer(0.01, self.futures[1]._set_result, [1]).start()
+
+        self.assertIs(wait_any(self.futures, timeout=1), self.futures[1])
+
+    def test_wait_all(self):
+        self.futures[0]._set_result(0)
+        self.futures[1]._set_result(1)
+
+        self.assertFalse(wait_all(self.futures, timeout=0.01))
+        self.futures[2]._set_result(2)
+        self.assertTrue(wait_all(self.futures + [ARG], timeout=0.01))
+
 class TestConditioned(TestCase):
 
     def test_conditioned(self):
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+import cPickle as pkl
+import errno
+import os
+import signal
+import tempfile
+import unittest
+import sys
+
+import numpy as np
+
+from unittest import TestCase
+from mock import mock_open, patch, MagicMock, Mock
+
+import parxe.engines.local as local_engine
+import parxe.shm as shm
+
+from parxe.common import OUT_OF_BAND_MIN_BYTES
+from parxe.task import Task
+
+ID = 0
+STDOUT = "/dev/null"
+STDERR = "/dev/null"
+NUM_WORKERS = 2
+
+def square(x):
+    return x**2
+
+def abort_itself():
+    os.kill(os.getpid(), local_engine.ABORT_SIGNAL)
+    return 1
+
+class TestLocalEngine(TestCase):
+
+    def setUp(self):
+        self.engine = local_engine.get_instance()
+        self.engine.set_options({
+            local_engine.NUM_WORKERS_OPTION : str(NUM_WORKERS),
+            local_engine.DISPATCH_OPTION : local_engine.PUSH_DISPATCH,
+        })
+        self.tasks_mock = Mock()
+        self.engine._tasks = self.tasks_mock
+        self.engine._num_running = 0
+
+    def tearDown(self):
+        self.engine._tasks = None
+        self.engine.set_options({local_engine.DISPATCH_OPTION:
+                                 local_engine.PULL_DISPATCH})
+
+    def test_set_options(self):
+        self.assertEqual(self.engine.get_max_tasks(), NUM_WORKERS)
+
+    def test_execute(self):
+        task = Task(ID, square, args=[4])
+        self.engine.execute(task, STDOUT, STDERR)
+
+        self.tasks_mock.send.assert_called_once()
+        sent_task, stdout, stderr = pkl.loads(
+            self.tasks_mock.send.call_args[0][0]
+        )
+        self.assertEqual(sent_task.id, ID)
+        self.assertEqual((stdout, stderr), (STDOUT, STDERR))
+
+    def test_accepting_tasks(self):
+        tasks = [Task(i, square, args=[i]) for i in range(NUM_WORKERS)]
+        for task in tasks:
+            self.assertTrue(self.engine.accepting_tasks())
+            self.engine.execute(task, STDOUT, STDERR)
+        self.assertFalse(self.engine.accepting_tasks())
+        self.engine.finished(tasks[0])
+        self.assertTrue(self.engine.accepting_tasks())
+
+    def test_pull_dispatch(self):
+        self.engine.set_options({local_engine.DISPATCH_OPTION:
+                                 local_engine.PULL_DISPATCH})
+        worker_mocks = [Mock() for _ in range(NUM_WORKERS)]
+        self.engine._worker_tasks = worker_mocks
+        self.engine._idle_workers = range(NUM_WORKERS)
+        tasks = [Task(i, square, args=[i]) for i in range(NUM_WORKERS + 1)]
+        try:
+            for task in tasks[:NUM_WORKERS]:
+                self.engine.execute(task, STDOUT, STDERR)
+            self.assertEqual(self.engine.get_free_slots(), 0)
+            # the second worker finishes first and takes the next task
+            self.engine.finished(tasks[1])
+            self.engine.execute(tasks[2], STDOUT, STDERR)
+        finally:
+            self.engine._worker_tasks = []
+            self.engine._idle_workers = []
+            self.engine._task_workers = {}
+
+        self.assertEqual(worker_mocks[0].send.call_count, 1)
+        self.assertEqual(worker_mocks[1].send.call_count, 2)
+        sent_task, _, _ = pkl.loads(worker_mocks[1].send.call_args[0][0])
+        self.assertEqual(sent_task.id, 2)
+        self.tasks_mock.send.assert_not_called()
+
+    def test_locality(self):
+        self.engine.set_options({local_engine.DISPATCH_OPTION:
+                                 local_engine.PULL_DISPATCH})
+        worker_mocks = [Mock() for _ in range(NUM_WORKERS)]
+        self.engine._worker_tasks = worker_mocks
+        self.engine._idle_workers = range(NUM_WORKERS)
+        first = Task(0, square, args=[2])
+        second = Task(1, square, args=[3], dependencies=[first.id])
+        try:
+            self.engine.execute(Task(2, square, args=[1]), STDOUT, STDERR)
+            self.engine.execute(first, STDOUT, STDERR)
+            self.engine.finished(first)
+            self.engine.execute(second, STDOUT, STDERR)
+        finally:
+            self.engine._worker_tasks = []
+            self.engine._idle_workers = []
+            self.engine._task_workers = {}
+            self.engine._finished_workers.clear()
+
+        self.assertEqual(worker_mocks[1].send.call_count, 2)
+        sent_task, _, _ = pkl.loads(worker_mocks[1].send.call_args[0][0])
+        self.assertEqual(sent_task.id, second.id)
+
+    def test_abort(self):
+        self.engine.set_options({local_engine.DISPATCH_OPTION:
+                                 local_engine.PULL_DISPATCH})
+        self.engine._worker_tasks = [Mock() for _ in range(NUM_WORKERS)]
+        self.engine._idle_workers = range(NUM_WORKERS)
+        self.engine._workers = [Mock(pid=100 + i) for i in range(NUM_WORKERS)]
+        task = Task(ID, square, args=[4])
+        try:
+            self.engine.execute(task, STDOUT, STDERR)
+            with patch('os.kill') as kill_mock:
+                self.engine.abort(task)
+        finally:
+            self.engine._worker_tasks = []
+            self.engine._idle_workers = []
+            self.engine._task_workers = {}
+            self.engine._workers = []
+
+        kill_mock.assert_called_once_with(100, local_engine.ABORT_SIGNAL)
+
+    def test_run_aborted_task(self):
+        handler = signal.signal(local_engine.ABORT_SIGNAL,
+                                local_engine._abort_handler)
+        try:
+            result, error = local_engine._run_task(Task(ID, abort_itself),
+                                                   STDOUT, STDERR)
+            # signals out of tasks are ignored
+            os.kill(os.getpid(), local_engine.ABORT_SIGNAL)
+        finally:
+            signal.signal(local_engine.ABORT_SIGNAL, handler)
+
+        self.assertIsNone(result)
+        self.assertEqual(error[0], "TaskAborted")
+
+    def test_abort_while_failing(self):
+        def print_exc():
+            os.kill(os.getpid(), local_engine.ABORT_SIGNAL)
+        handler = signal.signal(local_engine.ABORT_SIGNAL,
+                                local_engine._abort_handler)
+        try:
+            with patch.object(local_engine.traceback, 'print_exc',
+                              side_effect=print_exc):
+                result, error = local_engine._run_task(
+                    Task(ID, square, args=["x"]), STDOUT, STDERR
+                )
+        finally:
+            signal.signal(local_engine.ABORT_SIGNAL, handler)
+
+        self.assertIsNone(result)
+        self.assertEqual(error[0], "TypeError")
+
+    def test_worker_loop_aborted(self):
+        tasks_mock = Mock()
+        tasks_mock.recv = MagicMock(side_effect=[
+            pkl.dumps((Task(ID, square, args=[4]), STDOUT, STDERR)),
+            pkl.dumps(None),
+        ])
+        results_mock = Mock()
+
+        with patch.object(local_engine, '_run_task',
+                          side_effect=local_engine.TaskAborted()):
+            local_engine._worker_loop(tasks_mock, results_mock, "hash")
+
+        reply = pkl.loads(results_mock.send.call_args[0][0])
+        self.assertEqual(reply["error"][0], "TaskAborted")
+
+    def test_run_failed_task(self):
+        result, error = local_engine._run_task(Task(ID, square, args=["x"]),
+                                               STDOUT, STDERR)
+
+        self.assertIsNone(result)
+        self.assertEqual(error[0], "TypeError")
+        self.assertIn("in square", error[2])
+
+    def test_worker_loop(self):
+        task = Task(ID, square, args=[4])
+        tasks_mock = Mock()
+        tasks_mock.recv = MagicMock(side_effect=[
+            pkl.dumps((task, STDOUT, STDERR)),
+            pkl.dumps(None),
+        ])
+        results_mock = Mock()
+
+        local_engine._worker_loop(tasks_mock, results_mock, "hash")
+
+        reply = pkl.loads(results_mock.send.call_args[0][0])
+        self.assertEqual(reply, {"id":ID, "result":16, "error":None,
+                                 "hash":"hash", "reply":False})
+
+    def test_worker_loop_interrupted(self):
+        class Interrupted(local_engine.nmsg.NanoMsgAPIError):
+            def __init__(self):
+                self.errno = errno.EINTR
+        task = Task(ID, square, args=[4])
+        tasks_mock = Mock()
+        tasks_mock.recv = MagicMock(side_effect=[
+            Interrupted(),
+            pkl.dumps((task, STDOUT, STDERR)),
+            pkl.dumps(None),
+        ])
+        results_mock = Mock()
+        results_mock.send = MagicMock(side_effect=[Interrupted(), None])
+
+        local_engine._worker_loop(tasks_mock, results_mock, "hash")
+
+        self.assertEqual(results_mock.send.call_count, 2)
+        reply = pkl.loads(results_mock.send.call_args[0][0])
+        self.assertEqual(reply["result"], 16)
+
+    def test_worker_loop_shared_memory(self):
+        task = Task(ID, np.ones, args=[OUT_OF_BAND_MIN_BYTES])
+        tasks_mock = Mock()
+        tasks_mock.recv = MagicMock(side_effect=[
+            pkl.dumps((task, STDOUT, STDERR)),
+            pkl.dumps(None),
+        ])
+        results_mock = Mock()
+        shm_dir = tempfile.mkdtemp()
+
+        local_engine._worker_loop(tasks_mock, results_mock, "hash",
+                                  shm_dir=shm_dir)
+
+        reply = pkl.loads(results_mock.send.call_args[0][0])
+        self.assertIsInstance(reply["result"], shm.SharedResult)
+        self.assertTrue(np.all(reply["result"].load() == 1))
+        os.rmdir(shm_dir)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import TestCase
+
+from parxe.logs import (
+    ConcatLogReader,
+    LogReader,
+    StringLogReader,
+)
+
+CHUNK_SIZE = 7
+LINES = ["line %d\n" % i for i in range(20)]
+DATA = "".join(LINES)
+
+class TestLogReader(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "0.out")
+        with open(self.path, "w") as f:
+            f.write(DATA)
+        self.reader = LogReader(self.path, chunk_size=CHUNK_SIZE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read(self):
+        self.assertEqual(self.reader.size(), len(DATA))
+        self.assertEqual(self.reader.read(), DATA)
+        self.assertEqual(self.reader.read(5, 30), DATA[5:30])
+        self.assertEqual(self.reader.read(30, 1000), DATA[30:])
+
+    def test_chunks(self):
+        chunks = list(self.reader.chunks())
+        self.assertTrue(all(len(chunk) <= CHUNK_SIZE for chunk in chunks))
+        self.assertEqual("".join(chunks), DATA)
+
+    def test_lines(self):
+        self.assertEqual(list(self.reader.lines()), LINES)
+        self.assertEqual(list(StringLogReader("a\nb", CHUNK_SIZE)),
+                         ["a\n", "b"])
+
+    def test_head_tail(self):
+        self.assertEqual(self.reader.head(3), LINES[:3])
+        self.assertEqual(self.reader.tail(3), LINES[-3:])
+        self.assertEqual(self.reader.tail(100), LINES)
+        self.assertEqual(self.reader.tail(0), [])
+
+    def test_empty(self):
+        reader = LogReader(None)
+        self.assertEqual(reader.size(), 0)
+        self.assertEqual(reader.read(), "")
+        self.assertEqual(reader.tail(), [])
+
+class TestConcatLogReader(TestCase):
+
+    def test_concat(self):
+        values = [DATA, "", "last"]
+        reader = ConcatLogReader([StringLogReader(v, CHUNK_SIZE)
+                                  for v in values], chunk_size=CHUNK_SIZE)
+        expected = "\n".join(values)
+
+        self.assertEqual(reader.size(), len(expected))
+        self.assertEqual(reader.read(), expected)
+        self.assertEqual(reader.read(100, 150), expected[100:150])
+        self.assertEqual(list(reader.lines()), expected.splitlines(True))
+        self.assertEqual(reader.tail(2), ["\n", "last"])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from time import time, sleep
+from unittest import TestCase
+from mock import patch
+
+import parxe.notifier as notifier
+
+TIMEOUT = 5 # seconds
+
+def create_file(path, delay):
+    sleep(delay)
+    open(path, "w").close()
+
+class TestFileNotifier(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "file")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def wait_created(self, file_notifier, delay=0.05):
+        thread = threading.Thread(target=create_file, args=(self.path, delay))
+        thread.start()
+        t0 = time()
+        result = file_notifier.wait(self.path, TIMEOUT)
+        thread.join()
+        return result, time() - t0
+
+    def test_existing_file(self):
+        open(self.path, "w").close()
+
+        self.assertTrue(notifier.FileNotifier().wait(self.path, 0))
+
+    def test_timeout(self):
+        self.assertFalse(notifier.FileNotifier().wait(self.path, 0.01))
+
+    def test_inotify(self):
+        file_notifier = notifier.FileNotifier(poll_step=TIMEOUT)
+        if file_notifier._fd is None:
+            raise unittest.SkipTest("inotify is not available")
+
+        result, elapsed = self.wait_created(file_notifier)
+
+        self.assertTrue(result)
+        self.assertTrue(elapsed < 1)
+        self.assertEqual(file_notifier._watches, {})
+
+    def test_network_filesystem(self):
+        mounts = [("/", "ext4"), (self.directory, "nfs")]
+        with patch('parxe.notifier._read_mounts', return_value=mounts):
+            file_notifier = notifier.FileNotifier(poll_step=0.01)
+            result, elapsed = self.wait_created(file_notifier)
+
+        self.assertTrue(result)
+        self.assertEqual(file_notifier._directories, {})
+
+    def test_is_network_filesystem(self):
+        mounts = [("/", "ext4"), ("/home", "nfs"), ("/home/local", "xfs")]
+
+        self.assertTrue(notifier.is_network_filesystem("/home/user", mounts))
+        self.assertFalse(notifier.is_network_filesystem("/homes", mounts))
+        self.assertFalse(notifier.is_network_filesystem("/home/local/a",
+                                                        mounts))
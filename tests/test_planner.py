@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+import cPickle as pkl
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from time import sleep, time
+from unittest import TestCase
+from mock import patch
+
+import numpy as np
+
+import parxe.shm as shm
+
+from parxe.common import OUT_OF_BAND_MIN_BYTES, TaskError
+from parxe.engines import EngineInterface
+from parxe.future import FutureAborted
+from parxe.planner import Planner
+from parxe.results_cache import ResultsCache
+from parxe.task import Task
+
+MAX_TASKS = 2
+TIMEOUT = 5 # seconds
+SLOW = 7
+
+# parxe package exports planner object with the same name of its module
+planner_module = sys.modules['parxe.planner']
+
+class PipeSocket(object):
+    """A fake SP socket with a file descriptor readable when a message
+    is available."""
+    def __init__(self):
+        self._messages = []
+        self.recv_fd, self._write_fd = os.pipe()
+
+    def send(self, msg):
+        self._messages.append(msg)
+        os.write(self._write_fd, b"x")
+
+    def recv(self):
+        os.read(self.recv_fd, 1)
+        return self._messages.pop(0)
+
+    def close(self):
+        os.close(self.recv_fd)
+        os.close(self._write_fd)
+
+class FakeEngine(EngineInterface):
+    """Executes the task in place and replies through a PipeSocket."""
+    def __init__(self):
+        self.socket = PipeSocket()
+        self.num_running = 0
+        self.max_running = 0
+        self.finished_tasks = []
+        self.batch_sizes = []
+
+    def connect(self):
+        return self.socket
+
+    def disconnect(self):
+        self.socket.close()
+
+    def execute(self, task, stdout_path, stderr_path):
+        self.num_running += 1
+        self.max_running = max(self.max_running, self.num_running)
+        result = task.run()
+        self.socket.send(pkl.dumps({"id":task.id, "result":result,
+                                    "hash":"hash", "reply":False}))
+
+    def execute_many(self, tasks):
+        self.batch_sizes.append(len(tasks))
+        super(FakeEngine, self).execute_many(tasks)
+
+    def finished(self, task):
+        self.num_running -= 1
+        self.finished_tasks.append(task.id)
+
+    def abort(self, task):
+        pass
+
+    def accepting_tasks(self):
+        return self.num_running < MAX_TASKS
+
+    def get_free_slots(self):
+        return MAX_TASKS - self.num_running
+
+    def get_max_tasks(self):
+        return MAX_TASKS
+
+class StragglerEngine(FakeEngine):
+    """Holds the reply of the first task with SLOW argument until it is
+    aborted."""
+    def __init__(self):
+        super(StragglerEngine, self).__init__()
+        self.held = None
+        self.held_result = None
+        self.aborted = []
+
+    def execute(self, task, stdout_path, stderr_path):
+        if task.args == [SLOW] and self.held is None:
+            self.num_running += 1
+            self.held = task
+        else:
+            super(StragglerEngine, self).execute(task, stdout_path,
+                                                 stderr_path)
+
+    def abort(self, task):
+        self.aborted.append(task.id)
+        if task is self.held:
+            self.socket.send(pkl.dumps({"id":task.id,
+                                        "result":self.held_result,
+                                        "hash":"hash", "reply":False}))
+
+class FailingEngine(FakeEngine):
+    """Replies an error for the first num_failures executions of every
+    task."""
+    def __init__(self, num_failures):
+        super(FailingEngine, self).__init__()
+        self.num_failures = num_failures
+        self.executions = {}
+
+    def execute(self, task, stdout_path, stderr_path):
+        executions = self.executions.get(task.id, 0) + 1
+        self.executions[task.id] = executions
+        if executions > self.num_failures:
+            super(FailingEngine, self).execute(task, stdout_path,
+                                               stderr_path)
+        else:
+            self.num_running += 1
+            error = ("IOError", "node failure", "Traceback ...")
+            self.socket.send(pkl.dumps({"id":task.id, "result":None,
+                                        "error":error, "hash":"hash",
+                                        "reply":False}))
+
+def square(x):
+    return x**2
+
+def power(x, y):
+    return x**y
+
+def sum_broadcast(handle, x):
+    return sum(handle.get()) + x
+
+class TestTaskQueue(TestCase):
+
+    def setUp(self):
+        self.queue = planner_module._TaskQueue()
+        self.task_ids = iter(range(1000))
+
+    def push(self, submitter, num_tasks, priority=0):
+        for _ in range(num_tasks):
+            self.queue.push(Task(next(self.task_ids), square,
+                                 priority=priority),
+                            submitter)
+
+    def pop_all(self):
+        return [self.queue.pop().id for _ in range(len(self.queue))]
+
+    def test_fifo(self):
+        self.push("a", 5)
+
+        self.assertEqual(self.pop_all(), range(5))
+
+    def test_priority(self):
+        self.push("a", 2)
+        self.push("a", 2, priority=1)
+
+        self.assertEqual(self.pop_all(), [2, 3, 0, 1])
+
+    def test_fair_share(self):
+        self.push("batch", 100)
+        self.assertEqual(self.queue.pop().id, 0)
+        self.push("interactive", 3)
+
+        self.assertEqual(self.pop_all()[:6], [1, 100, 2, 101, 3, 102])
+
+    def test_remove(self):
+        self.push("a", 3)
+
+        self.assertTrue(self.queue.remove(1))
+        self.assertFalse(self.queue.remove(1))
+
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(self.pop_all(), [0, 2])
+
+class TestPlanner(TestCase):
+
+    def setUp(self):
+        self.planner = Planner.get_instance()
+        self.engine = FakeEngine()
+        self.planner.start(self.engine)
+
+    def tearDown(self):
+        self.planner.stop()
+
+    def test_start_twice(self):
+        with self.assertRaises(RuntimeError):
+            self.planner.start(self.engine)
+
+    def test_enqueue(self):
+        futures = [self.planner.enqueue(square, [i]) for i in range(10)]
+
+        for fut in futures:
+            self.assertTrue(fut.wait(TIMEOUT))
+        self.assertEqual([fut.get() for fut in futures],
+                         [i**2 for i in range(10)])
+        self.assertEqual(len(self.engine.finished_tasks), 10)
+        self.assertTrue(self.engine.max_running <= MAX_TASKS)
+        self.assertTrue(all(size <= MAX_TASKS
+                            for size in self.engine.batch_sizes))
+        self.assertEqual(self.planner._pending_futures, {})
+
+    def test_unknown_reply(self):
+        for _ in range(2):
+            self.engine.socket.send(pkl.dumps({"id":-1, "result":None,
+                                               "hash":"hash", "reply":False}))
+        self.engine.socket.send("not a reply")
+
+        fut = self.planner.enqueue(square, [3])
+
+        self.assertEqual(fut.get(), 9)
+        self.assertTrue(self.planner.started())
+
+    def test_enqueue_stopped(self):
+        self.planner.stop()
+        try:
+            self.assertIsNone(self.planner._wakeup_w)
+            with self.assertRaises(RuntimeError):
+                self.planner.enqueue(square, [2])
+        finally:
+            self.planner.start(FakeEngine())
+
+    def test_logs_paths(self):
+        fut = self.planner.enqueue(square, [2])
+        fut.wait(TIMEOUT)
+
+        self.assertTrue(fut._stdout.startswith(self.planner._logs_dir))
+        self.assertTrue(fut._stderr.startswith(self.planner._logs_dir))
+
+class TestPlannerSpeculation(TestCase):
+
+    def setUp(self):
+        self.patcher = patch.object(planner_module, 'SPECULATION_INTERVAL',
+                                    0.01)
+        self.patcher.start()
+        self.planner = Planner.get_instance()
+        self.engine = StragglerEngine()
+        self.planner.start(self.engine, speculative_percentile=90)
+
+    def tearDown(self):
+        self.planner.stop()
+        self.patcher.stop()
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(planner_module._percentile(values, 90), 90)
+        self.assertEqual(planner_module._percentile(values, 100), 100)
+        self.assertEqual(planner_module._percentile(values, 0), 1)
+
+    def test_straggler(self):
+        num_tasks = planner_module.MIN_SPECULATION_SAMPLES
+        for fut in [self.planner.enqueue(square, [i])
+                    for i in range(num_tasks)]:
+            fut.wait(TIMEOUT)
+
+        fut = self.planner.enqueue(square, [SLOW])
+
+        self.assertTrue(fut.wait(TIMEOUT))
+        self.assertEqual(fut.get(), SLOW**2)
+        self.assertEqual(self.engine.aborted, [self.engine.held.id])
+        # logs of the future are those of the duplicate
+        self.assertNotEqual(fut._stdout,
+                            self.planner._log_paths(self.engine.held)[0])
+        # the aborted attempt is finished after its reply
+        t0 = time()
+        while len(self.engine.finished_tasks) < num_tasks + 2:
+            self.assertTrue(time() - t0 < TIMEOUT)
+            sleep(0.01)
+        self.assertEqual(self.planner._running, {})
+        self.assertEqual(self.planner._losers, set())
+
+class TestPlannerAbort(TestCase):
+
+    def setUp(self):
+        self.planner = Planner.get_instance()
+        self.engine = StragglerEngine()
+        self.planner.start(self.engine)
+
+    def tearDown(self):
+        self.planner.stop()
+
+    def test_abort_pending(self):
+        self.engine.get_free_slots = lambda: 0
+        fut = self.planner.enqueue(square, [SLOW])
+
+        self.assertTrue(fut.abort())
+        self.assertFalse(fut.abort())
+
+        self.assertEqual(len(self.planner._pending_tasks), 0)
+        self.assertEqual(self.planner._pending_futures, {})
+        with self.assertRaises(FutureAborted):
+            fut.get()
+
+    def test_abort_running(self):
+        fut = self.planner.enqueue(square, [SLOW])
+        self.assertTrue(fut.wait_until_running(TIMEOUT))
+
+        self.assertTrue(fut.abort())
+
+        self.assertTrue(fut.aborted())
+        t0 = time()
+        while self.engine.held.id not in self.engine.finished_tasks:
+            self.assertTrue(time() - t0 < TIMEOUT)
+            sleep(0.01)
+        self.assertEqual(self.engine.aborted, [self.engine.held.id])
+        self.assertEqual(self.planner._running, {})
+        self.assertEqual(self.planner._losers, set())
+        with self.assertRaises(FutureAborted):
+            fut.get()
+
+    def test_abort_shared_result(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.engine.held_result = shm.share(
+                np.arange(OUT_OF_BAND_MIN_BYTES), directory
+            )
+            fut = self.planner.enqueue(square, [SLOW])
+            self.assertTrue(fut.wait_until_running(TIMEOUT))
+
+            self.assertTrue(fut.abort())
+
+            t0 = time()
+            while self.planner._running:
+                self.assertTrue(time() - t0 < TIMEOUT)
+                sleep(0.01)
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+class TestPlannerRetries(TestCase):
+
+    def setUp(self):
+        self.planner = Planner.get_instance()
+        self.engine = FailingEngine(2)
+        self.planner.start(self.engine, retries=2, retry_backoff=0.01)
+
+    def tearDown(self):
+        self.planner.stop()
+
+    def test_retries(self):
+        futures = [self.planner.enqueue(square, [i]) for i in range(4)]
+
+        self.assertEqual([fut.get() for fut in futures],
+                         [i**2 for i in range(4)])
+        self.assertEqual(sorted(self.engine.executions.values()), [3] * 4)
+        self.assertEqual(self.planner._task_retries, {})
+
+    def test_failure(self):
+        fut = self.planner.enqueue(square, [3], retries=1)
+
+        self.assertTrue(fut.wait(TIMEOUT))
+        self.assertTrue(fut.failed())
+        with self.assertRaises(TaskError) as ctx:
+            fut.get()
+        self.assertEqual(ctx.exception.type_name, "IOError")
+        self.assertEqual(self.engine.executions.values(), [2])
+
+    def test_abort_retry(self):
+        self.planner._retry_backoff = TIMEOUT
+        fut = self.planner.enqueue(square, [3])
+        t0 = time()
+        while not self.planner._retry_tasks:
+            self.assertTrue(time() - t0 < TIMEOUT)
+            sleep(0.01)
+
+        self.assertTrue(fut.abort())
+
+        while self.planner._retry_tasks:
+            self.assertTrue(time() - t0 < TIMEOUT)
+            sleep(0.01)
+        self.assertEqual(self.planner._pending_futures, {})
+        self.assertEqual(self.planner._task_retries, {})
+
+class TestPlannerGraph(TestCase):
+
+    def setUp(self):
+        self.planner = Planner.get_instance()
+        self.engine = FailingEngine(0)
+        self.planner.start(self.engine)
+
+    def tearDown(self):
+        self.planner.stop()
+
+    def test_future_arguments(self):
+        first = self.planner.enqueue(square, [3])
+
+        second = self.planner.enqueue(power, [first], {"y": first - 7})
+
+        self.assertEqual(second.get(), 9**2)
+        self.assertEqual(second.task.args, [9])
+        self.assertEqual(second.task.dependencies, (first.task.id,))
+        self.assertEqual(self.engine.finished_tasks,
+                         [first.task.id, second.task.id])
+
+    def test_failed_argument(self):
+        self.engine.num_failures = 1
+        first = self.planner.enqueue(square, [3])
+
+        second = self.planner.enqueue(square, [first])
+
+        self.assertTrue(second.wait(TIMEOUT))
+        self.assertTrue(second.failed())
+        self.assertNotIn(second.task.id, self.engine.executions)
+
+    def test_aborted_argument(self):
+        self.engine.get_free_slots = lambda: 0
+        first = self.planner.enqueue(square, [3])
+        second = self.planner.enqueue(square, [first])
+
+        self.assertTrue(first.abort())
+
+        self.assertTrue(second.aborted())
+        self.assertEqual(len(self.planner._pending_tasks), 0)
+
+class SharedMemoryEngine(FakeEngine):
+    """Replies results with large arrays through shared memory files."""
+    def __init__(self, directory):
+        super(SharedMemoryEngine, self).__init__()
+        self.directory = directory
+
+    def execute(self, task, stdout_path, stderr_path):
+        self.num_running += 1
+        result = shm.share(task.run(), self.directory)
+        self.socket.send(pkl.dumps({"id":task.id, "result":result,
+                                    "hash":"hash", "reply":False}))
+
+    def disconnect(self):
+        super(SharedMemoryEngine, self).disconnect()
+        # as LocalEngine, results not loaded are removed
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+class TestPlannerSharedMemory(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.planner = Planner.get_instance()
+        self.planner.start(SharedMemoryEngine(self.directory))
+
+    def tearDown(self):
+        self.planner.stop()
+        shutil.rmtree(self.directory)
+
+    def test_dependent_chain(self):
+        first = self.planner.enqueue(np.ones, [OUT_OF_BAND_MIN_BYTES])
+        second = self.planner.enqueue(np.negative, [first])
+        third = self.planner.enqueue(np.sum, [second])
+
+        self.assertEqual(third.get(), -OUT_OF_BAND_MIN_BYTES)
+        t0 = time()
+        while os.listdir(self.directory):
+            self.assertTrue(time() - t0 < TIMEOUT)
+            sleep(0.01)
+        # intermediate results are still available
+        self.assertTrue(np.all(second.get() == -1))
+
+    def test_get_after_stop(self):
+        fut = self.planner.enqueue(np.ones, [OUT_OF_BAND_MIN_BYTES])
+        t0 = time()
+        while not fut.finished():
+            self.assertTrue(time() - t0 < TIMEOUT)
+            sleep(0.01)
+
+        self.planner.stop()
+        self.planner.start(SharedMemoryEngine(self.directory))
+
+        self.assertTrue(np.all(fut.get() == 1))
+
+class TestPlannerBroadcast(TestCase):
+
+    def setUp(self):
+        self.planner = Planner.get_instance()
+        self.engine = FakeEngine()
+        self.logs_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.logs_dir)
+
+    def test_broadcast(self):
+        with self.assertRaises(RuntimeError):
+            self.planner.broadcast(range(10))
+        self.planner.start(self.engine, logs_dir=self.logs_dir)
+        try:
+            handle = self.planner.broadcast(range(10))
+            fut = self.planner.enqueue(sum_broadcast, [handle, 5])
+
+            self.assertEqual(fut.get(), 50)
+            self.assertEqual(os.path.dirname(handle.path), self.logs_dir)
+        finally:
+            self.planner.stop()
+        self.assertFalse(os.path.exists(handle.path))
+
+class TestPlannerResultsCache(TestCase):
+
+    def setUp(self):
+        self.planner = Planner.get_instance()
+        self.engine = FakeEngine()
+        self.directory = tempfile.mkdtemp()
+        self.planner.start(self.engine,
+                           results_cache=ResultsCache(self.directory))
+
+    def tearDown(self):
+        self.planner.stop()
+        shutil.rmtree(self.directory)
+
+    def test_cached_result(self):
+        fut = self.planner.enqueue(square, [3])
+        self.assertEqual(fut.get(), 9)
+
+        fut = self.planner.enqueue(square, [3])
+
+        self.assertTrue(fut.finished())
+        self.assertEqual(fut.get(), 9)
+        self.assertEqual(len(self.engine.finished_tasks), 1)
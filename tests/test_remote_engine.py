@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+import cPickle as pkl
+import os
+import unittest
+
+from unittest import TestCase
+from mock import patch, MagicMock, Mock
+
+import parxe.engines.remote as remote_engine
+
+from parxe.task import Task
+
+ID = 0
+STDOUT = "/dev/null"
+STDERR = "/dev/null"
+HASH = "abcdef"
+TASKS_PORT = 6000
+CONTROL_PORT = 6100
+INFO = {"hash":HASH, "serializer":"pickle", "tasks_ports":[TASKS_PORT],
+        "control_port":CONTROL_PORT}
+
+def square(x):
+    return x**2
+
+def register(daemon, workers):
+    return {"type":remote_engine.REGISTER, "daemon":daemon,
+            "workers":workers}
+
+class FakeControl(object):
+    """Control socket of a fake daemon, readable through a pipe while it
+    has messages."""
+    def __init__(self):
+        self.recv_fd, self._write_fd = os.pipe()
+        self._messages = []
+
+    def send(self, msg):
+        self._messages.append(msg)
+        os.write(self._write_fd, "x")
+
+    def recv(self):
+        os.read(self.recv_fd, 1)
+        return self._messages.pop(0)
+
+    def close(self):
+        os.close(self.recv_fd)
+        os.close(self._write_fd)
+
+class TestRemoteEngine(TestCase):
+
+    def setUp(self):
+        self.engine = remote_engine.get_instance()
+        self.engine.set_options({remote_engine.HEARTBEAT_TIMEOUT_OPTION:
+                                 "10"})
+        # every daemon tasks socket is a new mock
+        self.nmsg_patcher = patch.object(remote_engine, 'nmsg')
+        self.nmsg_mock = self.nmsg_patcher.start()
+        self.nmsg_mock.Socket.side_effect = lambda *args: Mock()
+        self.port_patcher = patch.object(remote_engine, '_free_port',
+                                         side_effect=range(TASKS_PORT, 7000))
+        self.port_patcher.start()
+        self.lost_mock = Mock()
+        self.engine._lost = self.lost_mock
+        self.engine._daemons = {}
+        self.engine._task_daemons = {}
+        self.engine._finished_workers.clear()
+        self.engine._removed_sockets = []
+
+    def tearDown(self):
+        self.nmsg_patcher.stop()
+        self.port_patcher.stop()
+        self.engine._lost = None
+        self.engine._daemons = {}
+        self.engine._task_daemons = {}
+        self.engine._removed_sockets = []
+
+    def lost_replies(self):
+        return [pkl.loads(call[0][0])
+                for call in self.lost_mock.send.call_args_list]
+
+    def test_registration(self):
+        self.assertEqual(self.engine.get_max_tasks(), 0)
+        self.assertFalse(self.engine.accepting_tasks())
+
+        answer = self.engine._handle_message(register("a:1", 4), 0)
+        self.engine._handle_message(register("b:2", 2), 0)
+
+        self.assertEqual(answer["hash"], self.engine._hash)
+        self.assertEqual(answer["control_port"], TASKS_PORT + 4)
+        self.assertEqual(answer["tasks_ports"], range(TASKS_PORT,
+                                                      TASKS_PORT + 4))
+        self.assertEqual(self.engine.get_max_tasks(), 6)
+        # a heartbeat keeps the tasks ports
+        answer = self.engine._handle_message(register("a:1", 4), 1)
+        self.assertEqual(answer["tasks_ports"], range(TASKS_PORT,
+                                                      TASKS_PORT + 4))
+        self.assertEqual(self.engine.get_daemons(), {"a:1":4, "b:2":2})
+
+        self.engine._handle_message({"type":remote_engine.UNREGISTER,
+                                     "daemon":"b:2"}, 1)
+        self.assertEqual(self.engine.get_max_tasks(), 4)
+
+    def test_expire(self):
+        self.engine._handle_message(register("a:1", 4), 0)
+        self.engine._handle_message(register("b:2", 2), 0)
+        # heartbeat of a:1
+        self.engine._handle_message(register("a:1", 4), 8)
+
+        self.engine._expire(15)
+
+        self.assertEqual(self.engine.get_daemons(), {"a:1":4})
+
+    def test_execute(self):
+        self.engine._handle_message(register("a:1", 2), 0)
+        tasks = [Task(i, square, args=[i]) for i in range(2)]
+        for task in tasks:
+            self.assertTrue(self.engine.accepting_tasks())
+            self.engine.execute(task, STDOUT, STDERR)
+        self.assertFalse(self.engine.accepting_tasks())
+
+        # every worker pulls from its own socket
+        for worker, tasks_mock in enumerate(self.engine._daemons["a:1"].tasks):
+            sent_task, _, _ = pkl.loads(tasks_mock.send.call_args[0][0])
+            self.assertEqual(sent_task.id, worker)
+        self.engine.finished(tasks[0])
+        self.assertEqual(self.engine.get_free_slots(), 1)
+
+    def test_execute_dependency_worker(self):
+        self.engine._handle_message(register("a:1", 2), 0)
+        self.engine._handle_message(register("b:2", 2), 0)
+        first = Task(ID, square, args=[2])
+        self.engine.execute(first, STDOUT, STDERR)
+        daemon_id = self.engine._task_daemons[ID]
+        worker = self.engine._daemons[daemon_id].running[ID]
+        self.engine.finished(first)
+
+        second = Task(1, square, args=[4], dependencies=[ID])
+        self.engine.execute(second, STDOUT, STDERR)
+
+        self.assertEqual(self.engine._task_daemons[1], daemon_id)
+        self.assertEqual(self.engine._daemons[daemon_id].running[1], worker)
+        self.assertEqual(self.engine.get_free_slots(), 3)
+
+    def test_expire_running_tasks(self):
+        self.engine._handle_message(register("a:1", 1), 0)
+        self.engine._handle_message(register("b:2", 1), 0)
+        tasks = [Task(i, square, args=[i]) for i in range(2)]
+        for task in tasks:
+            self.engine.execute(task, STDOUT, STDERR)
+        lost_daemon = self.engine._task_daemons[ID]
+        lost_socket = self.engine._daemons[lost_daemon].tasks[0]
+        self.engine._handle_message(register(self.engine._task_daemons[1],
+                                             1), 10)
+
+        self.engine._expire(15)
+
+        replies = self.lost_replies()
+        self.assertEqual([reply["id"] for reply in replies], [ID])
+        self.assertEqual(replies[0]["error"][0],
+                         remote_engine.LOST_ERROR_TYPE)
+        self.engine.finished(tasks[ID])
+        self.assertEqual(self.engine.get_max_tasks(), 1)
+        self.assertEqual(self.engine.get_free_slots(), 0)
+        # the socket is closed by the thread sending tasks
+        lost_socket.close.assert_not_called()
+        self.engine.finished(tasks[1])
+        self.engine.execute(Task(2, square, args=[2]), STDOUT, STDERR)
+        lost_socket.close.assert_called_once_with()
+
+    def test_unregister_running_tasks(self):
+        self.engine._handle_message(register("a:1", 2), 0)
+        self.engine.execute(Task(ID, square, args=[2]), STDOUT, STDERR)
+
+        self.engine._handle_message({"type":remote_engine.UNREGISTER,
+                                     "daemon":"a:1"}, 1)
+
+        self.assertEqual([reply["id"] for reply in self.lost_replies()],
+                         [ID])
+        self.assertEqual(self.engine._task_daemons, {})
+
+    def test_abort(self):
+        self.engine._handle_message(register("a:1", 2), 0)
+        for i in range(2):
+            self.engine.execute(Task(i, square, args=[i]), STDOUT, STDERR)
+        control_mock = self.engine._daemons["a:1"].control
+
+        self.engine.abort(Task(1, square, args=[1]))
+        # finished tasks are not aborted
+        self.engine.abort(Task(2, square, args=[2]))
+
+        self.assertEqual(control_mock.send.call_count, 1)
+        self.assertEqual(pkl.loads(control_mock.send.call_args[0][0]),
+                         {"worker":1})
+        # the worker replies the task, which is then finished
+        self.assertEqual(self.engine.get_free_slots(), 0)
+
+    def test_abort_fake_daemon(self):
+        self.engine._handle_message(register("a:1", 2), 0)
+        for i in range(2):
+            self.engine.execute(Task(i, square, args=[i]), STDOUT, STDERR)
+        control = FakeControl()
+        self.engine._daemons["a:1"].control = control
+        workers = [Mock(pid=100 + i) for i in range(2)]
+
+        self.engine.abort(Task(1, square, args=[1]))
+        try:
+            with patch.object(remote_engine.os, 'kill') as kill_mock:
+                remote_engine._serve_control(control, workers, 0.1)
+        finally:
+            control.close()
+
+        kill_mock.assert_called_once_with(101, remote_engine.ABORT_SIGNAL)
+
+    def test_execute_without_daemons(self):
+        self.engine.execute(Task(ID, square, args=[2]), STDOUT, STDERR)
+
+        self.assertEqual([reply["id"] for reply in self.lost_replies()],
+                         [ID])
+
+class TestRemoteDaemon(TestCase):
+
+    @patch('parxe.engines.remote._serve_control')
+    @patch('parxe.engines.remote.subprocess.Popen')
+    @patch('parxe.engines.remote.nmsg')
+    def test_daemon_registered_again(self, nmsg_mock, popen_mock,
+                                     serve_mock):
+        answers = [INFO, dict(INFO, tasks_ports=[TASKS_PORT + 1]), None,
+                   None]
+        requests = []
+        def request(socket, msg):
+            requests.append(msg)
+            return answers[len(requests) - 1]
+
+        with patch('parxe.engines.remote._request', side_effect=request):
+            remote_engine._daemon_main("localhost", 5995, 1, once=True)
+
+        self.assertEqual(popen_mock.call_count, 2)
+        self.assertEqual(popen_mock.call_args[0][0][-4],
+                         "tcp://localhost:%d" % (TASKS_PORT + 1))
+
+    @patch('parxe.engines.remote._serve_control')
+    @patch('parxe.engines.remote.subprocess.Popen')
+    @patch('parxe.engines.remote.nmsg')
+    def test_daemon(self, nmsg_mock, popen_mock, serve_mock):
+        info = dict(INFO, tasks_ports=range(TASKS_PORT, TASKS_PORT + 3))
+        requests = []
+        def request(socket, msg):
+            requests.append(msg)
+            # registration, one heartbeat, and then the engine is lost
+            return [info, info, None, None][len(requests) - 1]
+
+        with patch('parxe.engines.remote._request', side_effect=request):
+            remote_engine._daemon_main("localhost", 5995, 3, once=True)
+
+        self.assertEqual(popen_mock.call_count, 3)
+        for worker, call in enumerate(popen_mock.call_args_list):
+            self.assertEqual(call[0][0][-4:],
+                             ["tcp://localhost:%d" % (TASKS_PORT + worker),
+                              "tcp://localhost:5996", HASH, "pickle"])
+        self.assertEqual(popen_mock.return_value.terminate.call_count, 3)
+        self.assertEqual([msg["type"] for msg in requests],
+                         [remote_engine.REGISTER] * 3)
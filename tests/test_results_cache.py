@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import TestCase
+
+from parxe.results_cache import ResultsCache, task_key
+from parxe.task import Task
+
+RESULT = {"data":range(100)}
+
+def square(x):
+    return x**2
+
+def cube(x):
+    return x**3
+
+class TestTaskKey(TestCase):
+
+    def test_stable(self):
+        self.assertEqual(task_key(Task(0, square, args=[2])),
+                         task_key(Task(1, square, args=[2])))
+
+    def test_args(self):
+        self.assertNotEqual(task_key(Task(0, square, args=[2])),
+                            task_key(Task(0, square, args=[3])))
+        self.assertNotEqual(task_key(Task(0, square, kwargs={"x":2})),
+                            task_key(Task(0, square, kwargs={"x":3})))
+
+    def test_code(self):
+        key = task_key(Task(0, square, args=[2]))
+        map_key = task_key(Task(0, map, args=[square, [2]]))
+        # simulates a change in the code of square function
+        code = square.func_code
+        square.func_code = cube.func_code
+        try:
+            new_key = task_key(Task(0, square, args=[2]))
+            new_map_key = task_key(Task(0, map, args=[square, [2]]))
+        finally:
+            square.func_code = code
+
+        self.assertNotEqual(key, new_key)
+        self.assertIsNotNone(map_key)
+        self.assertNotEqual(map_key, new_map_key)
+
+    def test_not_picklable(self):
+        self.assertIsNone(task_key(Task(0, map, args=[lambda x: x, [2]])))
+
+class TestResultsCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_put(self):
+        cache = ResultsCache(self.directory)
+        key = task_key(Task(0, square, args=[2]))
+
+        self.assertEqual(cache.get(key), (False, None))
+        cache.put(key, RESULT)
+        self.assertEqual(cache.get(key), (True, RESULT))
+        self.assertEqual(ResultsCache(self.directory).get(key),
+                         (True, RESULT))
+
+    def test_eviction(self):
+        cache = ResultsCache(self.directory, max_bytes=1000)
+        keys = [task_key(Task(0, square, args=[i])) for i in range(5)]
+        for i, key in enumerate(keys):
+            cache.put(key, "x" * 300)
+            # sets a different last use time for every result
+            os.utime(cache._path(key), (i, i))
+
+        found = [cache.get(key)[0] for key in keys]
+        self.assertEqual(found, [False, False, True, True, True])
+
+    def test_overwrite(self):
+        cache = ResultsCache(self.directory, max_bytes=1000)
+        key = task_key(Task(0, square, args=[2]))
+        for _ in range(5):
+            cache.put(key, "x" * 300)
+
+        self.assertEqual(cache._num_bytes,
+                         os.path.getsize(cache._path(key)))
+        self.assertEqual(cache.get(key), (True, "x" * 300))
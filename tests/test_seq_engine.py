@@ -35,6 +35,17 @@ class TestSeqEngine(TestCase):
     #    socket = self.engine.connect()
     #    self.assertIsInstance(socket, nmsg.Socket)
 
+    def test_execute_error(self):
+        def fail():
+            raise ValueError("wrong value")
+
+        self.engine.execute(Task(ID, fail), STDOUT, STDERR)
+
+        reply = pkl.loads(self.client_mock.send.call_args[0][0])
+        self.assertIsNone(reply["result"])
+        self.assertEqual(reply["error"][:2], ("ValueError", "wrong value"))
+        self.engine._running = False
+
     def test_execute(self):
         def func(x):
             return x**2
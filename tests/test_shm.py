@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from unittest import TestCase
+
+import parxe.shm as shm
+
+from parxe.common import OUT_OF_BAND_MIN_BYTES
+from parxe.future import TaskFuture
+from parxe.task import Task
+
+class TestShm(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.big = np.arange(OUT_OF_BAND_MIN_BYTES, dtype=np.float64)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_share_small(self):
+        obj = {"small": np.arange(10)}
+
+        self.assertIs(shm.share(obj, self.directory), obj)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_share(self):
+        obj = [1, self.big, np.asfortranarray(self.big.reshape(-1, 8))]
+
+        result = shm.share(obj, self.directory)
+
+        self.assertIsInstance(result, shm.SharedResult)
+        self.assertTrue(os.path.isfile(result.path))
+        value = shm.load(result)
+        self.assertFalse(os.path.exists(result.path))
+        self.assertEqual(value[0], 1)
+        self.assertTrue(np.array_equal(value[1], obj[1]))
+        self.assertTrue(np.array_equal(value[2], obj[2]))
+        value[1][0] = -1
+        self.assertEqual(value[1][0], -1)
+
+    def test_discard(self):
+        result = shm.share(self.big, self.directory)
+
+        shm.discard(result)
+        shm.discard(result)
+        shm.discard(self.big)
+
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_task_run(self):
+        result = shm.share(self.big, self.directory)
+        task = Task(0, np.sum, args=[result])
+
+        self.assertEqual(task.run(), self.big.sum())
+        self.assertTrue(os.path.isfile(result.path))
+
+    def test_task_future_share(self):
+        fut = TaskFuture(Task(0, None))
+        fut.set_as_running()
+        fut._set_result(shm.share(self.big, self.directory))
+
+        result = fut._share()
+        self.assertIsInstance(result, shm.SharedResult)
+        self.assertTrue(np.array_equal(fut.get(), self.big))
+        self.assertTrue(os.path.isfile(result.path))
+        fut._release()
+        self.assertFalse(os.path.exists(result.path))
+
+    def test_task_future(self):
+        fut = TaskFuture(Task(0, None))
+        fut.set_as_running()
+        fut._set_result(shm.share(self.big, self.directory))
+
+        self.assertTrue(np.array_equal(fut.get(), self.big))
+        self.assertIs(fut.get(), fut.get())